@@ -6,193 +6,305 @@ Module for performing analysis/plotting for the report.
 # IMPORTS
 
 # Standard library:
+import argparse
 import json
+import logging
+import os
 
 # Installed packages:
+# NOTE: matplotlib, scipy.stats and plotly (through choropleth) are
+# imported by the functions that draw, so that loading and crunching the
+# data doesn't pay for the plotting stack.
 import pandas as pd
 import numpy as np
-import plotly.offline
-import plotly.figure_factory as ff
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.offsetbox import AnchoredText
-from sklearn.metrics import r2_score
-from scipy.stats import pearsonr, spearmanr
 
 # Project imports:
+import columnar_cache
+import correlation
+import county_tables
+import crosswalk
+import data_stages
+import feature_store
+import figure_build
+import fipsZipHandler
+import fitting
+import instrument
+import key_codec
+import metric_cube
+import pipeline
 import read_atlas_data
+import read_cdc
 import read_irs
+import spatial
+import weighted_stats
+from fipsZipHandler import FipsZipHandler
 
 ########################################################################
 # TWEAK MATPLOTLIB FOR IEEE STYLE
-mpl.rcParams['axes.titlesize'] = 8
-mpl.rcParams['axes.labelsize'] = 6
-mpl.rcParams['legend.fontsize'] = 6
-mpl.rcParams['font.family'] = 'serif'
-mpl.rcParams['font.serif'] = 'Times New Roman'
-mpl.rcParams['xtick.labelsize'] = 6
-mpl.rcParams['ytick.labelsize'] = 6
-mpl.rcParams['figure.figsize'] = (3.5, 1.64)
-# mpl.rcParams['lines.markersize'] = 2
-# mpl.rcParams['lines.markeredgewidth'] = 0.5
-mpl.rcParams['figure.dpi'] = 300
+# Applied to mpl.rcParams by pyplot(), i.e. only once something is drawn.
+STYLE = {'axes.titlesize': 8,
+         'axes.labelsize': 6,
+         'legend.fontsize': 6,
+         'font.family': 'serif',
+         'font.serif': 'Times New Roman',
+         'xtick.labelsize': 6,
+         'ytick.labelsize': 6,
+         'figure.figsize': (3.5, 1.64),
+         # 'lines.markersize': 2,
+         # 'lines.markeredgewidth': 0.5,
+         'figure.dpi': 300}
 
 # Font manager for text boxes
 FONT_PROPERTIES = {'family': 'serif', 'size': 5}
 
+# Columns correlated and fitted by the 'correlations' and 'fits' pipeline
+# stages (and tested for spatial autocorrelation by 'spatial').
+HEALTH_COLUMNS = ['PCT_OBESE_ADULTS13', 'PCT_DIABETES_ADULTS13']
+INCOME_COLUMNS = ['N1_pct_of_FIPS', 'total_people_pct_of_FIPS',
+                  'agi_per_person']
+
+# Scatters with more points than this (e.g. ZIP level or multi-year data)
+# are drawn as a single density raster per axis instead of one marker
+# per point, binned into a DENSITY_BINS x DENSITY_BINS grid.
+DENSITY_THRESHOLD = 20000
+DENSITY_BINS = 200
+
 ########################################################################
 # FUNCTIONS
 
 
+def pyplot():
+    """Import matplotlib.pyplot with STYLE applied."""
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    mpl.rcParams.update(STYLE)
+    return plt
+
+
+def build_pipeline(**irs_params):
+    """Declare the data stages behind the report's figures.
+
+    irs_params are passed on to read_irs.get_irs_data. With years, the
+    IRS, feature store, join and mean/median stages hold every year (see
+    data_stages), and the county tables, cube, statistics and figures
+    are those of the report year: IRS_YEAR, or the latest year if it
+    isn't among them.
+    """
+    fz_files = [FipsZipHandler.dataFilePrefix + f
+                for f in (FipsZipHandler.fipsToZipFile,
+                          FipsZipHandler.zipToFipsFile,
+                          FipsZipHandler.fipsToNameAndStateFile)]
+    irs_code = [read_irs, crosswalk, columnar_cache, fipsZipHandler,
+                key_codec]
+    cube_code = [metric_cube, county_tables, key_codec]
+    # The CDC tables and the old joined file are optional inputs of the
+    # feature store.
+    cdc_inputs = ['cdc_data'] if read_cdc.data_files() else []
+    joined_files = [f for f in [county_tables.JOINED_FILE]
+                    if os.path.exists(f)]
+
+    years = irs_params.get('years')
+    if years:
+        irs_files = [read_irs.irs_file_path(y) for y in sorted(set(years))]
+    else:
+        irs_files = [read_irs.IRS_FILE_PATH]
+
+    # The single year stages read the report year's rows.
+    joined = 'joined_data'
+    mean_median = 'mean_median_data'
+    year_stages = []
+    if years:
+        year = (read_irs.IRS_YEAR if read_irs.IRS_YEAR in years
+                else max(years))
+        joined = 'report_joined_data'
+        mean_median = 'report_mean_median_data'
+        year_stages = [
+            pipeline.Stage(joined, data_stages.select_year,
+                           inputs=['joined_data'], params={'year': year},
+                           code=[data_stages]),
+            pipeline.Stage(mean_median, data_stages.select_year,
+                           inputs=['mean_median_data'],
+                           params={'year': year}, code=[data_stages]),
+        ]
+
+    return pipeline.Pipeline([
+        pipeline.Stage('irs_data', read_irs.get_irs_data, params=irs_params,
+                       files=irs_files + fz_files, code=irs_code),
+        pipeline.Stage('atlas_data', read_atlas_data.read_data,
+                       files=[read_atlas_data.HEALTH_DATA_COUNTY_FILE,
+                              read_atlas_data.HEALTH_DATA_STATE_FILE],
+                       code=[read_atlas_data, columnar_cache, key_codec]),
+        pipeline.Stage('cdc_data', read_cdc.read_data,
+                       files=read_cdc.data_files()),
+        pipeline.Stage('feature_store', data_stages.build_store,
+                       inputs=['irs_data', 'atlas_data'] + cdc_inputs,
+                       files=fz_files + joined_files,
+                       code=[data_stages, feature_store, fipsZipHandler,
+                             key_codec, read_cdc, county_tables,
+                             columnar_cache, weighted_stats]),
+        pipeline.Stage('joined_data', data_stages.join_data,
+                       inputs=['irs_data', 'feature_store'],
+                       code=[data_stages, feature_store, key_codec]),
+        pipeline.Stage('mean_median_data',
+                       data_stages.compute_mean_medians,
+                       inputs=['joined_data'],
+                       code=[data_stages, weighted_stats, key_codec]),
+    ] + year_stages + [
+        pipeline.Stage('county_tables', county_tables.split,
+                       inputs=[mean_median],
+                       params={'county_columns':
+                               county_tables.COUNTY_COLUMNS},
+                       code=[county_tables, key_codec]),
+        pipeline.Stage('metric_cube', metric_cube.from_tables,
+                       inputs=['county_tables'], code=cube_code),
+        pipeline.Stage('state_comparison', data_stages.compare_states,
+                       inputs=['metric_cube', 'atlas_data'],
+                       params={'health_columns': HEALTH_COLUMNS},
+                       code=[data_stages] + cube_code),
+        pipeline.Stage('correlations', correlation.correlate,
+                       inputs=[joined],
+                       params={'health_columns': HEALTH_COLUMNS,
+                               'income_columns': INCOME_COLUMNS}),
+        pipeline.Stage('fits', fitting.fit_polynomials,
+                       inputs=[joined],
+                       params={'health_columns': HEALTH_COLUMNS,
+                               'income_columns': INCOME_COLUMNS}),
+        pipeline.Stage('spatial', spatial.moran_table,
+                       inputs=[joined], files=fz_files,
+                       params={'columns': HEALTH_COLUMNS + INCOME_COLUMNS,
+                               'county_columns': HEALTH_COLUMNS},
+                       code=[spatial, crosswalk, fipsZipHandler,
+                             key_codec]),
+    ])
+
+
 def main():
     """Main function"""
-    # Read the IRS data
-    irs_data = read_irs.get_irs_data()
+    # Load (or compute) the data stages. Stages whose inputs, parameters
+    # and code haven't changed since the last run come from the cache.
+    tables = build_pipeline().run(targets=['county_tables'])['county_tables']
 
     # Notify.
     print('IRS data loaded. Column descriptions:')
     print(json.dumps(read_irs.COLUMNS, indent=2))
 
-    # Read Food Environment Atlas data
-    food_county, food_state = read_atlas_data.read_data()
-    print('Food Environment Atlas data loaded.')
-
-    # Check to see if the county data has duplicate FIPS codes. Turns
-    # out it doesn't.
-    # county_duplicate_fips = food_county.duplicated()
-    # print(county_duplicate_fips.any())
-
-    # Join the IRS data and county Food Environment Atlas data by FIPS
-    # code. Since the IRS data has multiple entries per FIPS code, we'll
-    # join on the IRS data
-    joined_data = irs_data.join(food_county.set_index('FIPS'), on='FIPS')
-
-    # How many NaN's do we have?
-    total_rows = joined_data.shape[0]
-    nan_rows = joined_data.isnull().sum().max()
-    joined_data.dropna(inplace=True)
-    print('In the joined data, {} rows were be dropped out of {}.'.format(
-        nan_rows, total_rows))
-
     # Create maps for the various health factors.
-    # map_plots(joined_data)
+    # map_plots(tables)
 
-    # Create scatter plots:
-
-    # Plot pct obese vs. pct of tax returns filed in each agi_stub
-    scatter_plots(joined_data, health_column='PCT_OBESE_ADULTS13',
-                  income_column='N1_pct_of_FIPS', ylabel='Pct. Obese',
-                  filename='obese_scatter_N1')
-
-    # pct obese vs. pct of total people in each agi_stub
-    scatter_plots(joined_data, health_column='PCT_OBESE_ADULTS13',
-                  income_column='total_people_pct_of_FIPS',
-                  ylabel='Pct. Obese',
-                  filename='obese_scatter_total_people')
-
-    # pct diabetes vs. pct of tax returns filed in each agi_stub
-    scatter_plots(joined_data, health_column='PCT_DIABETES_ADULTS13',
-                  income_column='N1_pct_of_FIPS', ylabel='Pct. Diabetes',
-                  filename='diabetes_scatter_N1')
-
-    # pct diabetes vs. pct of total people in each agi_stb
-    scatter_plots(joined_data, health_column='PCT_DIABETES_ADULTS13',
-                  income_column='total_people_pct_of_FIPS',
-                  ylabel='Pct. Diabetes',
-                  filename='diabetes_scatter_total_people')
-
-    # Compute approximate mean and median income per person in each FIPS
-    # code, and create scatter plots with diabetes/obesity.
-    scatter_mean_medians(joined_data)
+    # Create scatter plots. Only figures whose data or styling changed
+    # since the last build are re-rendered, in parallel.
+    built = figure_build.build(figure_jobs(tables))
+    print('Rendered {} figure(s).'.format(len(built)))
 
     pass
 
 
-def map_plots(data):
-    """Do map plotting.
+@instrument.stage()
+def map_plots(tables, filename='maps.html'):
+    """Map the low income share, diabetes and obesity by county.
 
-    plotly reference: https://plot.ly/python/county-choropleth/
+    tables are the county_tables.CountyTables of the joined data. All
+    three layers share one cached set of county geometries and are
+    written to a single HTML file with a drop-down to switch layers.
+    """
+    agi1_data = tables.stub(1, ['total_people_pct_of_FIPS',
+                                'PCT_DIABETES_ADULTS13',
+                                'PCT_OBESE_ADULTS13'])
+    layers = {
+        'Pct. of People in $1-$25k AGI Bracket':
+            agi1_data['total_people_pct_of_FIPS'] * 100,
+        'Pct. of Adults with Diabetes': agi1_data['PCT_DIABETES_ADULTS13'],
+        'Pct. of Obese Adults': agi1_data['PCT_OBESE_ADULTS13'],
+    }
+    import choropleth
+    choropleth.render(key_codec.decode(agi1_data['FIPS'],
+                                       key_codec.FIPS_WIDTH),
+                      layers, filename)
+
+
+def plot_points(ax, x, y, density_threshold=DENSITY_THRESHOLD,
+                density_bins=DENSITY_BINS):
+    """Scatter y against x, or draw their density if there are many.
+
+    Up to density_threshold points are plotted as markers. Above that,
+    the points are binned into a 2D histogram that's drawn as one image,
+    so render time and file size don't grow with the number of points.
     """
-    # Plot percentage of lowest income people.
-    agi1_bool = data['agi_stub'] == 1
-    agi1_data = data['total_people_pct_of_FIPS'][agi1_bool] * 100
-    agi1_pct = (agi1_data).tolist()
-    agi1_fips = data['FIPS'][agi1_bool].tolist()
-    # agi_lin = (agi1_data.max() - agi1_data.min()) / 5
-    # pct_bins = np.linspace(agi1_data.min() + agi_lin,
-    #                        agi1_data.max() - agi_lin,
-    #                        num=5).tolist()
-    pct_bins = np.percentile(agi1_data, [20, 40, 60, 80]).tolist()
-
-    # colors from http://colorbrewer2.org
-    # colorscale = ['#f0f9e8', '#ccebc5', '#a8ddb5', '#7bccc4', '#4eb3d3',
-    #               '#2b8cbe', '#08589e']
-    # colorscale = ['#f0f9e8', '#ccebc5', '#a8ddb5', '#7bccc4', '#43a2ca',
-    #               '#0868ac']
-    colorscale = ['#f0f9e8', '#bae4bc', '#7bccc4', '#43a2ca', '#0868ac']
-    fig = ff.create_choropleth(fips=agi1_fips, values=agi1_pct,
-                               round_legend_values=True,
-                               binning_endpoints=pct_bins,
-                               colorscale=colorscale,
-                               legend_title='Pct. of People in $1-$25k AGI '
-                                            'Bracket')
-    plotly.offline.plot(fig, filename='pct_agi1.html')
-
-    # Plot diabetes. We can still use agi1_bool - the diabetes rate is
-    # the same for all agi_stubs.
-    diabetes_data = data['PCT_DIABETES_ADULTS13'][agi1_bool]
-    diabetes_pct = diabetes_data.tolist()
-    # We'll re-use the agi1_fips.
-    # New pct_bins (max for diabetes is 23.5:
-    # diabetes_lin = (diabetes_data.max() - diabetes_data.min()) / 5
-    # pct_bins = np.linspace(diabetes_data.min() + diabetes_lin,
-    #                        diabetes_data.max() - diabetes_lin, num=5).tolist()
-    pct_bins = np.percentile(diabetes_data, [20, 40, 60, 80]).tolist()
-    fig = ff.create_choropleth(fips=agi1_fips, values=diabetes_pct,
-                               round_legend_values=True,
-                               binning_endpoints=pct_bins,
-                               colorscale=colorscale,
-                               legend_title='Pct. of Adults with Diabetes')
-    plotly.offline.plot(fig, filename='pct_diabetes.html')
-
-    # Plot obesity.
-    obesity_data = data['PCT_OBESE_ADULTS13'][agi1_bool]
-    obesity_pct = obesity_data.tolist()
-    # We'll re-use the agi1_fips.
-    # New pct_bins (max for obesity is 47.6:
-    # obesity_lin = (obesity_data.max() - obesity_data.min()) / 5
-    # pct_bins = np.linspace(obesity_data.min() + obesity_lin,
-    #                        obesity_data.max() - obesity_lin, num=5).tolist()
-    pct_bins = np.percentile(obesity_data, [20, 40, 60, 80]).tolist()
-    fig = ff.create_choropleth(fips=agi1_fips, values=obesity_pct,
-                               round_legend_values=True,
-                               binning_endpoints=pct_bins,
-                               colorscale=colorscale,
-                               legend_title='Pct. of Obese Adults')
-    plotly.offline.plot(fig, filename='pct_obese.html')
-
-
-def scatter_plots(data, health_column, income_column, ylabel, filename):
-    """Method for creating scatter plots for each agi stub vs health"""
+    from matplotlib.colors import LogNorm
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= density_threshold:
+        ax.plot(x, y, linestyle='None', marker='.', markersize=1)
+        return
+
+    finite = np.isfinite(x) & np.isfinite(y)
+    x = x[finite]
+    y = y[finite]
+    if not len(x):
+        return
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=density_bins)
+
+    # Leave empty bins blank, and use a log scale so sparse tails remain
+    # visible next to the dense core.
+    counts = np.ma.masked_equal(counts.T, 0)
+    ax.imshow(counts, origin='lower', aspect='auto', cmap='Blues',
+              interpolation='nearest', norm=LogNorm(),
+              extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]))
+
+
+def figure_job(name, render, data, **style):
+    """figure_build.FigureJob for one of the render functions below.
+
+    Their figures also depend on the global style (STYLE,
+    FONT_PROPERTIES, the agi stub titles) and on the drawing helpers, so
+    those are part of the job's hash.
+    """
+    return figure_build.FigureJob(
+        name, render, data, depends=(pyplot, plot_points, fitting),
+        settings={'STYLE': STYLE, 'FONT_PROPERTIES': FONT_PROPERTIES,
+                  'AGI_STUBS': read_irs.AGI_STUBS},
+        **style)
+
+
+@instrument.stage()
+def scatter_figure(data, health_column, income_column, ylabel,
+                   density_threshold=DENSITY_THRESHOLD,
+                   density_bins=DENSITY_BINS, fit_degrees=None):
+    """Figure with a scatter plot for each agi stub vs health
+
+    If fit_degrees is given, polynomials of those degrees are fitted for
+    all agi stubs at once (see fitting.py) and the best one is drawn
+    over each subplot.
+    """
+    from matplotlib.offsetbox import AnchoredText
+    from scipy.stats import pearsonr, spearmanr
+    plt = pyplot()
+
+    if fit_degrees:
+        _, curves = fitting.fit_polynomials(data, [health_column],
+                                            [income_column],
+                                            degrees=fit_degrees)
 
     # Initialize figure. Let's make it the whole width of the paper,
     # minus the 1" margins.
     fig = plt.figure(figsize=[7.5, 1.64])
 
+    # Group the rows by agi stub once, instead of masking per subplot.
+    stubs = data.groupby('agi_stub')[[income_column, health_column]]
+
     # Loop over all the agi stubs
     for s in range(1, 7):
         # Initialize axis.
-        ax = plt.subplot(1, 6, s)
+        ax = fig.add_subplot(1, 6, s)
 
         # Get data for this agi_stub.
-        agi_bool = data['agi_stub'] == s
-        pct_in_fips = data[income_column][agi_bool] * 100
-
-        # Get health data. NOTE: This could be factored out of the loop.
-        health_data = data[health_column][agi_bool]
+        stub_data = stubs.get_group(s)
+        pct_in_fips = stub_data[income_column] * 100
+        health_data = stub_data[health_column]
 
-        ax.plot(pct_in_fips, health_data, linestyle='None', marker='.',
-                markersize=1)
+        plot_points(ax, pct_in_fips, health_data, density_threshold,
+                    density_bins)
 
         # Compute correlation coefficients. NOTE: Spearman may be better
         # here, as our data isn't Gaussian.
@@ -209,156 +321,141 @@ def scatter_plots(data, health_column, income_column, ylabel, filename):
         t = 'AGI: {}'
         ax.set_title(t.format(read_irs.AGI_STUBS[s]))
 
-        # # Perform polynomial fits for degrees 1 and 2, plot the best.
-        # c1 = np.polyfit(pct_in_fips, health_data, deg=1)
-        # p1 = np.poly1d(c1)
-        # f1 = p1(pct_in_fips)
-        # r2_1 = r2_score(health_data, f1)
-        #
-        # # Degree 2.
-        # c2 = np.polyfit(pct_in_fips, health_data, deg=2)
-        # p2 = np.poly1d(c2)
-        # f2 = p2(pct_in_fips)
-        # r2_2 = r2_score(health_data, f1)
-        #
-        # # Use the best r2 score for plotting.
-        # if r2_1 > r2_2:
-        #     p = p1
-        # else:
-        #     p = p2
-        #
-        # # Sweep over the x data to get y data for the best fit.
-        # x = np.arange(0, max(pct_in_fips), 1)
-        # y = p(x)
-        # ax.plot(x, y, marker='None')
+        # Overlay the best polynomial fit (by cross-validated R^2).
+        if fit_degrees:
+            x, y = curves[(s, health_column, income_column)]
+            ax.plot(x * 100, y, marker='None', linewidth=0.5, color='C1')
 
     # TODO: More layout tweaks:
     # - Could do a shared y-axis for all the figures.
     # - Always room for tweaking tight_layout parameters
     # - Consider figure title, with reduced subplot titles
-    plt.tight_layout(pad=0.05, h_pad=0, w_pad=0.2)
-    # TODO: Save .eps for report.
-    plt.savefig(filename + '.png')
-    plt.savefig(filename + '.eps', type='eps')
+    fig.tight_layout(pad=0.05, h_pad=0, w_pad=0.2)
 
-def scatter_mean_medians(data):
-    """"""
-    # Overall mean income per FIPS:
-    totals = data[['FIPS', 'total_people', 'A00100']].groupby('FIPS').sum()
-    totals['mean_agi_per_person'] = (totals['A00100'] * 1000
-                                     / totals['total_people'])
+    return fig
 
-    # Join data.
-    data = data.join(totals['mean_agi_per_person'], on='FIPS')
 
-    # Grab boolean for a single agi_stub to get health data.
-    health_bool = data['agi_stub'] == 1
+def scatter_job(data, health_column, income_column, ylabel, filename,
+                density_threshold=DENSITY_THRESHOLD, fit_degrees=None):
+    """FigureJob for scatter_figure, with just the columns it plots."""
+    return figure_job(
+        filename, scatter_figure,
+        data[['agi_stub', income_column, health_column]],
+        health_column=health_column, income_column=income_column,
+        ylabel=ylabel, density_threshold=density_threshold,
+        density_bins=DENSITY_BINS, fit_degrees=fit_degrees)
 
-    # Scatter for diabetes
-    fig, ax = plt.subplots(1, 1)
-    ax.plot(data[health_bool]['mean_agi_per_person'],
-            data[health_bool]['PCT_DIABETES_ADULTS13'],
-            linestyle='None', marker='.', markersize=1)
-
-    pr, _ = pearsonr(data[health_bool]['mean_agi_per_person'],
-                     data[health_bool]['PCT_DIABETES_ADULTS13'])
-    sr, _ = spearmanr(data[health_bool]['mean_agi_per_person'],
-                      data[health_bool]['PCT_DIABETES_ADULTS13'])
-    corr_text = 'Pearson: {:.2f}\nSpearman: {:.2f}'.format(pr, sr)
-    txt = AnchoredText(corr_text, loc='upper center', prop=FONT_PROPERTIES,
-                       frameon=False, pad=0, borderpad=0.2)
-    ax.add_artist(txt)
 
-    ax.set_ylabel('Pct. Diabetes')
-    ax.set_xlabel('Mean AGI per Person ($)')
-    plt.tight_layout(pad=0.05, h_pad=0, w_pad=0)
-    plt.savefig('mean_agi_diabetes.png')
-    plt.savefig('mean_agi_diabetes.eps')
+@instrument.stage()
+def scatter_plots(data, health_column, income_column, ylabel, filename,
+                  density_threshold=DENSITY_THRESHOLD):
+    """Method for creating scatter plots for each agi stub vs health
 
-    # Scatter for obesity
-    fig, ax = plt.subplots(1, 1)
-    ax.plot(data[health_bool]['mean_agi_per_person'],
-            data[health_bool]['PCT_OBESE_ADULTS13'],
-            linestyle='None', marker='.', markersize=1)
-
-    pr, _ = pearsonr(data[health_bool]['mean_agi_per_person'],
-                     data[health_bool]['PCT_OBESE_ADULTS13'])
-    sr, _ = spearmanr(data[health_bool]['mean_agi_per_person'],
-                      data[health_bool]['PCT_OBESE_ADULTS13'])
-    corr_text = 'Pearson: {:.2f}\nSpearman: {:.2f}'.format(pr, sr)
-    txt = AnchoredText(corr_text, loc='upper center', prop=FONT_PROPERTIES,
-                       frameon=False, pad=0, borderpad=0.2)
-    ax.add_artist(txt)
+    Subplots with more than density_threshold points are drawn as a
+    density raster (see plot_points).
+    """
+    figure_build.build([scatter_job(data, health_column, income_column,
+                                    ylabel, filename, density_threshold)])
 
-    ax.set_ylabel('Pct. Obese')
-    ax.set_xlabel('Mean AGI per Person ($)')
-    plt.tight_layout(pad=0.05, h_pad=0, w_pad=0)
-    plt.savefig('mean_agi_obese.png')
-    plt.savefig('mean_agi_obese.eps', type='eps')
-
-    # Compute median of means.
-    total_groups = data[['FIPS', 'agi_stub', 'total_people',
-                         'agi_per_person']].groupby('FIPS')
-
-    # Initialize DataFrame for holding the median mean data.
-    med_mean = pd.DataFrame(0.0, columns=['median_mean_agi'],
-                            index=data['FIPS'].unique())
-
-    # Loop over the groups
-    for name, group in total_groups:
-        # Ensure group is sorted by agi_stub
-        group.sort_values(by='agi_stub')
-        # Get the median index.
-        c = np.cumsum(group['total_people'].values)
-        med_ind = np.searchsorted(c, c[-1]/2)
-        median_mean_agi = group.iloc[med_ind]['agi_per_person'],
-        med_mean.loc[group.iloc[0]['FIPS']] = median_mean_agi
-
-    # Join.
-    data = data.join(med_mean, on='FIPS')
-
-    # Scatter plots.
-    # Diabetes:
-    fig, ax = plt.subplots(1, 1)
-    ax.plot(data[health_bool]['median_mean_agi'],
-            data[health_bool]['PCT_DIABETES_ADULTS13'],
-            linestyle='None', marker='.', markersize=1)
-
-    pr, _ = pearsonr(data[health_bool]['median_mean_agi'],
-                     data[health_bool]['PCT_DIABETES_ADULTS13'])
-    sr, _ = spearmanr(data[health_bool]['median_mean_agi'],
-                      data[health_bool]['PCT_DIABETES_ADULTS13'])
-    corr_text = 'Pearson: {:.2f}\nSpearman: {:.2f}'.format(pr, sr)
-    txt = AnchoredText(corr_text, loc='upper center', prop=FONT_PROPERTIES,
-                       frameon=False, pad=0, borderpad=0.2)
-    ax.add_artist(txt)
 
-    ax.set_ylabel('Pct. Diabetes')
-    ax.set_xlabel('Median Mean AGI per Person ($)')
-    plt.tight_layout(pad=0.05, h_pad=0, w_pad=0)
-    plt.savefig('median_mean_agi_diabetes.png')
-    plt.savefig('median_mean_agi_diabetes.eps', type='eps')
+@instrument.stage()
+def mean_median_figure(data, income_column, health_column, xlabel,
+                       ylabel, density_threshold=DENSITY_THRESHOLD,
+                       density_bins=DENSITY_BINS):
+    """Figure scattering a per-FIPS income measure against health."""
+    from matplotlib.offsetbox import AnchoredText
+    from scipy.stats import pearsonr, spearmanr
+    plt = pyplot()
 
-    # Obesity:
     fig, ax = plt.subplots(1, 1)
-    ax.plot(data[health_bool]['median_mean_agi'],
-            data[health_bool]['PCT_OBESE_ADULTS13'],
-            linestyle='None', marker='.', markersize=1)
-
-    pr, _ = pearsonr(data[health_bool]['median_mean_agi'],
-                     data[health_bool]['PCT_OBESE_ADULTS13'])
-    sr, _ = spearmanr(data[health_bool]['median_mean_agi'],
-                      data[health_bool]['PCT_OBESE_ADULTS13'])
+    plot_points(ax, data[income_column], data[health_column],
+                density_threshold, density_bins)
+
+    pr, _ = pearsonr(data[income_column], data[health_column])
+    sr, _ = spearmanr(data[income_column], data[health_column])
     corr_text = 'Pearson: {:.2f}\nSpearman: {:.2f}'.format(pr, sr)
     txt = AnchoredText(corr_text, loc='upper center', prop=FONT_PROPERTIES,
                        frameon=False, pad=0, borderpad=0.2)
     ax.add_artist(txt)
 
-    ax.set_ylabel('Pct. Obese')
-    ax.set_xlabel('Median Mean AGI per Person ($)')
-    plt.tight_layout(pad=0.05, h_pad=0, w_pad=0)
-    plt.savefig('median_mean_agi_obese.png')
-    plt.savefig('median_mean_agi_obese.eps', type='eps')
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel(xlabel)
+    fig.tight_layout(pad=0.05, h_pad=0, w_pad=0)
+
+    return fig
+
+
+def mean_median_jobs(tables, density_threshold=DENSITY_THRESHOLD):
+    """FigureJobs for the mean and median income vs. health scatters.
+
+    tables are the county_tables.CountyTables of the joined data with
+    the columns added by data_stages.compute_mean_medians; all of the
+    plotted columns are in its county table.
+    """
+    data = tables.counties
+
+    jobs = []
+    for income_column, xlabel, prefix in (
+            ('mean_agi_per_person', 'Mean AGI per Person ($)', 'mean_agi'),
+            ('median_mean_agi', 'Median Mean AGI per Person ($)',
+             'median_mean_agi')):
+        for health_column, ylabel, suffix in (
+                ('PCT_DIABETES_ADULTS13', 'Pct. Diabetes', 'diabetes'),
+                ('PCT_OBESE_ADULTS13', 'Pct. Obese', 'obese')):
+            jobs.append(figure_job(
+                prefix + '_' + suffix, mean_median_figure,
+                data[[income_column, health_column]],
+                income_column=income_column, health_column=health_column,
+                xlabel=xlabel, ylabel=ylabel,
+                density_threshold=density_threshold,
+                density_bins=DENSITY_BINS))
+    return jobs
+
+
+@instrument.stage()
+def scatter_mean_medians(data, density_threshold=DENSITY_THRESHOLD,
+                         processes=None):
+    """Scatter mean and median income per person against health.
+
+    Drawn as density rasters above density_threshold points. data is
+    the joined data; data_stages.compute_mean_medians is called if it
+    hasn't been. processes is passed on to figure_build.build (1 renders
+    in-process).
+    """
+    if 'median_mean_agi' not in data.columns:
+        data = data_stages.compute_mean_medians(data)
+    tables = county_tables.split(data,
+                                 county_columns=county_tables.COUNTY_COLUMNS)
+    figure_build.build(mean_median_jobs(tables, density_threshold),
+                       processes=processes)
+
+
+def figure_jobs(tables):
+    """All of the report's scatter figures as FigureJobs, from the
+    county_tables.CountyTables of the joined data."""
+    joined_data = tables.joined(['N1_pct_of_FIPS',
+                                 'total_people_pct_of_FIPS']
+                                + HEALTH_COLUMNS)
+    return [
+        # Plot pct obese vs. pct of tax returns filed in each agi_stub
+        scatter_job(joined_data, health_column='PCT_OBESE_ADULTS13',
+                    income_column='N1_pct_of_FIPS', ylabel='Pct. Obese',
+                    filename='obese_scatter_N1'),
+        # pct obese vs. pct of total people in each agi_stub
+        scatter_job(joined_data, health_column='PCT_OBESE_ADULTS13',
+                    income_column='total_people_pct_of_FIPS',
+                    ylabel='Pct. Obese',
+                    filename='obese_scatter_total_people'),
+        # pct diabetes vs. pct of tax returns filed in each agi_stub
+        scatter_job(joined_data, health_column='PCT_DIABETES_ADULTS13',
+                    income_column='N1_pct_of_FIPS', ylabel='Pct. Diabetes',
+                    filename='diabetes_scatter_N1'),
+        # pct diabetes vs. pct of total people in each agi_stb
+        scatter_job(joined_data, health_column='PCT_DIABETES_ADULTS13',
+                    income_column='total_people_pct_of_FIPS',
+                    ylabel='Pct. Diabetes',
+                    filename='diabetes_scatter_total_people'),
+    ] + mean_median_jobs(tables)
 
 
 ########################################################################
@@ -366,4 +463,16 @@ def scatter_mean_medians(data):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the analysis.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-stage timing and memory (see '
+                             'instrument.py).')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log the coverage of the feature store when '
+                             'it is built (see data_stages.build_store).')
+    args = parser.parse_args()
+    if args.profile:
+        instrument.enable()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
     main()
@@ -0,0 +1,270 @@
+"""
+Module for benchmarking the analysis stages on synthetic data.
+
+A synthetic data set (see synthetic_data.py) is generated in a temporary
+folder and each stage is run there, fully offline:
+    - FipsZipHandler construction, from the files and from its index
+      cache,
+    - read_irs.read_data (the first run builds the columnar cache),
+    - read_irs.lookup_fips, aggregate_by_fips and compute_percentages,
+    - the shared feature store and the IRS / Food Atlas join
+      (data_stages.build_store, join_data),
+    - analysis.scatter_mean_medians, rendered in-process so its CPU
+      time and memory are measured.
+Every stage is timed (wall clock and CPU, best and first of --repeat
+runs) and run once more under tracemalloc for its peak memory. Results
+are written as JSON, named by time and git commit, so runs from
+different commits can be compared:
+    python benchmark.py --counties 3100 --zips-per-county 10
+    python benchmark.py --compare benchmark_results/<earlier run>.json
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import matplotlib
+# Render off screen; must come before anything imports pyplot.
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+# Project modules:
+import analysis
+import columnar_cache
+import data_stages
+import figure_build
+import read_atlas_data
+import read_irs
+import synthetic_data
+from fipsZipHandler import FipsZipHandler
+
+########################################################################
+# CONSTANTS
+
+# Folder the results are written to.
+RESULTS_DIR = 'benchmark_results'
+
+# Number of timed runs of each stage.
+REPEAT = 3
+
+########################################################################
+# FUNCTIONS
+
+
+def measure(run, setup=None, repeat=REPEAT):
+    """Time run(*setup()) repeat times, then trace its peak memory.
+
+    setup (untimed) must return a fresh tuple of arguments each time, as
+    several stages modify their input. Output printed by run is
+    discarded. Returns a dict of timings (seconds) and peak_mb.
+    """
+    walls = []
+    cpus = []
+    for i in range(repeat + 1):
+        args = setup() if setup is not None else ()
+        trace = i == repeat
+        if trace:
+            tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run(*args)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        if trace:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            walls.append(wall)
+            cpus.append(cpu)
+
+    return {'best_s': min(walls), 'first_s': walls[0],
+            'mean_s': float(np.mean(walls)), 'cpu_s': min(cpus),
+            'peak_mb': peak / 2 ** 20}
+
+
+def _git_commit():
+    """Current git commit of this file's repository, if there is one."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stages(repeat=REPEAT):
+    """Benchmark every stage on the data in the working directory.
+
+    Returns a dict mapping stage name to its measure() result plus the
+    number of input rows.
+    """
+    results = {}
+
+    def record(name, rows, run, setup=None):
+        results[name] = measure(run, setup, repeat)
+        results[name]['rows'] = rows
+        print('{:<28} {:>9.3f}s {:>9.1f} MB'.format(
+            name, results[name]['best_s'], results[name]['peak_mb']))
+
+    # Build the FIPS/ZIP index once, so the cached case is cached.
+    FipsZipHandler()
+    record('FipsZipHandler.build', None,
+           lambda: FipsZipHandler(useIndexCache=False))
+    record('FipsZipHandler.cached', None, FipsZipHandler)
+    fz_obj = FipsZipHandler()
+
+    # The first run reads the CSV and builds the columnar cache.
+    irs_data = read_irs.read_data()
+    shutil.rmtree(columnar_cache.cache_dir(read_irs.IRS_FILE_PATH),
+                  ignore_errors=True)
+    record('read_irs.read_data', len(irs_data), read_irs.read_data)
+
+    record('lookup_fips', len(irs_data), read_irs.lookup_fips,
+           lambda: (irs_data.copy(), fz_obj))
+    looked_up = read_irs.lookup_fips(irs_data.copy(), fz_obj)
+
+    record('aggregate_by_fips', len(looked_up), read_irs.aggregate_by_fips,
+           lambda: (looked_up.copy(),))
+    aggregated = read_irs.wealth_per_person(
+        read_irs.aggregate_by_fips(looked_up.copy()))
+
+    record('compute_percentages', len(aggregated),
+           read_irs.compute_percentages, lambda: (aggregated.copy(),))
+    final = read_irs.compute_percentages(aggregated.copy())
+
+    atlas_data = read_atlas_data.read_data()
+    # The store loads its datasets lazily; the coverage loads them all.
+    record('build_store', len(final),
+           lambda *args: data_stages.build_store(*args).coverage(),
+           lambda: (final, atlas_data))
+    store = data_stages.build_store(final, atlas_data)
+    record('join_data', len(final), data_stages.join_data,
+           lambda: (final.copy(), store))
+    with contextlib.redirect_stdout(io.StringIO()):
+        joined = data_stages.join_data(final.copy(), store)
+
+    # Remove the figure manifest so every figure is actually rendered.
+    def fresh_figures():
+        if os.path.exists(figure_build.MANIFEST_FILE):
+            os.remove(figure_build.MANIFEST_FILE)
+        return (data_stages.compute_mean_medians(joined.copy()),)
+
+    # Worker processes would escape process_time() and tracemalloc.
+    record('scatter_mean_medians', len(joined),
+           partial(analysis.scatter_mean_medians, processes=1),
+           fresh_figures)
+
+    return results
+
+
+def benchmark(n_counties=synthetic_data.COUNTIES,
+              zips_per_county=synthetic_data.ZIPS_PER_COUNTY,
+              extra_columns=0, repeat=REPEAT, seed=0, keep=False):
+    """Generate a synthetic data set and benchmark the stages on it.
+
+    Returns the results as a dict (see main for the layout).
+    """
+    root = tempfile.mkdtemp(prefix='benchmark-')
+    cwd = os.getcwd()
+    try:
+        print('Generating synthetic data in {}'.format(root))
+        scale = synthetic_data.generate(
+            root, n_counties, zips_per_county, extra_columns=extra_columns,
+            seed=seed)
+        del scale['irs_paths']
+        os.chdir(root)
+        stages = run_stages(repeat)
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'commit': _git_commit(),
+                 'python': platform.python_version(),
+                 'numpy': np.__version__, 'pandas': pd.__version__,
+                 'platform': platform.platform(),
+                 'cpus': os.cpu_count()},
+        'params': {'counties': n_counties,
+                   'zips_per_county': zips_per_county,
+                   'extra_columns': extra_columns, 'repeat': repeat,
+                   'seed': seed},
+        'scale': scale,
+        'stages': stages,
+    }
+
+
+def compare(new, old):
+    """Print each stage's best time and peak memory against old's."""
+    print('{:<28} {:>10} {:>10} {:>7} {:>10} {:>7}'.format(
+        'stage', 'old s', 'new s', 'ratio', 'new MB', 'ratio'))
+    for name, stats in new['stages'].items():
+        if name not in old['stages']:
+            continue
+        before = old['stages'][name]
+        print('{:<28} {:>10.3f} {:>10.3f} {:>7.2f} {:>10.1f} {:>7.2f}'.format(
+            name, before['best_s'], stats['best_s'],
+            stats['best_s'] / before['best_s'], stats['peak_mb'],
+            stats['peak_mb'] / max(before['peak_mb'], 1e-9)))
+    if new['params'] != old['params']:
+        print('NOTE: the runs used different parameters.')
+
+
+def main(argv=None):
+    """Command line interface."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--counties', type=int,
+                        default=synthetic_data.COUNTIES)
+    parser.add_argument('--zips-per-county', type=int,
+                        default=synthetic_data.ZIPS_PER_COUNTY)
+    parser.add_argument('--extra-columns', type=int, default=0,
+                        help='Unused columns to add to the IRS file.')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write (default: '
+                        '{}/<time>-<commit>.json).'.format(RESULTS_DIR))
+    parser.add_argument('--compare', help='Earlier results to compare to.')
+    parser.add_argument('--keep', action='store_true',
+                        help="Don't delete the synthetic data.")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.counties, args.zips_per_county,
+                        args.extra_columns, args.repeat, args.seed,
+                        args.keep)
+
+    output = args.output
+    if output is None:
+        output = os.path.join(RESULTS_DIR, '{}-{}.json'.format(
+            time.strftime('%Y%m%d-%H%M%S'), results['meta']['commit']))
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+########################################################################
+# MAIN
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Module for drawing county choropleth maps.
+
+County geometries are loaded from a GeoJSON file once, simplified
+(coordinates are rounded and the points that collapse onto their
+neighbour are dropped) and cached on disk, so later runs skip the
+geometry processing entirely. Any number of value layers are then binned
+by percentile and rendered against the shared geometry into a single
+HTML file, with a drop-down menu to switch between layers. The geometry
+is written to the file once; each extra layer only adds its binned
+values.
+
+The county GeoJSON (features with 5 digit FIPS codes as their 'id') can
+be downloaded from
+https://raw.githubusercontent.com/plotly/datasets/master/geojson-counties-fips.json
+and saved as datasets/geojson-counties-fips.json.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import plotly.graph_objects as go
+import plotly.offline
+
+# Standard Library:
+import hashlib
+import json
+import os
+
+########################################################################
+# CONSTANTS
+
+# County geometries, keyed by FIPS code.
+GEOMETRY_FILE = 'datasets/geojson-counties-fips.json'
+
+# Folder (next to GEOMETRY_FILE) holding the simplified geometries.
+CACHE_DIR_NAME = '.choropleth'
+
+# Bump to invalidate cached geometries when the processing changes.
+CACHE_VERSION = 1
+
+# Coordinates are rounded to this many decimal degrees (3 is ~100m).
+SIMPLIFY_DECIMALS = 3
+
+# Default bin endpoints, as percentiles of each layer's values.
+PERCENTILES = (20, 40, 60, 80)
+
+# colors from http://colorbrewer2.org
+COLORSCALE = ['#f0f9e8', '#bae4bc', '#7bccc4', '#43a2ca', '#0868ac']
+
+########################################################################
+# FUNCTIONS
+
+
+def _rings(geometry):
+    """List of the coordinate rings in a Polygon or MultiPolygon."""
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    return [ring for polygon in geometry['coordinates'] for ring in polygon]
+
+
+def simplify(geojson, decimals=SIMPLIFY_DECIMALS):
+    """Simplify every ring of every feature in one pass.
+
+    All coordinates are stacked into a single array, rounded, and points
+    equal to the previous point of the same ring are dropped. Rings that
+    would be left with fewer than 4 points are kept as they were.
+    Returns a new GeoJSON dict.
+    """
+    rings = [ring for feature in geojson['features']
+             for ring in _rings(feature['geometry'])]
+    lengths = np.array([len(ring) for ring in rings])
+    points = np.round(np.array([point[:2] for ring in rings
+                                for point in ring], dtype=np.float64),
+                      decimals)
+
+    # Keep the first point of each ring and every point that moved.
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+    keep[starts] = True
+    ring_id = np.repeat(np.arange(len(rings)), lengths)
+    kept = np.bincount(ring_id, weights=keep, minlength=len(rings))
+    keep[np.isin(ring_id, np.flatnonzero(kept < 4))] = True
+
+    simplified = iter(np.split(points[keep],
+                               np.cumsum(np.bincount(ring_id[keep]))[:-1]))
+
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            coordinates = [next(simplified).tolist()
+                           for _ in geometry['coordinates']]
+        else:
+            coordinates = [[next(simplified).tolist() for _ in polygon]
+                           for polygon in geometry['coordinates']]
+        features.append({'type': 'Feature', 'id': feature['id'],
+                         'properties': {},
+                         'geometry': {'type': geometry['type'],
+                                      'coordinates': coordinates}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def load_geometry(path=GEOMETRY_FILE, decimals=SIMPLIFY_DECIMALS,
+                  use_cache=True):
+    """Simplified county GeoJSON, from the on-disk cache if possible.
+
+    The cached copy is keyed on the source file's size and modification
+    time and on decimals, so it's rebuilt whenever either changes.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError('County geometry file {} not found; see the '
+                                'choropleth module docstring for where to '
+                                'get it.'.format(path))
+    stat = os.stat(path)
+    key = hashlib.sha1('{}:{}:{}:{}'.format(
+        stat.st_size, stat.st_mtime_ns, decimals,
+        CACHE_VERSION).encode()).hexdigest()[:16]
+    head, tail = os.path.split(path)
+    cache_file = os.path.join(head, CACHE_DIR_NAME,
+                              '{}-{}.json'.format(tail, key))
+
+    if use_cache:
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    with open(path) as f:
+        geojson = simplify(json.load(f), decimals)
+
+    # Write atomically, but don't fail if the cache can't be written.
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(geojson, f, separators=(',', ':'))
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
+
+    return geojson
+
+
+def bin_values(values, percentiles=PERCENTILES):
+    """Bin values at the given percentiles of their (non-NaN) values.
+
+    Returns (bins, endpoints), where bins is a float array of each
+    value's bin index (NaN for NaN values) and bin i holds the values in
+    (endpoints[i - 1], endpoints[i]].
+    """
+    values = np.asarray(values, dtype=np.float64)
+    endpoints = np.nanpercentile(values, percentiles)
+    bins = np.digitize(values, endpoints, right=True).astype(np.float64)
+    bins[np.isnan(values)] = np.nan
+    return bins, endpoints
+
+
+def _bin_labels(endpoints, decimals=1):
+    """Legend label for each bin."""
+    edges = ['{:.{}f}'.format(e, decimals) for e in endpoints]
+    return (['<= ' + edges[0]]
+            + ['{} - {}'.format(lo, hi) for lo, hi in zip(edges, edges[1:])]
+            + ['> ' + edges[-1]])
+
+
+def _discrete_colorscale(colors):
+    """Plotly colorscale with a flat band per color."""
+    n = len(colors)
+    scale = []
+    for i, color in enumerate(colors):
+        scale += [[i / n, color], [(i + 1) / n, color]]
+    return scale
+
+
+def layer_style(values, title, percentiles=PERCENTILES):
+    """Trace properties that switch the map to a single layer."""
+    bins, endpoints = bin_values(values, percentiles)
+    n = len(endpoints) + 1
+    return {'z': bins, 'customdata': np.asarray(values, dtype=np.float64),
+            'zmin': -0.5, 'zmax': n - 0.5,
+            'colorbar': {'title': {'text': title},
+                         'tickvals': list(range(n)),
+                         'ticktext': _bin_labels(endpoints)}}
+
+
+def render(fips, layers, filename, geometry=None, colorscale=COLORSCALE,
+           percentiles=PERCENTILES, auto_open=False):
+    """Render value layers for the given counties into one HTML file.
+
+    fips is a sequence of 5 digit FIPS codes and layers maps each
+    layer's legend title to its values, aligned with fips. Each layer is
+    binned at percentiles (len(colorscale) must be len(percentiles) + 1)
+    and the first layer is shown initially. geometry defaults to
+    load_geometry().
+    """
+    if len(colorscale) != len(percentiles) + 1:
+        raise ValueError('Need one color per bin: {} colors for {} '
+                         'bins.'.format(len(colorscale),
+                                        len(percentiles) + 1))
+    if geometry is None:
+        geometry = load_geometry()
+
+    # Only ship the counties that are actually mapped.
+    fips = [str(f) for f in fips]
+    wanted = set(fips)
+    geometry = {'type': 'FeatureCollection',
+                'features': [f for f in geometry['features']
+                             if f['id'] in wanted]}
+
+    styles = [layer_style(values, title, percentiles)
+              for title, values in layers.items()]
+    colorbar_layout = {'len': 0.8, 'thickness': 15}
+
+    # A single trace holds the geometry; the menu restyles its values.
+    first = dict(styles[0], colorbar=dict(styles[0]['colorbar'],
+                                          **colorbar_layout))
+    fig = go.Figure(go.Choropleth(
+        geojson=geometry, locations=fips,
+        colorscale=_discrete_colorscale(colorscale),
+        marker_line_width=0.2, marker_line_color='white',
+        hovertemplate='FIPS %{location}<br>%{customdata:.2f}'
+                      '<extra></extra>',
+        **first))
+
+    buttons = []
+    for title, style in zip(layers, styles):
+        colorbar = dict(style['colorbar'], **colorbar_layout)
+        buttons.append({'label': title, 'method': 'restyle',
+                        'args': [{'z': [style['z']],
+                                  'customdata': [style['customdata']],
+                                  'zmin': style['zmin'],
+                                  'zmax': style['zmax'],
+                                  'colorbar': colorbar}]})
+    fig.update_layout(
+        geo={'scope': 'usa', 'projection': {'type': 'albers usa'}},
+        margin={'l': 0, 'r': 0, 't': 30, 'b': 0},
+        updatemenus=[{'buttons': buttons, 'direction': 'down',
+                      'x': 0, 'xanchor': 'left', 'y': 1.05,
+                      'yanchor': 'bottom'}])
+
+    plotly.offline.plot(fig, filename=filename, auto_open=auto_open)
+    return fig
@@ -0,0 +1,135 @@
+"""
+Command line entry point for the analysis.
+
+    python cli.py ingest     # load and cache the IRS, Food Atlas and CDC data
+    python cli.py stats      # joined data, mean/median income, correlations
+    python cli.py scatter    # the report's scatter figures
+    python cli.py maps       # county choropleth maps
+    python cli.py all        # stats, scatter and maps
+
+Every subcommand goes through the cached pipeline (see
+analysis.build_pipeline), so only stages whose inputs changed are
+recomputed. Only the standard library is imported up front; each
+subcommand imports what it needs, so e.g. 'stats' never loads
+matplotlib or plotly. Add --profile to record per-stage timing and memory
+(see instrument.py).
+"""
+########################################################################
+# IMPORTS
+
+# Standard Library:
+import argparse
+import sys
+
+########################################################################
+# FUNCTIONS
+
+
+def _pipeline(args):
+    """The analysis pipeline for the IRS options given on the command
+    line."""
+    import analysis
+    irs_params = {}
+    if args.apportion:
+        irs_params['apportion'] = True
+    if args.fused:
+        irs_params['fused'] = True
+    if args.chunksize:
+        irs_params['chunksize'] = args.chunksize
+    return analysis.build_pipeline(**irs_params)
+
+
+def ingest(args):
+    """Load (and cache) the input data sets."""
+    results = _pipeline(args).run(['irs_data', 'atlas_data', 'cdc_data'])
+    print('IRS rows: {}, Food Atlas counties: {}, CDC rows: {}'.format(
+        len(results['irs_data']), len(results['atlas_data'][0]),
+        len(results['cdc_data'])))
+
+
+def stats(args):
+    """Compute (or load) the joined data and the correlations."""
+    import pandas as pd
+    results = _pipeline(args).run(['joined_data', 'mean_median_data',
+                                   'correlations'])
+    correlations = results['correlations']
+    if args.output:
+        correlations.to_csv(args.output, index=False)
+        print('Correlations written to {}'.format(args.output))
+    else:
+        with pd.option_context('display.width', 160,
+                               'display.max_columns', None):
+            print(correlations.to_string(index=False))
+
+
+def scatter(args):
+    """Build the scatter figures that changed since the last build."""
+    import analysis
+    import figure_build
+    tables = _pipeline(args).run(['county_tables'])['county_tables']
+    built = figure_build.build(analysis.figure_jobs(tables),
+                               processes=args.processes, force=args.force)
+    print('Rendered {} figure(s).'.format(len(built)))
+
+
+def maps(args):
+    """Draw the county maps."""
+    import analysis
+    tables = _pipeline(args).run(['county_tables'])['county_tables']
+    analysis.map_plots(tables, filename=args.maps_file)
+    print('Maps written to {}'.format(args.maps_file))
+
+
+def run_all(args):
+    """Run stats, scatter and maps."""
+    stats(args)
+    scatter(args)
+    maps(args)
+
+
+def main(argv=None):
+    """Parse the command line and run a subcommand."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-stage timing and memory.')
+    parser.add_argument('--apportion', action='store_true',
+                        help='Split zip codes across all their counties.')
+    parser.add_argument('--fused', action='store_true',
+                        help='Aggregate the IRS data in a single pass.')
+    parser.add_argument('--chunksize', type=int,
+                        help='Stream the IRS file this many rows at a time.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('ingest', help=ingest.__doc__).set_defaults(func=ingest)
+    stats_parser = sub.add_parser('stats', help=stats.__doc__)
+    stats_parser.add_argument('--output', help='Write the correlations to '
+                                               'this CSV file.')
+    stats_parser.set_defaults(func=stats)
+    scatter_parser = sub.add_parser('scatter', help=scatter.__doc__)
+    maps_parser = sub.add_parser('maps', help=maps.__doc__)
+    all_parser = sub.add_parser('all', help=run_all.__doc__)
+    for p in (scatter_parser, all_parser):
+        p.add_argument('--processes', type=int,
+                       help='Worker processes for rendering.')
+        p.add_argument('--force', action='store_true',
+                       help='Re-render every figure.')
+    for p in (maps_parser, all_parser):
+        p.add_argument('--maps-file', default='maps.html')
+    all_parser.add_argument('--output', help='Write the correlations to '
+                                             'this CSV file.')
+    scatter_parser.set_defaults(func=scatter)
+    maps_parser.set_defaults(func=maps)
+    all_parser.set_defaults(func=run_all)
+
+    args = parser.parse_args(argv)
+    if args.profile:
+        import instrument
+        instrument.enable()
+    args.func(args)
+
+########################################################################
+# MAIN
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Module for caching CSV inputs in a columnar binary format.
+
+The first read of a CSV file converts every column to a .npy file with a
+compact dtype:
+    - zip/FIPS style codes are stored as key_codec integer keys, and
+      read back as nullable UInt32 key columns,
+    - other text columns are stored as categorical codes + categories,
+    - integer columns are downcast to the smallest integer type that
+      fits (e.g. int8 for agi_stub),
+    - float columns are stored as float32 wherever that's lossless.
+Later reads memory-map only the requested columns. The cache lives in a
+'.columnar' folder next to the source file and is keyed on the source's
+size, modification time and SHA-1, so a changed or re-downloaded file
+is converted again transparently. It's also rebuilt when it was built
+with different code widths, dtypes or pandas.read_csv options.
+
+Converting needs the whole file in memory, so a chunked read of a file
+without an up to date cache streams the CSV itself instead (see
+read_csv).
+
+The same format is used to store DataFrames the program builds itself
+(write_frame/read_frame), e.g. the normalized tables of county_tables.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import hashlib
+import json
+import os
+import shutil
+
+# Project modules:
+import key_codec
+
+########################################################################
+# CONSTANTS
+
+# Name of the cache folder created next to each source file.
+CACHE_DIR_NAME = '.columnar'
+
+# Bump to invalidate every existing cache when the format changes.
+CACHE_VERSION = 2
+
+########################################################################
+# FUNCTIONS
+
+
+def cache_dir(path):
+    """Folder holding the columnar cache for the CSV file at path."""
+    head, tail = os.path.split(path)
+    return os.path.join(head, CACHE_DIR_NAME, tail)
+
+
+def file_hash(path):
+    """SHA-1 of a file's contents."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _column_file(directory, position, part):
+    # Column names can contain anything, so files are named by the
+    # column's position in the source file rather than by name.
+    return os.path.join(directory, '{}.{}.npy'.format(position, part))
+
+
+def _compact(values, code_width=None):
+    """Convert a column to its compact stored form.
+
+    Returns (kind, dict of arrays) where kind is 'code', 'category' or
+    'numeric'.
+    """
+    if code_width is not None:
+        if pd.api.types.is_integer_dtype(values.dtype):
+            # Already integer keys.
+            return 'code', {'values': key_codec.encode(values, code_width)}
+        missing = pd.isnull(values)
+        encoded = key_codec.encode(
+            np.where(missing, '', values.astype(object)), code_width)
+        # Only integer encode if it's lossless.
+        if (encoded[~missing] != key_codec.MISSING).all():
+            return 'code', {'values': encoded}
+
+    if not pd.api.types.is_numeric_dtype(values):
+        cat = pd.Categorical(values)
+        return 'category', {'values': cat.codes,
+                            'categories': np.asarray(cat.categories,
+                                                     dtype=str)}
+
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub':
+        return 'numeric', {'values': pd.to_numeric(values,
+                                                   downcast='integer')}
+
+    # Float: use float32 only if converting back loses nothing.
+    small = values.astype(np.float32)
+    if np.array_equal(small.astype(values.dtype), values, equal_nan=True):
+        values = small
+    return 'numeric', {'values': values}
+
+
+def _read_dtype(dtype, codes):
+    """dtype for pandas.read_csv: code columns are read as strings so
+    leading zeros survive."""
+    read_dtype = dict(dtype or {})
+    read_dtype.update({c: str for c in codes})
+    return read_dtype
+
+
+def _options(dtype, codes, csv_kwargs):
+    """JSON form of the arguments a cache was built with."""
+    def name(value):
+        return getattr(value, '__name__', str(value))
+    return {'codes': dict(codes),
+            'dtype': {c: name(t) for c, t in dtype.items()},
+            'csv_kwargs': {k: repr(v) for k, v in csv_kwargs.items()}}
+
+
+def _build(path, directory, stat, sha1, dtype, codes, csv_kwargs):
+    """Convert the CSV file at path into a columnar cache in directory."""
+    data = pd.read_csv(path, dtype=_read_dtype(dtype, codes), **csv_kwargs)
+
+    return _write(data, directory, codes, {
+        'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1,
+        'options': _options(dtype, codes, csv_kwargs)})
+
+
+def _write(data, directory, codes, extra):
+    """Store the columns of data in directory, returning the manifest
+    (which also holds the entries of extra)."""
+    # Write into a fresh temporary folder, then swap it in.
+    tmp = '{}.{}.tmp'.format(directory, os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = {}
+    for i, column in enumerate(data.columns):
+        kind, arrays = _compact(data[column], codes.get(column))
+        for part, array in arrays.items():
+            np.save(_column_file(tmp, i, part), array)
+        columns[column] = {'file': i, 'kind': kind}
+        if kind == 'code':
+            columns[column]['width'] = codes[column]
+
+    manifest = dict(extra, version=CACHE_VERSION, rows=len(data),
+                    columns=columns)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    # Move the old folder aside rather than deleting it first, so the
+    # directory is only ever missing between two renames, never half
+    # deleted.
+    old = '{}.{}.old'.format(directory, os.getpid())
+    shutil.rmtree(old, ignore_errors=True)
+    try:
+        os.rename(directory, old)
+    except FileNotFoundError:
+        pass
+    os.rename(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def _save_manifest(manifest, manifest_file):
+    """Replace manifest_file atomically, so readers never see it half
+    written."""
+    tmp = '{}.{}.tmp'.format(manifest_file, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_file)
+
+
+def _current(path, dtype, codes, csv_kwargs):
+    """The cache manifest for path if it's up to date, else None."""
+    manifest_file = os.path.join(cache_dir(path), 'manifest.json')
+    stat = os.stat(path)
+
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (manifest['version'] != CACHE_VERSION
+            or manifest.get('options') != _options(dtype, codes,
+                                                   csv_kwargs)):
+        return None
+    if (manifest['size'] == stat.st_size
+            and manifest['mtime_ns'] == stat.st_mtime_ns):
+        return manifest
+
+    # Touched or re-downloaded: only rebuild if the contents changed.
+    if manifest['size'] == stat.st_size and manifest['sha1'] == file_hash(
+            path):
+        manifest['mtime_ns'] = stat.st_mtime_ns
+        _save_manifest(manifest, manifest_file)
+        return manifest
+    return None
+
+
+def _manifest(path, dtype, codes, csv_kwargs):
+    """Load the cache manifest for path, (re)building it if stale."""
+    manifest = _current(path, dtype, codes, csv_kwargs)
+    if manifest is not None:
+        return manifest
+
+    directory = cache_dir(path)
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    return _build(path, directory, os.stat(path), file_hash(path), dtype,
+                  codes, csv_kwargs)
+
+
+def _decode(directory, info, requested_dtype, rows):
+    """Load one cached column, returning it as a Series-ready array."""
+    values = np.load(_column_file(directory, info['file'], 'values'),
+                     mmap_mode='r')[rows]
+
+    if info['kind'] == 'code':
+        # Integer keys, NA where missing (see key_codec.decode for the
+        # strings).
+        return key_codec.to_pandas(values)
+
+    if info['kind'] == 'category':
+        categories = np.load(_column_file(directory, info['file'],
+                                          'categories'))
+        cat = pd.Categorical.from_codes(values, categories)
+        if requested_dtype in (None, 'category'):
+            return cat
+        return np.asarray(cat, dtype=object)
+
+    if requested_dtype is not None:
+        return values.astype(requested_dtype)
+    return np.array(values)
+
+
+def _frame(directory, manifest, usecols, dtype, rows):
+    """DataFrame of the cached columns usecols (all if None)."""
+    if usecols is None:
+        usecols = list(manifest['columns'])
+    missing = set(usecols) - set(manifest['columns'])
+    if missing:
+        raise ValueError('Columns not found in {}: {}'.format(
+            directory, sorted(missing)))
+    # Keep the stored column order, as pandas.read_csv does.
+    usecols = [c for c in manifest['columns'] if c in set(usecols)]
+    return pd.DataFrame({c: _decode(directory, manifest['columns'][c],
+                                    dtype.get(c), rows)
+                         for c in usecols})
+
+
+def write_frame(data, directory, codes=None):
+    """Store the columns of the DataFrame data (not its index) in the
+    folder directory, replacing it. codes maps zip/FIPS style columns
+    (strings or key_codec keys) to their digit width."""
+    os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+    _write(data, directory, codes or {}, {})
+
+
+def read_frame(directory, usecols=None, dtype=None):
+    """Read a DataFrame stored by write_frame (see read_csv for
+    usecols and dtype)."""
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['version'] != CACHE_VERSION:
+        raise ValueError('{} was written by an incompatible version.'.format(
+            directory))
+    return _frame(directory, manifest, usecols, dtype or {}, slice(None))
+
+
+def _stream(path, usecols, dtype, codes, chunksize, csv_kwargs):
+    """Chunks of the CSV file read by pandas, with the code columns as
+    key_codec keys as in the cache. Other columns have the dtypes
+    pandas.read_csv gives them rather than the compact stored ones."""
+    chunks = pd.read_csv(path, usecols=usecols,
+                         dtype=_read_dtype(dtype, codes),
+                         chunksize=chunksize, **csv_kwargs)
+    for chunk in chunks:
+        for column, width in codes.items():
+            if column in chunk.columns:
+                chunk[column] = key_codec.encode_column(chunk[column],
+                                                        width)
+        yield chunk
+
+
+def read_csv(path, usecols=None, dtype=None, codes=None, chunksize=None,
+             **csv_kwargs):
+    """Read a CSV file through its columnar cache.
+
+    usecols selects the columns to load. dtype maps columns to the dtype
+    they should be returned as; numeric columns without an entry keep
+    their compact stored dtype, and text columns are returned as
+    categoricals unless str/object is requested. codes maps zip/FIPS
+    style columns to their digit width; they are stored and returned as
+    key_codec integer keys.
+    Other keyword arguments are passed to pandas.read_csv when the cache
+    is built.
+
+    If chunksize is given, an iterator over DataFrames of at most
+    chunksize rows is returned, sliced from the memory-mapped columns.
+    If the cache isn't up to date the CSV file is streamed instead (see
+    _stream), without building the cache, so memory stays bounded by the
+    chunk size.
+    """
+    codes = codes or {}
+    dtype = dtype or {}
+    if chunksize is not None:
+        manifest = _current(path, dtype, codes, csv_kwargs)
+        if manifest is None:
+            return _stream(path, usecols, dtype, codes, chunksize,
+                           csv_kwargs)
+    else:
+        manifest = _manifest(path, dtype, codes, csv_kwargs)
+    directory = cache_dir(path)
+
+    if chunksize is None:
+        return _frame(directory, manifest, usecols, dtype, slice(None))
+    return (_frame(directory, manifest, usecols, dtype,
+                   slice(start, start + chunksize))
+            for start in range(0, manifest['rows'], chunksize))
@@ -0,0 +1,206 @@
+"""
+Module for computing health vs. income correlations in bulk.
+
+For each agi_stub, the Pearson and Spearman coefficients of every
+(health column, income column) pair come from a single standardized
+matrix product (on ranks for Spearman), instead of one scipy.stats call
+per pair. Confidence intervals are estimated by bootstrap resampling
+(or significance by permutation), with the resamples split into
+fixed-size batches that are spread across a process pool. Each batch
+draws from its own child of one SeedSequence, so results are
+reproducible for a given seed regardless of the number of processes.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+# NOTE: scipy.stats is slow to import, so it's imported where it's used.
+
+# Standard Library:
+from concurrent.futures import ProcessPoolExecutor
+
+########################################################################
+# CONSTANTS
+
+# Number of resamples handled by a single worker task.
+BATCH_SIZE = 100
+
+########################################################################
+# FUNCTIONS
+
+
+def _standardize(a, axis):
+    """Center and scale to unit (population) standard deviation."""
+    a = a - a.mean(axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return a / a.std(axis=axis, keepdims=True)
+
+
+def correlation_matrix(x, y):
+    """Pearson correlations between the columns of x and y.
+
+    x is (..., n, h) and y is (..., n, k); the result is (..., h, k).
+    Leading dimensions are treated as a batch.
+    """
+    n = x.shape[-2]
+    return np.matmul(np.swapaxes(_standardize(x, -2), -1, -2),
+                     _standardize(y, -2)) / n
+
+
+def _pearson_spearman(x, y):
+    """(Pearson, Spearman) matrices for (batches of) x and y."""
+    from scipy.stats import rankdata
+    return (correlation_matrix(x, y),
+            correlation_matrix(rankdata(x, axis=-2), rankdata(y, axis=-2)))
+
+
+def _resample_batch(x, y, size, seed, method):
+    """Correlations for one batch of bootstrap or permutation resamples."""
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    if method == 'bootstrap':
+        # Resample rows (pairs) with replacement.
+        idx = rng.integers(0, n, size=(size, n))
+        return _pearson_spearman(x[idx], y[idx])
+
+    # Permutation: break the pairing by shuffling y's rows.
+    idx = rng.permuted(np.tile(np.arange(n), (size, 1)), axis=1)
+    return _pearson_spearman(np.broadcast_to(x, (size,) + x.shape), y[idx])
+
+
+def _batches(x, y, n_resamples, seed, method):
+    """Argument tuples for _resample_batch covering n_resamples."""
+    sizes = [BATCH_SIZE] * (n_resamples // BATCH_SIZE)
+    if n_resamples % BATCH_SIZE:
+        sizes.append(n_resamples % BATCH_SIZE)
+    return [(x, y, size, batch_seed, method)
+            for size, batch_seed in zip(sizes, seed.spawn(len(sizes)))]
+
+
+def correlate(data, health_columns, income_columns, by='agi_stub',
+              n_resamples=1000, method='bootstrap', confidence=0.95, seed=0,
+              processes=None):
+    """Correlate every health column with every income column.
+
+    data is the joined FIPS table (e.g. analysis.join_data output). For
+    each value of by (or the whole table if by is None), returns one
+    tidy row per (health, income) pair with the sample size, Pearson and
+    Spearman coefficients and:
+        - method='bootstrap': percentile confidence intervals
+          ('pearson_low', 'pearson_high', 'spearman_low',
+          'spearman_high') at the given confidence level,
+        - method='permutation': two-sided permutation p-values
+          ('pearson_p', 'spearman_p').
+    Set n_resamples to 0 to skip resampling. processes is the size of
+    the process pool used for resampling (1 to run in-process).
+
+    NaNs are deleted pairwise, as in fitting.py: each pair uses the rows
+    where both of its columns are present, and n is that pair's count.
+    Groups without NaNs have every pair computed in one product.
+    """
+    if method not in ('bootstrap', 'permutation'):
+        raise ValueError('Unknown method: {}'.format(method))
+    health_columns = list(health_columns)
+    income_columns = list(income_columns)
+    seed_sequence = np.random.SeedSequence(seed)
+
+    if by is None:
+        groups = [(None, data)]
+    else:
+        groups = list(data.groupby(by, sort=True))
+
+    # Units of work: a group's columns together if it has no NaNs, else
+    # each of its pairs on the rows where both columns are present.
+    units = []
+    for g, ((key, group), group_seed) in enumerate(
+            zip(groups, seed_sequence.spawn(len(groups)))):
+        x = group[health_columns].to_numpy(dtype=np.float64)
+        y = group[income_columns].to_numpy(dtype=np.float64)
+        present_x = ~np.isnan(x)
+        present_y = ~np.isnan(y)
+        if present_x.all() and present_y.all():
+            units.append((g, list(range(x.shape[1])),
+                          list(range(y.shape[1])), x, y, group_seed))
+            continue
+        pair_seeds = iter(group_seed.spawn(x.shape[1] * y.shape[1]))
+        for i in range(x.shape[1]):
+            for j in range(y.shape[1]):
+                rows = present_x[:, i] & present_y[:, j]
+                units.append((g, [i], [j], x[rows][:, [i]],
+                              y[rows][:, [j]], next(pair_seeds)))
+
+    # Point estimates, plus the resampling tasks for every unit.
+    estimates = []
+    tasks = []
+    for g, _, _, x, y, unit_seed in units:
+        stats = {'n': np.full((x.shape[1], y.shape[1]), len(x))}
+        unit_tasks = []
+        if len(x) > 1:
+            stats['pearson'], stats['spearman'] = _pearson_spearman(x, y)
+            if n_resamples:
+                unit_tasks = _batches(x, y, n_resamples, unit_seed, method)
+        estimates.append(stats)
+        tasks.append(unit_tasks)
+
+    # Run all units' batches together so the pool stays busy.
+    flat = [t for unit_tasks in tasks for t in unit_tasks]
+    if not flat:
+        results = []
+    elif processes == 1:
+        results = [_resample_batch(*t) for t in flat]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_resample_batch, *zip(*flat)))
+
+    # Every statistic of every group as a (health, income) array; pairs
+    # with fewer than two rows are NaN.
+    names = ['pearson', 'spearman']
+    if n_resamples and method == 'bootstrap':
+        names += ['pearson_low', 'pearson_high', 'spearman_low',
+                  'spearman_high']
+    elif n_resamples:
+        names += ['pearson_p', 'spearman_p']
+    shape = (len(health_columns), len(income_columns))
+    group_stats = [dict({'n': np.zeros(shape, dtype=np.int64)},
+                        **{name: np.full(shape, np.nan) for name in names})
+                   for _ in groups]
+
+    start = 0
+    for (g, hs, js, _, _, _), stats, unit_tasks in zip(units, estimates,
+                                                      tasks):
+        unit_results = results[start:start + len(unit_tasks)]
+        start += len(unit_tasks)
+        for i, name in enumerate(('pearson', 'spearman')):
+            if not unit_results:
+                break
+            resampled = np.concatenate([r[i] for r in unit_results])
+            if method == 'bootstrap':
+                alpha = (1 - confidence) / 2
+                stats[name + '_low'], stats[name + '_high'] = \
+                    np.nanpercentile(resampled,
+                                     [100 * alpha, 100 * (1 - alpha)],
+                                     axis=0)
+            else:
+                extreme = (np.abs(resampled)
+                           >= np.abs(stats[name]) - 1e-12)
+                stats[name + '_p'] = ((extreme.sum(axis=0) + 1)
+                                      / (n_resamples + 1))
+        for name, values in stats.items():
+            group_stats[g][name][np.ix_(hs, js)] = values
+
+    rows = []
+    for (key, _), stats in zip(groups, group_stats):
+        for i, health in enumerate(health_columns):
+            for j, income in enumerate(income_columns):
+                row = {'health': health, 'income': income}
+                if by is not None:
+                    row[by] = key
+                row.update({k: v[i, j] for k, v in stats.items()})
+                rows.append(row)
+
+    result = pd.DataFrame(rows)
+    if by is not None:
+        result = result[[by] + [c for c in result.columns if c != by]]
+    return result
@@ -0,0 +1,252 @@
+"""
+Module for storing the joined data as normalized county and stub tables.
+
+The joined data (and datasets/fData.csv, written from it) has one row per
+(county, agi_stub), so every county level column (State, County,
+population, the health measures, per-county income totals) is repeated
+on each of a county's agi_stub rows, and one value per county is found
+by filtering on agi_stub == 1. Here it's split into:
+    - counties: one row per county, indexed by FIPS key (see key_codec),
+      holding the columns that are constant within a county,
+    - stubs: one row per (agi_stub, county), holding the columns that
+      vary by agi_stub and the county's row in counties. Rows are sorted
+      by agi_stub and then county, so each agi_stub is a contiguous
+      block.
+Joined rows are put together on demand, for just the requested columns.
+The stub columns of one agi_stub are a slice of stubs, and if the stub
+covers every county its county columns are the county arrays
+themselves, so stub() builds its frame without copying. joined() is not
+zero-copy: it gathers (copies) the county columns for every row, giving
+the long table, with the stub columns as views.
+
+Tables are saved as two columnar folders (see columnar_cache.write_frame),
+e.g. 'python county_tables.py datasets/fData.csv datasets/fData'.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import json
+import os
+import sys
+
+# Project modules:
+import columnar_cache
+import key_codec
+import read_atlas_data
+
+########################################################################
+# CONSTANTS
+
+# Columns holding the county key and the agi stub in the joined data.
+KEY = 'FIPS'
+BY = 'agi_stub'
+
+# Column of the stub table holding the county's row in the county table.
+ROW = 'county'
+
+# The denormalized joined data written by earlier versions.
+JOINED_FILE = 'datasets/fData.csv'
+
+# Columns of the joined data holding one value per county: the Food
+# Environment Atlas columns, the per-FIPS IRS totals and the mean and
+# median income per person (see data_stages).
+COUNTY_COLUMNS = ([c for c in read_atlas_data.COUNTY_DTYPES if c != KEY]
+                  + ['N1_total_for_FIPS', 'total_people_total_for_FIPS',
+                     'mean_agi_per_person', 'median_mean_agi'])
+
+########################################################################
+# CLASSES
+
+
+class CountyTables:
+    """The joined data as a county table and an (agi_stub, county)
+    table."""
+
+    def __init__(self, counties, stubs, key=KEY, by=BY):
+        self.counties = counties
+        self.stubs = stubs
+        self.key = key
+        self.by = by
+        # First row of each agi_stub's block (and the end of the last).
+        values = stubs[by].to_numpy()
+        self.stub_values, starts = np.unique(values, return_index=True)
+        self._bounds = np.append(starts, len(values))
+
+    def __len__(self):
+        return len(self.counties)
+
+    @property
+    def county_columns(self):
+        return list(self.counties.columns)
+
+    @property
+    def stub_columns(self):
+        return [c for c in self.stubs.columns if c not in (ROW, self.by)]
+
+    def _columns(self, columns):
+        """columns split into (county columns, stub columns)."""
+        if columns is None:
+            return self.county_columns, self.stub_columns
+        unknown = (set(columns) - set(self.county_columns)
+                   - set(self.stub_columns))
+        if unknown:
+            raise KeyError('Unknown columns: {}'.format(sorted(unknown)))
+        return ([c for c in columns if c in self.counties.columns],
+                [c for c in columns if c not in self.counties.columns])
+
+    def rows(self, stub):
+        """Slice of the stub table holding agi_stub stub."""
+        i = np.searchsorted(self.stub_values, stub)
+        if i == len(self.stub_values) or self.stub_values[i] != stub:
+            raise KeyError(stub)
+        return slice(self._bounds[i], self._bounds[i + 1])
+
+    def _frame(self, county_columns, stub_columns, rows, head):
+        """Frame of the stub table's rows (a slice) with the county columns
+        alongside, after the columns in head."""
+        stubs = self.stubs.iloc[rows]
+        counties = self.counties
+        positions = stubs[ROW].to_numpy()
+        complete = (len(positions) == len(counties)
+                    and (positions == np.arange(len(counties))).all())
+        if not complete:
+            counties = counties.take(positions)
+
+        columns = dict(head)
+        columns[self.key] = counties.index.array
+        for column in county_columns:
+            columns[column] = counties[column].array
+        for column in stub_columns:
+            columns[column] = stubs[column].array
+        return pd.DataFrame(columns, copy=False)
+
+    def stub(self, stub, columns=None):
+        """Joined rows of agi_stub stub: FIPS key and columns (default:
+        all), one row per county."""
+        county_columns, stub_columns = self._columns(columns)
+        return self._frame(county_columns, stub_columns, self.rows(stub), {})
+
+    def joined(self, columns=None):
+        """Joined rows of every agi_stub: FIPS key, agi_stub and columns
+        (default: all), sorted by agi_stub and FIPS.
+
+        Unlike stub(), this copies: each county column is gathered into a
+        new array with a value per row. Ask for just the columns needed.
+        """
+        county_columns, stub_columns = self._columns(columns)
+        return self._frame(county_columns, stub_columns, slice(None),
+                           {self.by: self.stubs[self.by].array})
+
+    def memory_usage(self):
+        """Bytes held by the two tables."""
+        return int(self.counties.memory_usage(deep=True).sum()
+                   + self.stubs.memory_usage(deep=True).sum())
+
+    def save(self, directory):
+        """Write the tables to the folder directory."""
+        os.makedirs(directory, exist_ok=True)
+        columnar_cache.write_frame(self.counties.reset_index(),
+                                   os.path.join(directory, 'counties'),
+                                   codes={self.key: key_codec.FIPS_WIDTH})
+        columnar_cache.write_frame(self.stubs,
+                                   os.path.join(directory, 'stubs'))
+        with open(os.path.join(directory, 'tables.json'), 'w') as f:
+            json.dump({'key': self.key, 'by': self.by}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """Read tables written by save."""
+        with open(os.path.join(directory, 'tables.json')) as f:
+            names = json.load(f)
+        counties = columnar_cache.read_frame(
+            os.path.join(directory, 'counties')).set_index(names['key'])
+        stubs = columnar_cache.read_frame(os.path.join(directory, 'stubs'))
+        return cls(counties, stubs, names['key'], names['by'])
+
+########################################################################
+# FUNCTIONS
+
+
+def county_level(data, key=KEY):
+    """Columns of data that hold a single value per key."""
+    columns = [c for c in data.columns if c != key]
+    counts = data.groupby(key, sort=False)[columns].nunique(dropna=False)
+    return [c for c in columns if counts[c].max() <= 1]
+
+
+def split(data, key=KEY, by=BY, county_columns=None):
+    """Split the joined data into CountyTables.
+
+    county_columns (e.g. COUNTY_COLUMNS) go to the county table, taken
+    from each county's first row; those not in data are skipped. They
+    default to the columns found to be constant within every county (see
+    county_level), which takes a pass over the data. The rest, apart
+    from key and by, go to the stub table. Rows without a key are
+    dropped.
+    """
+    data = data[data[key].notna()]
+    if county_columns is None:
+        county_columns = [c for c in county_level(data, key) if c != by]
+    else:
+        county_columns = [c for c in county_columns if c in data.columns]
+    stub_columns = [c for c in data.columns
+                    if c not in county_columns and c not in (key, by)]
+
+    # The first row of each county holds its county columns.
+    codes = key_codec.encode(data[key], key_codec.FIPS_WIDTH)
+    first = ~pd.Index(codes).duplicated()
+    order = np.argsort(codes[first])
+    keys = codes[first][order]
+    counties = data[first].iloc[order][county_columns]
+    counties.index = pd.Index(key_codec.to_pandas(keys), name=key)
+
+    positions, _ = key_codec.find(keys, codes)
+    stubs = pd.DataFrame({ROW: positions.astype(np.int32),
+                          by: data[by].to_numpy()})
+    for column in stub_columns:
+        stubs[column] = data[column].array
+    stubs = stubs.sort_values([by, ROW], kind='stable', ignore_index=True)
+    return CountyTables(counties, stubs, key, by)
+
+
+def from_csv(path=JOINED_FILE):
+    """CountyTables of a denormalized joined CSV file like fData.csv."""
+    data = columnar_cache.read_csv(path, codes={KEY: key_codec.FIPS_WIDTH},
+                                   index_col=0)
+    return split(data, county_columns=COUNTY_COLUMNS)
+
+
+def _size(path):
+    """Bytes in the file or folder at path."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def main(argv=None):
+    """Convert a joined CSV file to normalized tables."""
+    argv = sys.argv[1:] if argv is None else argv
+    source = argv[0] if argv else JOINED_FILE
+    target = argv[1] if len(argv) > 1 else os.path.splitext(source)[0]
+    data = pd.read_csv(source, index_col=0, dtype={KEY: str})
+    tables = split(data, county_columns=COUNTY_COLUMNS)
+    tables.save(target)
+    print('{} rows -> {} counties x {} agi stubs.'.format(
+        len(data), len(tables), len(tables.stub_values)))
+    print('Memory: {:.2f} MB -> {:.2f} MB. Disk: {:.2f} MB -> {:.2f} MB.'
+          .format(data.memory_usage(deep=True).sum() / 1e6,
+                  tables.memory_usage() / 1e6, _size(source) / 1e6,
+                  _size(target) / 1e6))
+
+########################################################################
+# MAIN
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Module for apportioning zip code level data to counties.
+
+A zip code can straddle several counties (zipToFips.csv lists all of
+them). Rather than assigning each zip code to its first county, the
+crosswalk is held as a sparse (zip code x county) weight matrix, and all
+numeric columns for every agi_stub are apportioned to counties with a
+single sparse matrix product.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+# NOTE: scipy.sparse is imported where it's used, as read_irs (and so
+# every run) imports this module even when nothing is apportioned.
+
+# Project modules:
+import key_codec
+from fipsZipHandler import FipsZipHandler
+
+########################################################################
+# FUNCTIONS
+
+
+def crosswalk_matrix(fz_obj=None, weights=None):
+    """Build the sparse zip code -> county weight matrix.
+
+    By default each zip code's weight is split equally across the
+    counties it falls in. Alternatively, weights can be a DataFrame with
+    'zipcode', 'FIPS' and 'weight' columns (e.g. HUD residential ratios),
+    which is used as-is.
+
+    Returns a CSR matrix of shape (# zip codes, # counties), the sorted
+    zip code keys for the rows and the sorted FIPS keys for the columns
+    (see key_codec).
+    """
+    import scipy.sparse as sp
+
+    if weights is None:
+        if fz_obj is None:
+            fz_obj = FipsZipHandler()
+
+        # The handler's zip index is already in CSR form.
+        indptr = np.asarray(fz_obj.zipOffsets)
+        zips = np.asarray(fz_obj.zipKeys)
+        fips, indices = np.unique(np.asarray(fz_obj.zipFipsCodes),
+                                  return_inverse=True)
+        counts = np.diff(indptr)
+        data = np.repeat(1.0 / counts, counts)
+        matrix = sp.csr_matrix((data, indices, indptr),
+                               shape=(len(zips), len(fips)))
+    else:
+        zip_codes = key_codec.encode(weights['zipcode'], key_codec.ZIP_WIDTH)
+        fips_codes = key_codec.encode(weights['FIPS'], key_codec.FIPS_WIDTH)
+        valid = ((zip_codes != key_codec.MISSING)
+                 & (fips_codes != key_codec.MISSING))
+        zips, rows = np.unique(zip_codes[valid], return_inverse=True)
+        fips, cols = np.unique(fips_codes[valid], return_inverse=True)
+        matrix = sp.csr_matrix(
+            (np.asarray(weights['weight'], dtype=np.float64)[valid],
+             (rows, cols)), shape=(len(zips), len(fips)))
+
+    return matrix, zips, fips
+
+
+def apportion(irs_data, columns=None, crosswalk=None):
+    """Apportion IRS zip code data to (FIPS, agi_stub) totals.
+
+    Every row's values are spread over the counties of its zip code
+    according to the crosswalk weights. Rows with unknown zip codes or
+    NaN values are dropped, as in read_irs.aggregate_by_fips.
+
+    columns defaults to all numeric columns other than agi_stub and the
+    key columns (key_codec.KEY_COLUMNS), and crosswalk to the equal
+    weight matrix from crosswalk_matrix.
+    """
+    import scipy.sparse as sp
+
+    if crosswalk is None:
+        crosswalk = crosswalk_matrix()
+    matrix, zips, fips = crosswalk
+
+    if columns is None:
+        columns = [c for c in irs_data.select_dtypes('number').columns
+                   if c != 'agi_stub' and c not in key_codec.KEY_COLUMNS]
+    columns = list(columns)
+
+    # Position of each row's zip code in the crosswalk.
+    pos, found = key_codec.find(zips, key_codec.encode(irs_data['zipcode'],
+                                                       key_codec.ZIP_WIDTH))
+    values = irs_data[columns].to_numpy(dtype=np.float64)
+    keep = found & ~np.isnan(values).any(axis=1)
+    rows = np.flatnonzero(keep)
+    pos = pos[rows]
+    values = values[rows]
+
+    stubs, stub_codes = np.unique(irs_data['agi_stub'].values[rows],
+                                  return_inverse=True)
+
+    # Expand each row into one entry per county of its zip code.
+    counts = np.diff(matrix.indptr)[pos]
+    row_ids = np.repeat(np.arange(len(rows)), counts)
+    run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    entries = (np.repeat(matrix.indptr[pos], counts)
+               + np.arange(counts.sum()) - run_starts)
+    counties = matrix.indices[entries]
+
+    # One output row per (county, agi_stub) pair, one input column per
+    # IRS row.
+    out_rows = counties * len(stubs) + np.repeat(stub_codes, counts)
+    spread = sp.csr_matrix((matrix.data[entries], (out_rows, row_ids)),
+                           shape=(len(fips) * len(stubs), len(rows)))
+    totals = spread @ values
+
+    # Only keep (county, agi_stub) pairs that received any data.
+    present = np.flatnonzero(spread.getnnz(axis=1))
+    aggregated_data = pd.DataFrame(totals[present], columns=columns)
+    aggregated_data.insert(0, 'FIPS', key_codec.to_pandas(
+        fips[present // len(stubs)]))
+    aggregated_data.insert(1, 'agi_stub', stubs[present % len(stubs)])
+
+    return aggregated_data
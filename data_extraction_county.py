@@ -1,26 +1,121 @@
+"""
+Module for extracting county-wise data from the Food Atlas tables.
 
-# This code is used for extracting county-wise data from supplemental_data, health data and food security data
-# This does a left-join for ensuring FIPS consistency
+Each table is described by a (file, columns) spec. Only the FIPS column
+and the requested columns are read from each file, every table is
+indexed by FIPS, and all of them are joined onto the first (base) table
+in a single left join, which keeps the base table's FIPS codes. FIPS
+codes are joined as integer keys (see key_codec) and written back as
+zero padded strings. The result is written out atomically.
 
+Running this module builds Food_Atlas_County_2013.csv from the
+supplemental data, health data and food security tables.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
 import pandas as pd
-import numpy as np
 
+# Standard Library:
+import os
+
+# Project modules:
+import key_codec
+
+########################################################################
+# CONSTANTS
+
+# Column shared by all the tables.
+KEY = 'FIPS'
+
+# The Food Atlas CSVs aren't UTF-8.
+ENCODING = 'cp1252'
+
+# The key is parsed as a string (keeping leading zeros) and then encoded.
 COUNTY_DTYPES = {'FIPS': str, 'State': str, 'County': str}
-df1 = pd.read_csv('datasets/Food_Atlas_supplemental_data.csv', encoding='cp1252', dtype=COUNTY_DTYPES)
-df2 = pd.read_csv('datasets/Food_Atlas_health_data.csv', encoding='cp1252', dtype=COUNTY_DTYPES)
-df3 = pd.read_csv('datasets/Food_Atlas_food_security.csv', encoding='cp1252', dtype=COUNTY_DTYPES)
 
-# left join for supplemental data, health data
-df_intermed = df1.merge(df2, left_on='FIPS', right_on='FIPS', how='left')
+# (file, columns) to take from each table. The first table is the base of
+# the left join.
+SPECS = [
+    ('datasets/Food_Atlas_supplemental_data.csv',
+     ['Population Estimate, 2013']),
+    ('datasets/Food_Atlas_health_data.csv',
+     ['PCT_DIABETES_ADULTS13', 'PCT_OBESE_ADULTS13']),
+    ('datasets/Food_Atlas_food_security.csv',
+     ['State', 'County', 'FOODINSEC_13_15', 'VLFOODSEC_13_15']),
+]
+
+# final columns to extract, in order.
+COLUMNS = ['FIPS', 'State', 'County', 'Population Estimate, 2013',
+           'PCT_DIABETES_ADULTS13', 'PCT_OBESE_ADULTS13', 'FOODINSEC_13_15',
+           'VLFOODSEC_13_15']
+
+OUTPUT_FILE = 'Food_Atlas_County_2013.csv'
+
+########################################################################
+# FUNCTIONS
+
+
+def read_table(path, columns, key=KEY, encoding=ENCODING):
+    """Read just key and columns from a CSV, indexed by key (as integer
+    keys)."""
+    usecols = [key] + [c for c in columns if c != key]
+    dtype = {c: t for c, t in COUNTY_DTYPES.items() if c in usecols}
+    table = pd.read_csv(path, usecols=usecols, dtype=dtype,
+                        encoding=encoding, index_col=key)
+    table.index = pd.Index(key_codec.encode_column(table.index,
+                                                   key_codec.FIPS_WIDTH),
+                           name=key)
+    return table
+
+
+def join_tables(specs, key=KEY, encoding=ENCODING):
+    """Left join the columns of every spec onto the first spec's table.
+
+    specs is a list of (file, columns). Each column may only be taken
+    from one table. Returns a DataFrame with key as a column, followed by
+    the columns in spec order.
+    """
+    seen = {}
+    for path, columns in specs:
+        for column in columns:
+            if column in seen:
+                raise ValueError('Column {} requested from both {} and '
+                                 '{}.'.format(column, seen[column], path))
+            seen[column] = path
+
+    tables = [read_table(path, columns, key, encoding)
+              for path, columns in specs]
+
+    # One join of all the tables on their shared index.
+    joined = tables[0].join(tables[1:], how='left') if len(tables) > 1 \
+        else tables[0]
+    return joined.reset_index()
+
+
+def write_csv(data, path):
+    """Write data to path as CSV, replacing any existing file atomically."""
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        data.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 
-# left join for previous data, food security
-df_final = df_intermed.merge(df3, left_on='FIPS', right_on='FIPS', how='left')
+def extract(specs=SPECS, columns=COLUMNS, output=OUTPUT_FILE):
+    """Join the spec'd tables and write columns to output."""
+    data = join_tables(specs)[columns]
+    output_data = data.copy()
+    output_data[KEY] = key_codec.decode(data[KEY], key_codec.FIPS_WIDTH)
+    write_csv(output_data, output)
+    return data
 
-# final columns to extract
-col_list = ['FIPS', 'State', 'County', 'Population Estimate, 2013', 'PCT_DIABETES_ADULTS13', 'PCT_OBESE_ADULTS13', 'FOODINSEC_13_15', 'VLFOODSEC_13_15']
-df = df_final[col_list]
+########################################################################
+# MAIN
 
-# save to csv
-df.to_csv('Food_Atlas_County_2013.csv', index=False)
 
+if __name__ == '__main__':
+    extract()
@@ -0,0 +1,278 @@
+"""
+Module for the data stages of the analysis pipeline.
+
+These are the stages that join and derive the data behind the report
+(see analysis.build_pipeline). They're kept apart from the plotting code
+in analysis.py, so the pipeline's hash of their source doesn't change
+when a figure or its styling does, and the data stages aren't re-run.
+
+IRS data of several years (read_irs.get_irs_data(years=...)) has a
+'year' column. Per-county values are then computed per (year, FIPS):
+the feature store gets one '<column> <year>' column per year, and the
+mean and median income are those of the row's year.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import logging
+import os
+from functools import partial
+
+# Project modules:
+import county_tables
+import feature_store
+import instrument
+import key_codec
+import metric_cube
+import read_cdc
+import weighted_stats
+
+########################################################################
+# CONSTANTS
+
+# IRS columns summed over the agi_stubs for the feature store; they're
+# registered as '<column>_total_for_FIPS'.
+IRS_TOTAL_COLUMNS = ['N1', 'MARS1', 'MARS2', 'MARS4', 'NUMDEP', 'A00100',
+                     'A02650', 'total_people']
+
+# Prefixes of the feature store columns of the CDC measures and of the
+# old joined file (whose columns repeat the other datasets' names).
+CDC_PREFIX = 'CDC '
+JOINED_FILE_PREFIX = 'fData '
+
+# build_store logs the feature store coverage at the INFO level.
+logger = logging.getLogger(__name__)
+
+########################################################################
+# FUNCTIONS
+
+
+def _frame(data):
+    """Loader for a table that's already in memory (partial() of it
+    pickles with the store, unlike a lambda)."""
+    return data
+
+
+def _years(irs_data):
+    """Years of the IRS data; [None] if it has no year column."""
+    if 'year' not in irs_data.columns:
+        return [None]
+    return sorted(irs_data['year'].unique().tolist())
+
+
+def _year_columns(columns, years):
+    """Feature store names of columns for each of years (see _years)."""
+    return [c if y is None else '{} {}'.format(c, y)
+            for y in years for c in columns]
+
+
+def _county_keys(irs_data):
+    """Columns of irs_data to group per-county values on."""
+    return [irs_data[c] for c in ('FIPS', 'year') if c in irs_data.columns]
+
+
+def _per_county(frame):
+    """frame, indexed by FIPS or by (FIPS, year), as one row per county
+    with a '<column> <year>' column per year in the second case."""
+    if frame.index.nlevels > 1:
+        frame = frame.unstack('year')
+        frame.columns = ['{} {}'.format(c, y) for c, y in frame.columns]
+    return frame.rename_axis('FIPS').reset_index()
+
+
+def _irs_totals(irs_data):
+    """Per-county (and year) sums of the IRS columns over the
+    agi_stubs."""
+    totals = irs_data[IRS_TOTAL_COLUMNS].groupby(
+        _county_keys(irs_data), observed=True).sum()
+    return _per_county(totals.add_suffix('_total_for_FIPS'))
+
+
+def _irs_distribution(irs_data):
+    """Weighted mean, quantiles and Gini coefficient of each county's
+    (and year's) agi_per_person over its agi_stubs (see
+    weighted_stats.distribution_features)."""
+    if 'year' not in irs_data.columns:
+        return _per_county(weighted_stats.distribution_features(irs_data))
+    features = pd.concat(
+        {year: weighted_stats.distribution_features(rows)
+         for year, rows in irs_data.groupby('year')}, names=['year'])
+    return _per_county(features)
+
+
+def _cdc_expected(cdc_data, irs_data):
+    """Each county's CDC measures weighted by its people per agi_stub
+    (see read_cdc.stub_measures): the rates its income mix implies."""
+    measures = read_cdc.stub_measures(cdc_data, irs_data['agi_stub'])
+    people = irs_data['total_people']
+    keys = _county_keys(irs_data)
+    weighted = measures.mul(people, axis=0).groupby(keys).sum(min_count=1)
+    weights = measures.notna().mul(people, axis=0).groupby(keys).sum()
+    return _per_county((weighted / weights).add_prefix(CDC_PREFIX))
+
+
+def _joined_file_counties(path):
+    """County table of the old joined file (see county_tables)."""
+    counties = county_tables.from_csv(path).counties
+    return counties.add_prefix(JOINED_FILE_PREFIX).reset_index()
+
+
+@instrument.stage()
+def build_store(irs_data, atlas_data, cdc_data=None,
+                joined_file=county_tables.JOINED_FILE, fz_obj=None):
+    """The feature store shared by every reader's county level data.
+
+    Registers the Food Environment Atlas county table ('atlas'), the
+    IRS totals per county ('irs'), the weighted income distribution of
+    each county ('irs_distribution'), the CDC measures implied by each
+    county's income mix ('cdc', if cdc_data is given) and the county
+    table of the old joined file ('joined_file', if it exists). The
+    datasets are loaded when first used; the coverage of every column
+    is logged if INFO messages are enabled. The IRS, income
+    distribution and CDC columns are per year if irs_data has several
+    (see the module docstring).
+    """
+    food_county, _ = atlas_data
+    years = _years(irs_data)
+    store = feature_store.FeatureStore(fz_obj)
+    store.register('atlas', partial(_frame, food_county),
+                   [c for c in food_county.columns if c != 'FIPS'])
+    store.register('irs', partial(_irs_totals, irs_data), _year_columns(
+        [c + '_total_for_FIPS' for c in IRS_TOTAL_COLUMNS], years))
+    store.register('irs_distribution', partial(_irs_distribution, irs_data),
+                   _year_columns(weighted_stats.feature_columns(), years))
+    if cdc_data is not None:
+        measures = read_cdc.band_matrix(cdc_data)[1]
+        store.register('cdc', partial(_cdc_expected, cdc_data, irs_data),
+                       _year_columns([CDC_PREFIX + m for m in measures],
+                                     years))
+    if joined_file is not None and os.path.exists(joined_file):
+        counties = _joined_file_counties(joined_file)
+        store.register('joined_file', partial(_frame, counties),
+                       [c for c in counties.columns if c != 'FIPS'])
+
+    # The coverage loads every dataset, so only compute it if it's shown.
+    if logger.isEnabledFor(logging.INFO):
+        with pd.option_context('display.width', 160):
+            logger.info('Feature store coverage of %d counties:\n%s',
+                        len(store), store.coverage().to_string())
+    return store
+
+
+@instrument.stage()
+def join_data(irs_data, store):
+    """Join the IRS data with the county Food Environment Atlas data
+    from the shared feature store (see build_store).
+
+    The Atlas has one value per county, so every year of multi-year IRS
+    data gets the same county features.
+    """
+
+    # Join the IRS data and county Food Environment Atlas data by FIPS
+    # code. Since the IRS data has multiple entries per FIPS code, we'll
+    # join on the IRS data. The county features are taken from the
+    # feature store by row, so this is an array lookup rather than a
+    # merge.
+    columns = store.dataset_columns('atlas')
+    features = store.gather(columns, irs_data['FIPS'])
+    features.index = irs_data.index
+    joined_data = pd.concat([irs_data, features], axis=1)
+    coverage = store.coverage(columns, irs_data['FIPS'].unique())
+    print('IRS counties without Food Environment Atlas data, per column:')
+    print(coverage['missing'].to_string())
+
+    # How many NaN's do we have?
+    total_rows = joined_data.shape[0]
+    nan_rows = joined_data.isnull().sum().max()
+    joined_data.dropna(inplace=True)
+    print('In the joined data, {} rows were be dropped out of {}.'.format(
+        nan_rows, total_rows))
+
+    return joined_data
+
+
+@instrument.stage()
+def compute_mean_medians(data):
+    """Add approximate mean and median income per person for each FIPS
+    (and year, if data has a year column).
+
+    Adds 'mean_agi_per_person' (total AGI over total people) and
+    'median_mean_agi' (the agi_per_person of the agi_stub holding the
+    median person) columns.
+    """
+    # Overall mean income per FIPS, from the per-FIPS sums taken for
+    # each row.
+    totals = data[['total_people', 'A00100']].groupby(
+        _county_keys(data)).transform('sum')
+    data = data.copy()
+    data['mean_agi_per_person'] = (totals['A00100'] * 1000
+                                   / totals['total_people'])
+
+    # Compute median of means: the agi_per_person of the agi_stub holding
+    # each FIPS code's median person, all FIPS codes (and years) at once.
+    codes = key_codec.encode(data['FIPS'], key_codec.FIPS_WIDTH)
+    groups = codes.astype(np.int64)
+    if 'year' in data.columns:
+        groups += (data['year'].to_numpy(dtype=np.int64)
+                   * (int(key_codec.MISSING) + 1))
+    keys, medians = weighted_stats.weighted_quantiles(
+        groups, data['agi_per_person'].to_numpy(),
+        data['total_people'].to_numpy(), 0.5,
+        order=data['agi_stub'].to_numpy())
+    median = medians[np.searchsorted(keys, groups), 0]
+    median[codes == key_codec.MISSING] = np.nan
+    data['median_mean_agi'] = median
+
+    return data
+
+
+def select_year(data, year):
+    """Rows of one year of multi-year data, without the year column;
+    data without a year column is returned as is."""
+    if 'year' not in data.columns:
+        return data
+    rows = data[data['year'] == year]
+    if not len(rows):
+        raise KeyError('No rows for year {}.'.format(year))
+    return rows.drop(columns='year')
+
+
+@instrument.stage()
+def compare_states(cube, atlas_data, health_columns):
+    """Compare state roll-ups of the county data with the Food
+    Environment Atlas state table.
+
+    Returns one row per state with its number of counties, the sum of
+    their population estimates next to the state population, their
+    population weighted health_columns and the mean AGI per person over
+    all agi_stubs.
+    """
+    _, food_state = atlas_data
+    population = 'Population Estimate, 2013'
+    states, counties = np.unique(cube.keys // metric_cube.STATE_DIVISOR,
+                                 return_counts=True)
+    result = pd.DataFrame({
+        'StateFIPS': key_codec.to_pandas(states),
+        'counties': counties,
+        'county_population': cube.state_totals(population),
+        'mean_agi_per_person': (cube.state_totals('A00100').sum(axis=1)
+                                * 1000 / cube.state_totals('total_people')
+                                .sum(axis=1)),
+    })
+    for column in health_columns:
+        result[column] = cube.weighted_mean(column, population)
+
+    # The state table's counts are text with thousands separators.
+    state = food_state[['StateFIPS', 'State']].copy()
+    state['state_population'] = pd.to_numeric(
+        food_state['State Population,  2013'].astype(str)
+        .str.replace(',', ''))
+    result = result.merge(state, on='StateFIPS', how='left')
+    result['population_coverage'] = (result['county_population']
+                                     / result['state_population'])
+    return result
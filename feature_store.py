@@ -0,0 +1,221 @@
+"""
+Module for a FIPS-indexed, in-memory store of county features.
+
+Every county in fipsToNameAndState.csv gets a dense integer row. Datasets
+register the columns they provide together with a loader; the first time
+one of those columns is needed the loader is called and each column is
+scattered into an array with one entry per row (NaN, or a -1 category
+code, for counties the dataset doesn't cover). Joining features onto any
+table of FIPS codes is then a single array take, and any subset of
+features can be pulled for any set of counties without a merge.
+
+The store is also where coverage is measured: which counties each column
+is missing, and which FIPS codes a dataset has that aren't counties.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Project modules:
+import key_codec
+from fipsZipHandler import FipsZipHandler
+
+########################################################################
+# CONSTANTS
+
+# Column holding the FIPS codes in registered datasets.
+KEY = 'FIPS'
+
+########################################################################
+# CLASSES
+
+
+class FeatureStore:
+    """County features as arrays aligned on a dense row per FIPS code."""
+
+    def __init__(self, fz_obj=None):
+        if fz_obj is None:
+            fz_obj = FipsZipHandler()
+        # Sorted FIPS keys (see key_codec); a county's row is its
+        # position.
+        self.keys = np.asarray(fz_obj.nameKeys)
+        self.datasets = {}
+        self.columns = {}
+        self._arrays = {}
+        self._stats = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def fips(self):
+        """FIPS code of every row, as zero padded strings."""
+        return key_codec.decode(self.keys, key_codec.FIPS_WIDTH)
+
+    def register(self, name, loader, columns, key=KEY):
+        """Register a dataset without loading it.
+
+        loader() must return a DataFrame with a key column of FIPS codes
+        and one row per county, holding at least the given columns;
+        loading it raises a ValueError if a county has several rows.
+        """
+        if name in self.datasets:
+            raise ValueError('Dataset {} is already registered.'.format(name))
+        for column in columns:
+            if column in self.columns:
+                raise ValueError('Column {} is already provided by dataset '
+                                 '{}.'.format(column, self.columns[column]))
+        self.datasets[name] = (loader, list(columns), key)
+        for column in columns:
+            self.columns[column] = name
+
+    def dataset_columns(self, name):
+        """Columns registered by a dataset."""
+        return list(self.datasets[name][1])
+
+    def rows(self, fips):
+        """Row of each FIPS code (strings or integer keys); -1 if
+        unknown."""
+        pos, found = key_codec.find(
+            self.keys, key_codec.encode(fips, key_codec.FIPS_WIDTH))
+        return np.where(found, pos, -1)
+
+    def _load(self, name):
+        """Call a dataset's loader and align its columns to the rows."""
+        loader, columns, key = self.datasets[name]
+        data = loader()
+        rows = self.rows(data[key])
+        matched = rows >= 0
+        duplicated = pd.Index(rows[matched]).duplicated()
+        if duplicated.any():
+            raise ValueError('{} duplicate {} rows in dataset {}.'.format(
+                duplicated.sum(), key, name))
+
+        for column in columns:
+            values = data[column]
+            if pd.api.types.is_numeric_dtype(values.dtype):
+                array = np.full(len(self), np.nan)
+                array[rows[matched]] = values.to_numpy(
+                    dtype=np.float64, na_value=np.nan)[matched]
+                self._arrays[column] = array
+            else:
+                # Text columns are kept as category codes.
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    codes = values.cat.codes.to_numpy()
+                    categories = values.cat.categories
+                else:
+                    codes, categories = pd.factorize(values)
+                    categories = pd.Index(np.asarray(categories))
+                array = np.full(len(self), -1, dtype=np.int32)
+                array[rows[matched]] = codes[matched]
+                self._arrays[column] = (array, categories)
+
+        self._stats[name] = {
+            'rows': len(data),
+            'unmatched': int((~matched).sum()),
+            'unmatched_fips': pd.unique(
+                np.asarray(data[key])[~matched]).tolist(),
+        }
+
+    def array(self, column):
+        """Aligned array for column (loading its dataset if needed).
+
+        Numeric columns are float64 with NaN for missing counties; text
+        columns are (int32 codes with -1 for missing, categories).
+        """
+        if column not in self._arrays:
+            if column not in self.columns:
+                raise KeyError('No dataset provides column '
+                               '{}.'.format(column))
+            self._load(self.columns[column])
+        return self._arrays[column]
+
+    def present(self, column):
+        """Boolean array: which rows have a value for column."""
+        array = self.array(column)
+        if isinstance(array, tuple):
+            return array[0] >= 0
+        return ~np.isnan(array)
+
+    def take(self, columns, rows):
+        """DataFrame of columns for the given rows (which may repeat).
+
+        Rows of -1 come out as missing values.
+        """
+        rows = np.asarray(rows)
+        missing = rows < 0
+        safe = np.where(missing, 0, rows)
+        out = {}
+        for column in columns:
+            array = self.array(column)
+            if isinstance(array, tuple):
+                codes = array[0][safe]
+                codes[missing] = -1
+                out[column] = pd.Categorical.from_codes(codes, array[1])
+            else:
+                values = array[safe]
+                values[missing] = np.nan
+                out[column] = values
+        return pd.DataFrame(out)
+
+    def gather(self, columns, fips):
+        """DataFrame of columns aligned with a sequence of FIPS codes."""
+        return self.take(columns, self.rows(fips))
+
+    def frame(self, columns=None, fips=None):
+        """County level DataFrame indexed by FIPS code.
+
+        Defaults to every registered column and every county.
+        """
+        if columns is None:
+            columns = list(self.columns)
+        if fips is None:
+            rows = np.arange(len(self))
+        else:
+            rows = self.rows(fips)
+        data = self.take(columns, rows)
+        data.index = pd.Index(self.fips if fips is None else fips, name=KEY)
+        return data
+
+    def coverage(self, columns=None, fips=None):
+        """Coverage of each column over the counties fips (default: all
+        counties; unknown codes count as missing).
+
+        Returns a DataFrame indexed by column with its dataset, the
+        number of counties present and missing, the fraction present,
+        and the dataset's rows whose FIPS code isn't a known county.
+        """
+        if columns is None:
+            columns = list(self.columns)
+        rows = np.arange(len(self)) if fips is None else self.rows(fips)
+        known = rows[rows >= 0]
+        records = []
+        for column in columns:
+            present = int(self.present(column)[known].sum())
+            name = self.columns[column]
+            records.append({'column': column, 'dataset': name,
+                            'present': present,
+                            'missing': len(rows) - present,
+                            'coverage': present / max(len(rows), 1),
+                            'unmatched': self._stats[name]['unmatched']})
+        return pd.DataFrame(records).set_index('column')
+
+    def missing(self, column, fips=None):
+        """FIPS codes (of fips, default all counties) lacking column."""
+        if fips is None:
+            rows = np.arange(len(self))
+        else:
+            rows = self.rows(fips)
+            rows = rows[rows >= 0]
+        absent = rows[~self.present(column)[rows]]
+        return key_codec.decode(self.keys[absent], key_codec.FIPS_WIDTH)
+
+    def stats(self, name):
+        """Load statistics for a dataset (loading it if needed): rows,
+        unmatched rows and the unmatched FIPS codes."""
+        if name not in self._stats:
+            self._load(name)
+        return self._stats[name]
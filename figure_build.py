@@ -0,0 +1,142 @@
+"""
+Module for building the report's figures as independent jobs.
+
+Each figure is registered as a FigureJob: a module-level render function
+that returns a matplotlib figure, the slice of data it plots and its
+styling keyword arguments, plus the helpers it draws with and the
+global settings (e.g. rcParams) it relies on. build() hashes every job
+(data, style, settings and the source of the render function and its
+helpers) and only renders jobs whose hash changed since the last build
+or whose output files are missing. Those are rendered in parallel
+worker processes on the headless Agg backend (or in-process, on the
+caller's backend), saved in every requested format and closed straight
+away.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import pandas as pd
+
+# Standard Library:
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Project modules:
+import instrument
+
+########################################################################
+# CONSTANTS
+
+# Build manifest (job name -> hash), kept next to the figures.
+MANIFEST_FILE = '.figure_manifest.json'
+
+# Formats each figure is saved in.
+FORMATS = ('png', 'eps')
+
+########################################################################
+# CLASSES
+
+
+class FigureJob:
+    """A figure to build.
+
+    render(data, **style) must be a module-level function returning a
+    matplotlib figure. The figure is saved as '<name>.<format>'. depends
+    are the functions and modules render draws with, and settings a
+    dict of the global settings it uses; both are part of the hash.
+    """
+
+    def __init__(self, name, render, data, depends=(), settings=None,
+                 **style):
+        self.name = name
+        self.render = render
+        self.data = data
+        self.depends = tuple(depends)
+        self.settings = settings or {}
+        self.style = style
+
+    def __getstate__(self):
+        # Workers only render, and modules in depends can't be pickled.
+        state = self.__dict__.copy()
+        state['depends'] = ()
+        return state
+
+    def digest(self):
+        """Hash of everything that affects the rendered figure."""
+        sha = hashlib.sha256()
+        for code in (self.render,) + self.depends:
+            sha.update(inspect.getsource(code).encode())
+        for values in (self.style, self.settings):
+            sha.update(json.dumps(values, sort_keys=True,
+                                  default=repr).encode())
+        sha.update(json.dumps([str(c) for c in self.data.columns]).encode())
+        sha.update(pd.util.hash_pandas_object(self.data,
+                                              index=False).values.tobytes())
+        return sha.hexdigest()
+
+########################################################################
+# FUNCTIONS
+
+
+def _init_worker():
+    """Use the headless backend in worker processes."""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(job, formats):
+    """Render, save and close a single job's figure."""
+    import matplotlib.pyplot as plt
+
+    fig = job.render(job.data, **job.style)
+    try:
+        for fmt in formats:
+            fig.savefig('{}.{}'.format(job.name, fmt), format=fmt)
+    finally:
+        plt.close(fig)
+    return job.name
+
+
+@instrument.stage()
+def build(jobs, processes=None, formats=FORMATS, force=False,
+          manifest_file=MANIFEST_FILE):
+    """Render the jobs that changed since the last build.
+
+    Returns the names of the jobs that were rendered. processes is the
+    size of the worker pool (1 to render in-process); force re-renders
+    everything.
+    """
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    digests = {job.name: job.digest() for job in jobs}
+    todo = [job for job in jobs
+            if force or manifest.get(job.name) != digests[job.name]
+            or not all(os.path.exists('{}.{}'.format(job.name, fmt))
+                       for fmt in formats)]
+
+    if processes == 1 or len(todo) <= 1:
+        # In-process jobs use the caller's backend, which isn't ours to
+        # change.
+        built = [_render(job, formats) for job in todo]
+    else:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=_init_worker) as pool:
+            built = list(pool.map(_render, todo,
+                                  [formats] * len(todo)))
+
+    for name in built:
+        manifest[name] = digests[name]
+    tmp = '{}.{}.tmp'.format(manifest_file, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, manifest_file)
+
+    return built
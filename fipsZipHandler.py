@@ -5,72 +5,267 @@ Created on Tue Oct 23 18:02:19 2018
 @author: Harish K
 """
 
+import json
+import os
+
 import numpy as np
 
+import instrument
+import key_codec
+
 
 class FipsZipHandler:
     dataFilePrefix = 'datasets/'
     fipsToZipFile = 'fipsToZip.csv'
     zipToFipsFile = 'zipToFips.csv'
     fipsToNameAndStateFile = 'fipsToNameAndState.csv'
+    # Compiled index, rebuilt whenever one of the files above changes.
+    indexDir = '.fipsZipIndex'
+    indexVersion = 2
+    zipWidth = key_codec.ZIP_WIDTH
+    fipsWidth = key_codec.FIPS_WIDTH
     
-    def __init__(self):
-        fipsToZipMap, zipToFipsMap, fipsToCountyNameAndStateMap = self.__prepareAndGetDictionaries()
-        self.fipsToZipMap = fipsToZipMap
-        self.zipToFipsMap = zipToFipsMap
-        self.fipsToCountyNameAndStateMap = fipsToCountyNameAndStateMap
+    @instrument.stage('FipsZipHandler')
+    def __init__(self, useIndexCache=True):
+        # The crosswalks are held as sorted integer key arrays with
+        # offset/value arrays (CSR style): the values for keys[i] are
+        # values[offsets[i]:offsets[i + 1]], in file order.
+        index = self.__loadIndex() if useIndexCache else None
+        if index is None:
+            index = self.__buildIndex()
+            if useIndexCache:
+                self.__saveIndex(index)
+        self.zipKeys = index['zip_keys']
+        self.zipOffsets = index['zip_offsets']
+        self.zipFipsCodes = index['zip_values']
+        self.fipsKeys = index['fips_keys']
+        self.fipsOffsets = index['fips_offsets']
+        self.fipsZipCodes = index['fips_values']
+        self.nameKeys = index['name_keys']
+        self.countyNames = index['name_counties']
+        self.stateCodes = index['name_states']
+        self.__maps = {}
+        self.__formatted = {}
         
     def __loadAndGetData(self):
         fipsToZip = np.loadtxt(self.dataFilePrefix + self.fipsToZipFile, 
-                               dtype='str', delimiter=',')
+                               dtype='str', delimiter=',', ndmin=2)
         zipToFips = np.loadtxt(self.dataFilePrefix + self.zipToFipsFile,
-                               dtype='str', delimiter=',')
+                               dtype='str', delimiter=',', ndmin=2)
         fipsToNameAndState = np.loadtxt(
                 self.dataFilePrefix + self.fipsToNameAndStateFile, 
-                                        dtype='str', delimiter=',')
+                                        dtype='str', delimiter=',', ndmin=2)
         return fipsToZip, zipToFips, fipsToNameAndState
     
-    def __getDictionaryFromNumpyStringArray(self, npArray):
-        result = {}
-        for i in range(len(npArray)):
-            key = npArray[i,0]
-            value = []
-            for j in range(1, len(npArray[i])):
-                value += [npArray[i][j]]
-            if key not in result.keys():
-                result[key] = value
+    @staticmethod
+    def __groupByKey(keys, values):
+        # Stable sort so each key's values keep their file order, then
+        # collapse runs of equal keys into offsets.
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        uniqueKeys, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys)).astype(np.int64)
+        return uniqueKeys, offsets, values[order]
+    
+    def __buildIndex(self):
+        fipsToZip, zipToFips, fipsToNameAndState = self.__loadAndGetData()
+        index = {}
+        
+        # Keys and values are key_codec (uint32) codes.
+        zips = key_codec.encode(zipToFips[:, 0], self.zipWidth)
+        fips = key_codec.encode(zipToFips[:, 1], self.fipsWidth)
+        (index['zip_keys'], index['zip_offsets'],
+         index['zip_values']) = self.__groupByKey(zips, fips)
+        
+        fips = key_codec.encode(fipsToZip[:, 0], self.fipsWidth)
+        zips = key_codec.encode(fipsToZip[:, 1], self.zipWidth)
+        (index['fips_keys'], index['fips_offsets'],
+         index['fips_values']) = self.__groupByKey(fips, zips)
+        
+        # Names are one per FIPS, so keep the first row for each.
+        fips = key_codec.encode(fipsToNameAndState[:, 0], self.fipsWidth)
+        index['name_keys'], first = np.unique(fips, return_index=True)
+        index['name_counties'] = fipsToNameAndState[first, 1]
+        index['name_states'] = fipsToNameAndState[first, 2]
+        return index
+    
+    def __indexPath(self, name=''):
+        return os.path.join(self.dataFilePrefix, self.indexDir, name)
+    
+    def __sourceStamps(self):
+        # Size and modification time of each source file.
+        stamps = {}
+        for name in (self.fipsToZipFile, self.zipToFipsFile,
+                     self.fipsToNameAndStateFile):
+            stat = os.stat(self.dataFilePrefix + name)
+            stamps[name] = [stat.st_size, stat.st_mtime_ns]
+        return stamps
+    
+    def __loadIndex(self):
+        # Returns the memory-mapped index, or None if it's missing or stale.
+        try:
+            with open(self.__indexPath('manifest.json')) as f:
+                manifest = json.load(f)
+            if (manifest['version'] != self.indexVersion
+                    or manifest['sources'] != self.__sourceStamps()):
+                return None
+            return {name: np.load(self.__indexPath(name + '.npy'),
+                                  mmap_mode='r')
+                    for name in manifest['arrays']}
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def __saveIndex(self, index):
+        # Arrays first, manifest last, each through a temporary file so a
+        # concurrent reader never sees a partial index. Failing to write
+        # (e.g. a read-only checkout) just means rebuilding next time.
+        try:
+            os.makedirs(self.__indexPath(), exist_ok=True)
+            for name, array in index.items():
+                tmp = self.__indexPath('%s.%d.tmp' % (name, os.getpid()))
+                with open(tmp, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp, self.__indexPath(name + '.npy'))
+            manifest = {'version': self.indexVersion,
+                        'sources': self.__sourceStamps(),
+                        'arrays': sorted(index)}
+            tmp = self.__indexPath('manifest.%d.tmp' % os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp, self.__indexPath('manifest.json'))
+        except OSError:
+            pass
+    
+    @staticmethod
+    def formatCodes(codes, width): #Returns an object array of zero padded
+        #strings for integer codes
+        return np.char.zfill(np.asarray(codes).astype(str),
+                             width).astype(object)
+    
+    def __formattedValues(self, name):
+        # Zero padded strings for the lookup results, built on first use.
+        if name not in self.__formatted:
+            if name == 'zip_fips':
+                values = self.formatCodes(
+                        self.zipFipsCodes[self.zipOffsets[:-1]],
+                        self.fipsWidth)
+            elif name == 'fips_zips':
+                zips = self.formatCodes(self.fipsZipCodes, self.zipWidth)
+                values = np.empty(len(self.fipsKeys), dtype=object)
+                for i, (a, b) in enumerate(zip(self.fipsOffsets[:-1],
+                                               self.fipsOffsets[1:])):
+                    values[i] = zips[a:b].tolist()
+            elif name == 'counties':
+                values = np.array(self.countyNames, dtype=object)
             else:
-                result[key] = result[key] + value
+                values = np.array(self.stateCodes, dtype=object)
+            self.__formatted[name] = values
+        return self.__formatted[name]
+    
+    def __groupedMap(self, keys, offsets, values, keyWidth, valueWidth):
+        keys = self.formatCodes(keys, keyWidth)
+        values = self.formatCodes(values, valueWidth)
+        return {k: values[a:b].tolist()
+                for k, a, b in zip(keys, offsets[:-1], offsets[1:])}
+    
+    # The dictionaries are only built if the single-code lookups are used.
+    @property
+    def zipToFipsMap(self):
+        if 'zip' not in self.__maps:
+            self.__maps['zip'] = self.__groupedMap(
+                    self.zipKeys, self.zipOffsets, self.zipFipsCodes,
+                    self.zipWidth, self.fipsWidth)
+        return self.__maps['zip']
+    
+    @property
+    def fipsToZipMap(self):
+        if 'fips' not in self.__maps:
+            self.__maps['fips'] = self.__groupedMap(
+                    self.fipsKeys, self.fipsOffsets, self.fipsZipCodes,
+                    self.fipsWidth, self.zipWidth)
+        return self.__maps['fips']
+    
+    @property
+    def fipsToCountyNameAndStateMap(self):
+        if 'name' not in self.__maps:
+            self.__maps['name'] = {
+                    k: [str(c), str(s)] for k, c, s in zip(
+                            self.formatCodes(self.nameKeys, self.fipsWidth),
+                            self.countyNames, self.stateCodes)}
+        return self.__maps['name']
+    
+    @staticmethod
+    def encodeCodes(codes, width): #Returns an int64 array of the codes,
+        #-1 wherever a code isn't exactly width digits (see key_codec)
+        result = key_codec.encode(codes, width).astype(np.int64)
+        result[result == key_codec.MISSING] = -1
         return result
     
-    def __prepareAndGetDictionaries(self, ):
-        fipsToZip, zipToFips, fipsToNameAndState = self.__loadAndGetData()
-        fipsToZipsMap = self.__getDictionaryFromNumpyStringArray(fipsToZip)
-        zipToFipsMap = self.__getDictionaryFromNumpyStringArray(zipToFips)
-        fipsToCountyNameAndStateMap = self.__getDictionaryFromNumpyStringArray(
-                fipsToNameAndState)
-        return fipsToZipsMap, zipToFipsMap, fipsToCountyNameAndStateMap
+    @classmethod
+    def __searchSorted(cls, keys, codes, width):
+        # Returns the position of each code in the sorted keys array and a
+        # boolean mask telling which codes were actually found.
+        return key_codec.find(keys, key_codec.encode(codes, width))
+    
+    @staticmethod
+    def __alignedResult(values, pos, found, missing):
+        # Object array aligned with the input, holding missing wherever the
+        # code wasn't in the map.
+        result = np.full(len(found), missing, dtype=object)
+        result[found] = values[pos[found]]
+        return result
     
     def getFipsForZipcode(self, zipcode): #Returns a string containing the fips
         # Return NaN if the zip code isn't in the map.
         if zipcode not in self.zipToFipsMap.keys():
-            return np.NaN
+            return np.nan
         # Look up and return zip code
         return self.zipToFipsMap[zipcode][0]
         
     def getZipcodesForFips(self, fips): #Returns a list containing all the zips
         #in the county
         if fips not in self.fipsToZipMap.keys():
-            return np.NaN
+            return np.nan
         return self.fipsToZipMap[fips]
     
     def getCountyNameAndStateForFips(self, fips): #Returns a map containing
         #The state and the county for a fips
         if fips not in self.fipsToCountyNameAndStateMap.keys():
-            return np.NaN
+            return np.nan
         return {'state': self.fipsToCountyNameAndStateMap[fips][1], 
                 'county': self.fipsToCountyNameAndStateMap[fips][0]}
     
+    def getFipsForZipcodeArray(self, zipcodes, missing=np.nan): #Returns an
+        #array of fips aligned with zipcodes (a Series, array or list)
+        pos, found = self.__searchSorted(self.zipKeys, zipcodes,
+                                        self.zipWidth)
+        return self.__alignedResult(self.__formattedValues('zip_fips'), pos,
+                                    found, missing)
+    
+    def getFipsCodesForZipcodeArray(self, zipcodes): #Returns key_codec
+        #(uint32) fips codes aligned with zipcodes, MISSING where unknown
+        pos, found = self.__searchSorted(self.zipKeys, zipcodes,
+                                        self.zipWidth)
+        return np.where(found, self.zipFipsCodes[self.zipOffsets[pos]],
+                        key_codec.MISSING).astype(key_codec.DTYPE)
+    
+    def getZipcodesForFipsArray(self, fips, missing=np.nan): #Returns an array
+        #of zip lists aligned with fips
+        pos, found = self.__searchSorted(self.fipsKeys, fips,
+                                        self.fipsWidth)
+        return self.__alignedResult(self.__formattedValues('fips_zips'), pos,
+                                    found, missing)
+    
+    def getCountyNameAndStateForFipsArray(self, fips, missing=np.nan):
+        #Returns a map of state and county arrays aligned with fips
+        pos, found = self.__searchSorted(self.nameKeys, fips,
+                                        self.fipsWidth)
+        return {'state': self.__alignedResult(
+                        self.__formattedValues('states'), pos, found, missing),
+                'county': self.__alignedResult(
+                        self.__formattedValues('counties'), pos, found,
+                        missing)}
+    
     def getCountyNameAndStateForZip(self, zipcode): #Returns a map containing 
         #The state and the county for a zip
         return self.getCountyNameAndStateForFips(
@@ -0,0 +1,194 @@
+"""
+Module for fitting polynomial trends of health vs. income in bulk.
+
+For every group (agi_stub), income column, health column and candidate
+degree, a least-squares polynomial is fitted. Rather than calling
+np.polyfit in a loop, the rows of all groups are padded into one array,
+each (group, income) pair gets a Vandermonde matrix of the standardized
+income, and the normal equations of every (group, income, health,
+degree) fit are solved in one batched call. Lower degrees are embedded
+in the highest one with their unused coefficients pinned to zero, so all
+degrees share the same system size.
+
+Fits are scored by R^2 on all rows and by k-fold cross-validated R^2.
+Each fold's training system is the full system minus that fold's
+contribution, so cross-validation is one more batched solve rather than
+k refits.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+########################################################################
+# CONSTANTS
+
+# Candidate polynomial degrees.
+DEGREES = (1, 2)
+
+# Number of cross-validation folds.
+FOLDS = 5
+
+# Points in each fitted curve.
+GRID_POINTS = 100
+
+########################################################################
+# FUNCTIONS
+
+
+def _pad(data, columns, codes, positions, n_groups, length):
+    """(group, row, column) array of data[columns], NaN padded."""
+    out = np.full((n_groups, length, len(columns)), np.nan)
+    out[codes, positions] = data[columns].to_numpy(dtype=np.float64)
+    return out
+
+
+def _solve(a, b, degree_masks):
+    """Solve a @ coef = b for every degree at once.
+
+    a is (..., P, P) and b is (..., P). Returns (..., # degrees, P), with
+    coefficients above each degree equal to zero.
+    """
+    keep = degree_masks[:, :, None] & degree_masks[:, None, :]
+    eye = np.eye(a.shape[-1])
+    a = np.where(keep, a[..., None, :, :], eye * ~degree_masks[:, :, None])
+    b = np.where(degree_masks, b[..., None, :], 0)
+    # pinv copes with groups too small for the higher degrees.
+    return np.einsum('...pq,...q->...p', np.linalg.pinv(a), b)
+
+
+def fit_polynomials(data, health_columns, income_columns, by='agi_stub',
+                    degrees=DEGREES, folds=FOLDS, seed=0,
+                    grid=GRID_POINTS):
+    """Fit every health column against every income column per group.
+
+    Returns (scores, curves):
+        - scores: DataFrame with one row per (by, health, income, degree)
+          giving n, r2, cv_r2 (mean out-of-fold R^2 over folds; NaN if
+          folds < 2) and best (the degree with the highest cv_r2, or r2
+          without cross-validation, per (by, health, income)).
+        - curves: dict mapping (group, health, income) to (x, y) arrays
+          of the best fit evaluated on grid points spanning the data.
+    """
+    health_columns = list(health_columns)
+    income_columns = list(income_columns)
+    degrees = sorted(degrees)
+    n_params = degrees[-1] + 1
+    degree_masks = np.arange(n_params)[None, :] <= np.array(degrees)[:, None]
+
+    # Pad the groups' rows into (group, row, column) arrays.
+    if by is None:
+        codes = np.zeros(len(data), dtype=np.intp)
+        groups = [None]
+    else:
+        codes, groups = pd.factorize(data[by], sort=True)
+    counts = np.bincount(codes, minlength=len(groups))
+    order = np.argsort(codes, kind='stable')
+    positions = np.empty(len(data), dtype=np.intp)
+    positions[order] = np.arange(len(data)) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    x = _pad(data, income_columns, codes, positions, len(groups),
+             counts.max())
+    y = _pad(data, health_columns, codes, positions, len(groups),
+             counts.max())
+
+    # Rows usable by each (group, row, income, health) fit.
+    mask = (~np.isnan(x))[..., :, None] & (~np.isnan(y))[..., None, :]
+    x = np.nan_to_num(x)
+    y = np.nan_to_num(y)
+
+    # Standardize income per (group, income) for a well conditioned
+    # Vandermonde matrix: (group, income, row, power).
+    valid_x = mask.any(axis=-1)
+    n_x = valid_x.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = (x * valid_x).sum(axis=1) / n_x
+        sigma = np.sqrt((((x - mu[:, None]) * valid_x) ** 2).sum(axis=1)
+                        / n_x)
+    sigma = np.where(sigma > 0, sigma, 1)
+    z = np.nan_to_num((x - mu[:, None]) / sigma[:, None])
+    vander = np.moveaxis(z, 1, 2)[..., None] ** np.arange(n_params)
+
+    # Normal equations for every (group, income, health).
+    w = mask.astype(np.float64)
+    a = np.einsum('glih,gilp,gilq->gihpq', w, vander, vander,
+                  optimize=True)
+    b = np.einsum('glih,gilp,glh->gihp', w, vander, y, optimize=True)
+    coef = _solve(a, b, degree_masks)
+
+    # R^2 on all rows: (group, income, health, degree).
+    pred = np.einsum('gilp,gihdp->glihd', vander, coef, optimize=True)
+    n = w.sum(axis=1)
+    y_mean = np.einsum('glih,glh->gih', w, y) / np.where(n > 0, n, 1)
+    ss_tot = np.einsum('glih,glih->gih', w,
+                       (y[:, :, None, :] - y_mean[:, None]) ** 2)
+    ss_res = np.einsum('glih,glihd->gihd', w,
+                       (y[:, :, None, :, None] - pred) ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r2 = 1 - ss_res / ss_tot[..., None]
+
+    # k-fold cross-validation: fold f trains on everything but f.
+    if folds >= 2:
+        rng = np.random.default_rng(seed)
+        fold = rng.permutation(x.shape[1]) % folds
+        one_hot = (fold[None, :] == np.arange(folds)[:, None]).astype(float)
+        wf = np.einsum('fl,glih->fglih', one_hot, w)
+        a_fold = np.einsum('fglih,gilp,gilq->fgihpq', wf, vander, vander,
+                           optimize=True)
+        b_fold = np.einsum('fglih,gilp,glh->fgihp', wf, vander, y,
+                           optimize=True)
+        coef_cv = _solve(a[None] - a_fold, b[None] - b_fold, degree_masks)
+        pred_cv = np.einsum('gilp,fgihdp->fglihd', vander, coef_cv,
+                            optimize=True)
+        ss_res_cv = np.einsum('fglih,fglihd->fgihd', wf,
+                              (y[None, :, :, None, :, None] - pred_cv) ** 2)
+        n_f = wf.sum(axis=2)
+        mean_f = np.einsum('fglih,glh->fgih', wf, y) / np.where(n_f > 0,
+                                                                n_f, 1)
+        ss_tot_cv = np.einsum('fglih,fglih->fgih', wf,
+                              (y[None, :, :, None, :]
+                               - mean_f[:, :, None]) ** 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cv_r2 = np.nanmean(1 - ss_res_cv / ss_tot_cv[..., None], axis=0)
+    else:
+        cv_r2 = np.full(r2.shape, np.nan)
+
+    # Best degree per fit; lowest degree wins ties and all-NaN scores.
+    criterion = cv_r2 if folds >= 2 else r2
+    best = np.argmax(np.nan_to_num(criterion, nan=-np.inf), axis=-1)
+
+    # Tidy scores.
+    g, i, h, d = np.indices(r2.shape).reshape(4, -1)
+    scores = pd.DataFrame({
+        'health': np.array(health_columns, dtype=object)[h],
+        'income': np.array(income_columns, dtype=object)[i],
+        'degree': np.array(degrees)[d],
+        'n': n[g, i, h].astype(int),
+        'r2': r2.ravel(),
+        'cv_r2': cv_r2.ravel(),
+        'best': best[g, i, h] == d,
+    })
+    if by is not None:
+        scores.insert(0, by, np.asarray(groups)[g])
+
+    # Best curves on a grid over each (group, income)'s data.
+    with np.errstate(invalid='ignore'):
+        lo = np.where(valid_x, x, np.inf).min(axis=1)
+        hi = np.where(valid_x, x, -np.inf).max(axis=1)
+    steps = np.linspace(0, 1, grid)
+    x_grid = lo[..., None] + (hi - lo)[..., None] * steps
+    z_grid = (x_grid - mu[..., None]) / sigma[..., None]
+    best_coef = np.take_along_axis(coef, best[..., None, None],
+                                   axis=3)[..., 0, :]
+    y_grid = np.einsum('gikp,gihp->gihk',
+                       z_grid[..., None] ** np.arange(n_params), best_coef)
+    curves = {}
+    for gi, group in enumerate(groups):
+        for ii, income in enumerate(income_columns):
+            for hi_, health in enumerate(health_columns):
+                curves[(group, health, income)] = (x_grid[gi, ii],
+                                                   y_grid[gi, ii, hi_])
+
+    return scores, curves
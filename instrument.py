@@ -0,0 +1,216 @@
+"""
+Module for optional per-stage timing and memory instrumentation.
+
+Functions are marked as stages with the @stage decorator. While
+instrumentation is off the decorator returns the function unchanged, so
+it costs nothing. It's switched on either by setting the environment
+variable named in ENV_VAR before the modules are imported, or by calling
+enable() (e.g. from a --profile command line flag), which swaps every
+registered stage for its instrumented version in place.
+
+Each call of an instrumented stage records its wall time, CPU time, peak
+traced memory (tracemalloc) and rows in (its first argument) and out.
+Nested stages are recorded with their parent. report() writes the
+records as JSON and returns a summary table; with ENV_VAR set that's
+done automatically at exit.
+
+Stages run in worker processes (e.g. several IRS years at once) aren't
+recorded, only the call that dispatched them.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import atexit
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+########################################################################
+# CONSTANTS
+
+# Set this environment variable (to anything but '' or '0') to switch
+# instrumentation on.
+ENV_VAR = 'ANALYSIS_PROFILE'
+
+# Where report() writes the JSON records by default.
+REPORT_FILE = 'profile_report.json'
+
+########################################################################
+# FUNCTIONS
+
+# Whether stages are instrumented.
+enabled = os.environ.get(ENV_VAR, '') not in ('', '0')
+
+# Every decorated stage as (module name, qualified name, stage name,
+# original function).
+_registry = []
+
+# Finished calls, and the calls in progress (innermost last).
+records = []
+_stack = []
+
+# Set in forked worker processes, where stages just run.
+_worker = False
+
+
+def _rows(obj):
+    """Row count of a DataFrame/Series/array, or of a tuple/list of
+    them; None for anything else."""
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(obj)
+    if isinstance(obj, (tuple, list)) and obj:
+        counts = [_rows(o) for o in obj]
+        if all(c is not None for c in counts):
+            return sum(counts)
+    return None
+
+
+def _instrumented(func, name):
+    """Wrap func to record a stage named name on every call."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _worker:
+            return func(*args, **kwargs)
+
+        # Fold the peak so far into the caller's record, then measure
+        # this call's peak on its own.
+        if _stack:
+            _stack[-1]['abs_peak'] = max(_stack[-1]['abs_peak'],
+                                         tracemalloc.get_traced_memory()[1])
+        elif not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        frame = {'start': tracemalloc.get_traced_memory()[0], 'abs_peak': 0}
+        record = {'stage': name, 'depth': len(_stack),
+                  'parent': _stack[-1]['record']['stage'] if _stack else None,
+                  'rows_in': _rows(args[0]) if args else None}
+        frame['record'] = record
+        _stack.append(frame)
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            _stack.pop()
+            abs_peak = max(frame['abs_peak'],
+                           tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = (abs_peak - frame['start']) / 2 ** 20
+            if _stack:
+                _stack[-1]['abs_peak'] = max(_stack[-1]['abs_peak'],
+                                             abs_peak)
+                tracemalloc.reset_peak()
+            records.append(record)
+        record['rows_out'] = _rows(result)
+        return result
+
+    wrapper.__wrapped_stage__ = func
+    return wrapper
+
+
+def stage(name=None):
+    """Decorator marking a function (or method) as a stage.
+
+    name defaults to '<module>.<qualified name>'. Returns the function
+    unchanged unless instrumentation is enabled.
+    """
+    def decorator(func):
+        stage_name = name or '{}.{}'.format(func.__module__,
+                                            func.__qualname__)
+        _registry.append((func.__module__, func.__qualname__, stage_name,
+                          func))
+        if enabled:
+            return _instrumented(func, stage_name)
+        return func
+    return decorator
+
+
+def enable():
+    """Switch instrumentation on for every registered stage.
+
+    Stages are replaced on their module or class, so callers that look
+    them up through it (module.function, or calls within the module)
+    get the instrumented version. The report is written at exit.
+    """
+    global enabled
+    if enabled:
+        return
+    enabled = True
+    atexit.register(_report_at_exit)
+    for module_name, qualname, stage_name, func in _registry:
+        owner = sys.modules[module_name]
+        *path, attr = qualname.split('.')
+        for part in path:
+            owner = getattr(owner, part)
+        setattr(owner, attr, _instrumented(func, stage_name))
+
+
+def summary(rows=None):
+    """Table of the records totalled by stage, in first call order."""
+    if rows is None:
+        rows = records
+    if not rows:
+        return 'No stages recorded.'
+    data = pd.DataFrame(rows)
+    order = pd.unique(data['stage'])
+    table = data.groupby('stage', sort=False).agg(
+        calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'),
+        cpu_s=('cpu_s', 'sum'), peak_mb=('peak_mb', 'max'),
+        rows_in=('rows_in', lambda r: r.sum(min_count=1)),
+        rows_out=('rows_out', lambda r: r.sum(min_count=1))).loc[order]
+
+    def count(n):
+        return '-' if pd.isna(n) else '{:,d}'.format(int(n))
+
+    lines = ['{:<40} {:>5} {:>9} {:>9} {:>9} {:>10} {:>10}'.format(
+        'stage', 'calls', 'wall s', 'cpu s', 'peak MB', 'rows in',
+        'rows out')]
+    for stage_name, r in table.iterrows():
+        lines.append('{:<40} {:>5d} {:>9.3f} {:>9.3f} {:>9.1f} {:>10} '
+                     '{:>10}'.format(stage_name, int(r['calls']),
+                                     r['wall_s'], r['cpu_s'], r['peak_mb'],
+                                     count(r['rows_in']),
+                                     count(r['rows_out'])))
+    return '\n'.join(lines)
+
+
+def report(path=REPORT_FILE):
+    """Write the records to path as JSON; returns the summary table."""
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump({'records': records}, f, indent=2)
+    return summary()
+
+
+def _forget_in_child():
+    """Worker processes don't record stages, so stop tracing there."""
+    global _worker
+    _worker = True
+    records.clear()
+    _stack.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+os.register_at_fork(after_in_child=_forget_in_child)
+
+
+def _report_at_exit():
+    if records:
+        print(report(), file=sys.stderr)
+        print('Profile written to {}'.format(REPORT_FILE), file=sys.stderr)
+
+
+if enabled:
+    atexit.register(_report_at_exit)
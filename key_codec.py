@@ -0,0 +1,134 @@
+"""
+Module for encoding zip code and FIPS style keys as integers.
+
+Zip codes, county FIPS codes and state FIPS codes are fixed width digit
+strings. Carried around as Python strings, every groupby, join and
+lookup on them hashes and compares objects. Here they are held as
+unsigned 32 bit integers instead: a fixed width code loses nothing (its
+leading zeros are implied by the width), comparisons and sorting are
+plain integer operations, and a column takes 4 bytes per row rather
+than a pointer plus a string object.
+
+In NumPy arrays (e.g. the FipsZipHandler index) missing or invalid codes
+are MISSING. In DataFrames key columns use pandas' nullable PANDAS_DTYPE,
+so missing keys are NA and dropna()/groupby() treat them as usual.
+Codes are turned back into zero padded strings with decode() only where
+they leave the program (CSV files, maps, JSON).
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+########################################################################
+# CONSTANTS
+
+DTYPE = np.uint32
+PANDAS_DTYPE = 'UInt32'
+
+# Stands for a missing or invalid code in NumPy arrays. Larger than any
+# code of up to 9 digits, so it also sorts last.
+MISSING = np.iinfo(DTYPE).max
+
+# Digits in each kind of code.
+ZIP_WIDTH = 5
+FIPS_WIDTH = 5
+STATE_WIDTH = 2
+
+# Columns holding keys in the readers' tables. They're identifiers, so
+# they're never summed with the numeric columns.
+KEY_COLUMNS = ('STATEFIPS', 'StateFIPS', 'zipcode', 'FIPS')
+
+########################################################################
+# FUNCTIONS
+
+
+def _encode_text(codes, width):
+    """int64 codes (-1 where invalid) for an array of strings."""
+    if codes.dtype.kind != 'U':
+        codes = codes.astype(str)
+    if codes.dtype.itemsize // 4 < width:
+        codes = codes.astype('<U%d' % width)
+    # View the fixed width strings as a matrix of code points and convert
+    # the digits column by column.
+    chars = np.ascontiguousarray(codes).reshape(-1).view(np.uint32)
+    chars = chars.reshape(codes.size, -1)
+    digits = chars[:, :width].astype(np.int64) - ord('0')
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    if chars.shape[1] > width:
+        valid &= (chars[:, width:] == 0).all(axis=1)
+    result = digits @ (10 ** np.arange(width - 1, -1, -1))
+    result[~valid] = -1
+    return result
+
+
+def encode(codes, width):
+    """Encode codes of width digits as a DTYPE array.
+
+    codes may be strings (which must be exactly width digits), integers,
+    floats or a nullable pandas integer array/Series. Missing, invalid
+    and out of range codes become MISSING.
+    """
+    if isinstance(codes, (pd.Series, pd.Index)):
+        codes = codes.array
+    if isinstance(codes, pd.api.extensions.ExtensionArray):
+        if pd.api.types.is_integer_dtype(codes.dtype):
+            codes = codes.to_numpy(dtype=np.int64, na_value=-1)
+        else:
+            codes = codes.to_numpy(dtype=object, na_value=None)
+    codes = np.asarray(codes)
+    if codes.dtype == object and pd.api.types.infer_dtype(
+            codes, skipna=True) == 'integer':
+        codes = pd.array(codes, dtype='Int64').to_numpy(dtype=np.int64,
+                                                        na_value=-1)
+
+    if codes.dtype.kind in 'iu':
+        result = codes.astype(np.int64)
+    elif codes.dtype.kind == 'f':
+        whole = np.isfinite(codes) & (codes == np.round(codes))
+        result = np.where(whole, codes, -1).astype(np.int64)
+    else:
+        result = _encode_text(codes, width)
+
+    invalid = (result < 0) | (result >= 10 ** width)
+    result = result.astype(DTYPE)
+    result[invalid] = MISSING
+    return result
+
+
+def to_pandas(codes):
+    """Nullable PANDAS_DTYPE array of DTYPE codes, NA where MISSING."""
+    codes = np.asarray(codes, dtype=DTYPE)
+    return pd.arrays.IntegerArray(codes, codes == MISSING)
+
+
+def encode_column(codes, width):
+    """encode() as a nullable pandas array, for DataFrame key columns."""
+    return to_pandas(encode(codes, width))
+
+
+def decode(codes, width, missing=np.nan):
+    """Object array of zero padded strings for codes (anything encode()
+    accepts), holding missing where a code is missing."""
+    codes = encode(codes, width)
+    absent = codes == MISSING
+    result = np.char.zfill(codes.astype(str), width).astype(object)
+    result[absent] = missing
+    return result
+
+
+def find(keys, codes):
+    """Positions of codes in the sorted DTYPE array keys.
+
+    Returns (positions, found), where found is False (and the position
+    meaningless) for codes that aren't in keys or are MISSING.
+    """
+    codes = np.asarray(codes, dtype=DTYPE)
+    if not len(keys):
+        return (np.zeros(len(codes), dtype=np.intp),
+                np.zeros(len(codes), dtype=bool))
+    pos = np.searchsorted(keys, codes)
+    pos[pos == len(keys)] = 0
+    return pos, (keys[pos] == codes) & (codes != MISSING)
@@ -0,0 +1,302 @@
+"""
+Module for a dense (year, county, agi_stub, metric) array of the data.
+
+Analyses keep cutting the same slices out of the long joined table: one
+agi_stub's rows, per-county totals over the agi_stubs, state totals.
+Here the numeric columns are scattered once into dense arrays:
+    - values: (year, county, agi_stub, metric) for the columns that vary
+      by agi_stub,
+    - county_values: (year, county, metric) for the county level columns
+      (see county_tables), so they aren't repeated per agi_stub.
+Absent (county, agi_stub) pairs are NaN. Every axis label (year, FIPS
+key, agi_stub, metric, state) maps to its integer position through a
+dict, so get() is a dict lookup plus basic indexing: a view, whatever
+the size of the data.
+
+Counties are sorted by FIPS key, and a county's state is the leading
+digits of its key, so each state's counties are a contiguous block of
+the county axis. Sums over the agi_stubs (per county), over each state's
+block (np.add.reduceat) and over all counties are computed when the cube
+is built, together with the number of values behind each sum, so state
+and national totals and means are views or elementwise operations too.
+Data without a year column gets a single year, None.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Project modules:
+import county_tables
+import key_codec
+
+########################################################################
+# CONSTANTS
+
+KEY = county_tables.KEY
+BY = county_tables.BY
+
+# A county's state FIPS code is its FIPS code divided by this.
+STATE_DIVISOR = 10 ** (key_codec.FIPS_WIDTH - key_codec.STATE_WIDTH)
+
+########################################################################
+# CLASSES
+
+
+class MetricCube:
+    """Dense arrays of the per-stub and county level metrics."""
+
+    def __init__(self, keys, stubs, years, metrics, values,
+                 county_metrics=(), county_values=None):
+        self.keys = np.asarray(keys, dtype=key_codec.DTYPE)
+        self.stubs = np.asarray(stubs)
+        self.years = tuple(years)
+        self.metrics = list(metrics)
+        self.county_metrics = list(county_metrics)
+        if county_values is None:
+            county_values = np.empty((len(self.years), len(self.keys), 0))
+        self.values = values
+        self.county_values = county_values
+
+        # Axis lookups. A metric maps to (cube, position), where cube 0 is
+        # values and cube 1 is county_values.
+        self._years = {y: i for i, y in enumerate(self.years)}
+        self._counties = {k: i for i, k in enumerate(self.keys.tolist())}
+        self._stubs = {s: i for i, s in enumerate(self.stubs.tolist())}
+        self._metrics = {m: (0, i) for i, m in enumerate(self.metrics)}
+        self._metrics.update({m: (1, i)
+                              for i, m in enumerate(self.county_metrics)})
+
+        # Each state's counties are contiguous.
+        self.states, self._starts = np.unique(self.keys // STATE_DIVISOR,
+                                              return_index=True)
+        self._states = {s: i for i, s in enumerate(self.states.tolist())}
+
+        # Roll-ups of both cubes: sums (NaN counting as 0) and the number
+        # of values behind them.
+        self.county_sums = np.nansum(values, axis=2)
+        self.county_counts = (~np.isnan(values)).sum(axis=2)
+        self._state_sums = []
+        self._state_counts = []
+        for cube in (values, county_values):
+            present = ~np.isnan(cube)
+            if len(self.keys):
+                sums = np.add.reduceat(np.where(present, cube, 0),
+                                       self._starts, axis=1)
+                counts = np.add.reduceat(present.astype(np.int64),
+                                         self._starts, axis=1)
+            else:
+                shape = (cube.shape[0], 0) + cube.shape[2:]
+                sums = np.zeros(shape)
+                counts = np.zeros(shape, dtype=np.int64)
+            self._state_sums.append(sums)
+            self._state_counts.append(counts)
+        self._national_sums = [s.sum(axis=1) for s in self._state_sums]
+        self._national_counts = [c.sum(axis=1) for c in self._state_counts]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def fips(self):
+        """FIPS code of every county, as zero padded strings."""
+        return key_codec.decode(self.keys, key_codec.FIPS_WIDTH)
+
+    def _year(self, year):
+        if year is None:
+            # Data without years has the single year None.
+            return 0 if self.years == (None,) else slice(None)
+        return self._years[year]
+
+    @staticmethod
+    def _lookup(positions, label):
+        if label is None:
+            return slice(None)
+        return positions[label]
+
+    def _index(self, metric, year, middle, stub):
+        """(cube, index tuple) for metric with the given positions on the
+        county (or state) axis."""
+        cube, position = self._metrics[metric]
+        index = (self._year(year), middle)
+        if cube == 0:
+            index += (self._lookup(self._stubs, stub),)
+        return cube, index + (position,)
+
+    def county(self, fips):
+        """Position of a county on the county axis."""
+        return self._counties[int(fips)]
+
+    def state(self, state):
+        """Position of a state (its FIPS code) on the state axis."""
+        return self._states[int(state)]
+
+    def get(self, metric, stub=None, year=None, county=None):
+        """View of metric: one or all (None) years, counties (FIPS codes)
+        and agi_stubs (ignored for county level metrics)."""
+        middle = slice(None) if county is None else self.county(county)
+        cube, index = self._index(metric, year, middle, stub)
+        return (self.values, self.county_values)[cube][index]
+
+    def totals(self, metric, year=None, county=None):
+        """Sum of a per-stub metric over the agi_stubs, per county."""
+        cube, position = self._metrics[metric]
+        if cube != 0:
+            raise ValueError('{} is a county level metric; use get() for '
+                             'its values.'.format(metric))
+        middle = slice(None) if county is None else self.county(county)
+        return self.county_sums[self._year(year), middle, position]
+
+    def state_totals(self, metric, stub=None, year=None, state=None,
+                     mean=False):
+        """Sum (or with mean, the mean) of metric over each state's
+        counties; see get for the other arguments."""
+        middle = slice(None) if state is None else self.state(state)
+        cube, index = self._index(metric, year, middle, stub)
+        sums = self._state_sums[cube][index]
+        if mean:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return sums / self._state_counts[cube][index]
+        return sums
+
+    def national_totals(self, metric, stub=None, year=None, mean=False):
+        """Sum (or with mean, the mean) of metric over all counties."""
+        cube, index = self._index(metric, year, None, stub)
+        index = index[:1] + index[2:]
+        sums = self._national_sums[cube][index]
+        if mean:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return sums / self._national_counts[cube][index]
+        return sums
+
+    def weighted_mean(self, metric, weight, stub=None, year=None,
+                      level='state'):
+        """Mean of metric weighted by weight (another metric) per state
+        (level 'state') or over all counties ('national').
+
+        Unlike the plain sums these aren't precomputed: it takes one
+        segment sum of the products.
+        """
+        values = self.get(metric, stub, year)
+        weights = self.get(weight, stub, year)
+        # A county level metric or weight applies to every agi_stub.
+        if weights.ndim < values.ndim:
+            weights = weights[..., None]
+        elif values.ndim < weights.ndim:
+            values = values[..., None]
+        axis = 0 if isinstance(self._year(year), int) else 1
+        present = ~(np.isnan(values) | np.isnan(weights))
+        products = np.where(present, values * weights, 0)
+        weights = np.where(present, weights, 0)
+        if level == 'national':
+            numerator = products.sum(axis=axis)
+            denominator = weights.sum(axis=axis)
+        elif level == 'state':
+            numerator = np.add.reduceat(products, self._starts, axis=axis)
+            denominator = np.add.reduceat(weights, self._starts, axis=axis)
+        else:
+            raise ValueError('Unknown level: {}'.format(level))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return numerator / denominator
+
+    def positions(self, data, key=KEY, by=BY, year=None):
+        """(year, county, agi_stub) positions of the rows of a long table
+        like the one the cube was built from."""
+        pos, found = key_codec.find(
+            self.keys, key_codec.encode(data[key], key_codec.FIPS_WIDTH))
+        if not found.all():
+            raise KeyError('{} rows have a {} not in the cube.'.format(
+                (~found).sum(), key))
+        stubs = np.searchsorted(self.stubs, data[by].to_numpy())
+        if year is None:
+            years = np.zeros(len(data), dtype=np.intp)
+        else:
+            years = np.array([self._years[y] for y in data[year]],
+                             dtype=np.intp)
+        return years, pos, stubs
+
+########################################################################
+# FUNCTIONS
+
+
+def _numeric(data, columns):
+    return [c for c in columns
+            if pd.api.types.is_numeric_dtype(data[c])
+            and not isinstance(data[c].dtype, pd.CategoricalDtype)
+            and c not in key_codec.KEY_COLUMNS]
+
+
+def build(data, metrics=None, county_metrics=(), key=KEY, by=BY,
+          year=None):
+    """MetricCube of a long table with one row per (year, county,
+    agi_stub).
+
+    metrics default to the numeric columns other than key, by, year and
+    county_metrics. county_metrics must hold one value per (year,
+    county). Rows without a key are dropped; duplicate (year, county,
+    agi_stub) rows raise a ValueError.
+    """
+    county_metrics = list(county_metrics)
+    if metrics is None:
+        metrics = _numeric(data, [c for c in data.columns
+                                  if c not in (key, by, year)
+                                  and c not in county_metrics])
+    codes = key_codec.encode(data[key], key_codec.FIPS_WIDTH)
+    valid = codes != key_codec.MISSING
+    if not valid.all():
+        data = data[valid]
+        codes = codes[valid]
+
+    keys, counties = np.unique(codes, return_inverse=True)
+    stubs, stub_pos = np.unique(data[by].to_numpy(), return_inverse=True)
+    if year is None:
+        years = [None]
+        year_pos = np.zeros(len(data), dtype=np.intp)
+    else:
+        years, year_pos = np.unique(data[year].to_numpy(),
+                                    return_inverse=True)
+        years = years.tolist()
+
+    cells = np.ravel_multi_index((year_pos, counties, stub_pos),
+                                 (len(years), len(keys), len(stubs)))
+    duplicated = pd.Index(cells).duplicated()
+    if duplicated.any():
+        names = [c for c in (year, key, by) if c is not None]
+        raise ValueError('{} duplicate ({}) rows.'.format(
+            duplicated.sum(), ', '.join(names)))
+
+    values = np.full((len(years), len(keys), len(stubs), len(metrics)),
+                     np.nan)
+    values[year_pos, counties, stub_pos] = \
+        data[metrics].to_numpy(dtype=np.float64, na_value=np.nan)
+    county_values = np.full((len(years), len(keys), len(county_metrics)),
+                            np.nan)
+    county_values[year_pos, counties] = \
+        data[county_metrics].to_numpy(dtype=np.float64, na_value=np.nan)
+    return MetricCube(keys, stubs, years, metrics, values, county_metrics,
+                      county_values)
+
+
+def from_tables(tables):
+    """MetricCube of the numeric columns of county_tables.CountyTables."""
+    counties = tables.counties
+    stubs = tables.stubs
+    metrics = _numeric(stubs, tables.stub_columns)
+    county_metrics = _numeric(counties, tables.county_columns)
+
+    values = np.full((1, len(counties), len(tables.stub_values),
+                      len(metrics)), np.nan)
+    stub_pos = np.searchsorted(tables.stub_values, stubs[tables.by])
+    values[0, stubs[county_tables.ROW].to_numpy(), stub_pos] = \
+        stubs[metrics].to_numpy(dtype=np.float64, na_value=np.nan)
+    county_values = counties[county_metrics].to_numpy(
+        dtype=np.float64, na_value=np.nan)[None]
+    return MetricCube(key_codec.encode(counties.index, key_codec.FIPS_WIDTH),
+                      tables.stub_values, [None], metrics, values,
+                      county_metrics, county_values)
@@ -0,0 +1,237 @@
+"""
+Module for running the analysis as a pipeline of memoized stages.
+
+Each stage's output is pickled to disk under a key that hashes:
+    - the stage's parameters,
+    - the source code of the modules it depends on,
+    - the size and modification time of the files it reads,
+    - the keys of the stages it takes as inputs.
+Since a stage's key includes its inputs' keys, changing anything only
+invalidates that stage and the stages downstream of it; everything else
+is loaded from the cache (and upstream outputs are only loaded if a
+downstream stage actually has to run).
+
+The cache is bounded in size, evicting the least recently used entries.
+Run this module to list or purge cached stages:
+    python pipeline.py list
+    python pipeline.py purge [stage ...]
+"""
+########################################################################
+# IMPORTS
+
+# Standard Library:
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+
+########################################################################
+# CONSTANTS
+
+# Folder holding the cached stage outputs.
+CACHE_DIR = '.pipeline_cache'
+
+# Once the cache grows past this many bytes, least recently used entries
+# are evicted.
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Cached outputs are named '<stage>-<key>.pkl'.
+CACHE_SUFFIX = '.pkl'
+
+########################################################################
+# CLASSES
+
+
+class Stage:
+    """A single pipeline stage.
+
+    func is called with the outputs of the stages named in inputs (in
+    order) as positional arguments and params as keyword arguments.
+    files are the data files the stage reads, and code the modules whose
+    source it depends on (default: func's own module).
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=(),
+                 code=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.files = list(files)
+        self.code = list(code) if code is not None \
+            else [inspect.getmodule(func)]
+
+    def key(self, input_keys):
+        """Content hash for this stage given its inputs' keys."""
+        sha = hashlib.sha256()
+        sha.update(self.name.encode())
+        sha.update(self.func.__qualname__.encode())
+        sha.update(json.dumps(self.params, sort_keys=True,
+                              default=repr).encode())
+        for module in self.code:
+            sha.update(inspect.getsource(module).encode())
+        for path in self.files:
+            stat = os.stat(path)
+            sha.update('{}:{}:{}'.format(path, stat.st_size,
+                                         stat.st_mtime_ns).encode())
+        for key in input_keys:
+            sha.update(key.encode())
+        return sha.hexdigest()[:32]
+
+
+class Pipeline:
+    """An ordered collection of stages with an on-disk output cache."""
+
+    def __init__(self, stages, cache_dir=CACHE_DIR,
+                 max_bytes=CACHE_MAX_BYTES):
+        self.stages = {}
+        for stage in stages:
+            missing = [i for i in stage.inputs if i not in self.stages]
+            if missing:
+                raise ValueError('Stage {} depends on undeclared stage(s) '
+                                 '{}'.format(stage.name, missing))
+            self.stages[stage.name] = stage
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def keys(self, targets=None):
+        """Map each stage name to its current key.
+
+        Only targets (default: all stages) and the stages upstream of them
+        are hashed, so files and code that other stages depend on don't
+        have to exist.
+        """
+        keys = {}
+
+        def key(name):
+            if name not in keys:
+                stage = self.stages[name]
+                keys[name] = stage.key([key(i) for i in stage.inputs])
+            return keys[name]
+
+        for name in self.stages if targets is None else targets:
+            key(name)
+        return keys
+
+    def _path(self, name, key):
+        return os.path.join(self.cache_dir, name + '-' + key + CACHE_SUFFIX)
+
+    def run(self, targets=None, verbose=True):
+        """Return a dict of outputs for targets (default: all stages).
+
+        Stages whose key is cached are loaded rather than executed.
+        """
+        if targets is None:
+            targets = list(self.stages)
+        keys = self.keys(targets)
+        outputs = {}
+
+        def get(name):
+            if name in outputs:
+                return outputs[name]
+            stage = self.stages[name]
+            path = self._path(name, keys[name])
+            try:
+                with open(path, 'rb') as f:
+                    outputs[name] = pickle.load(f)
+                # Mark as recently used for eviction.
+                os.utime(path)
+                if verbose:
+                    print('Stage {}: loaded from cache.'.format(name))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                args = [get(i) for i in stage.inputs]
+                start = time.time()
+                outputs[name] = stage.func(*args, **stage.params)
+                if verbose:
+                    print('Stage {}: ran in {:.2f}s.'.format(
+                        name, time.time() - start))
+                self._store(path, outputs[name])
+            return outputs[name]
+
+        return {name: get(name) for name in targets}
+
+    def _store(self, path, output):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        evict(self.cache_dir, self.max_bytes)
+
+########################################################################
+# FUNCTIONS
+
+
+def list_cache(cache_dir=CACHE_DIR):
+    """List cached outputs, most recently used first.
+
+    Returns a list of dicts with stage, key, bytes and last_used (epoch
+    seconds).
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith(CACHE_SUFFIX):
+            continue
+        stat = os.stat(os.path.join(cache_dir, filename))
+        stage, key = filename[:-len(CACHE_SUFFIX)].rsplit('-', 1)
+        entries.append({'stage': stage, 'key': key, 'bytes': stat.st_size,
+                        'last_used': stat.st_mtime, 'file': filename})
+    entries.sort(key=lambda e: e['last_used'], reverse=True)
+    return entries
+
+
+def purge(stages=None, cache_dir=CACHE_DIR):
+    """Delete cached outputs for the given stage names (default: all).
+
+    Returns the number of files removed.
+    """
+    removed = 0
+    for entry in list_cache(cache_dir):
+        if stages is None or entry['stage'] in stages:
+            os.remove(os.path.join(cache_dir, entry['file']))
+            removed += 1
+    return removed
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """Remove least recently used outputs until under max_bytes."""
+    entries = list_cache(cache_dir)
+    total = sum(e['bytes'] for e in entries)
+    while entries and total > max_bytes:
+        entry = entries.pop()
+        os.remove(os.path.join(cache_dir, entry['file']))
+        total -= entry['bytes']
+
+
+def main():
+    """Command line interface for inspecting the cache."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='List cached stage outputs.')
+    purge_parser = sub.add_parser('purge', help='Delete cached outputs.')
+    purge_parser.add_argument('stages', nargs='*',
+                              help='Stages to purge (default: all).')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for e in list_cache(args.cache_dir):
+            print('{:<20} {} {:>12,d} bytes  last used {}'.format(
+                e['stage'], e['key'], e['bytes'],
+                time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(e['last_used']))))
+    else:
+        removed = purge(args.stages or None, args.cache_dir)
+        print('Removed {} cached output(s).'.format(removed))
+
+########################################################################
+# MAIN
+
+
+if __name__ == '__main__':
+    main()
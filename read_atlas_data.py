@@ -1,12 +1,14 @@
 ########################################################################
 # IMPORTS
 
-# Installed packages:
-import pandas as pd
-
 # Standard Library:
 import os.path
 
+# Project modules:
+import columnar_cache
+import instrument
+import key_codec
+
 ########################################################################
 # CONSTANTS
 
@@ -18,21 +20,30 @@ HEALTH_DATA_STATE_FILE = \
     os.path.join(DATA_DIR, 'Food_Atlas_State_2013.csv')
 
 # Data types for the county data.
-COUNTY_DTYPES = {'FIPS': str, 'State': str, 'County': str,
+COUNTY_DTYPES = {'FIPS': str, 'State': 'category', 'County': str,
                  'Population Estimate, 2013': float, 'VLFOODSEC_13_15': float,
                  'FOODINSEC_13_15': float, 'PCT_DIABETES_ADULTS13': float,
                  'PCT_OBESE_ADULTS13': float}
 
+# Code columns (and their widths), stored and returned as key_codec
+# integer keys by the columnar cache.
+COUNTY_CODE_WIDTHS = {'FIPS': key_codec.FIPS_WIDTH}
+STATE_CODE_WIDTHS = {'StateFIPS': key_codec.STATE_WIDTH}
+
 ########################################################################
 # FUNCTIONS
 
 
+@instrument.stage()
 def read_data():
-    """Function to simply read the atlas data from file."""
-    health_county_data = pd.read_csv(HEALTH_DATA_COUNTY_FILE,
-                                     dtype=COUNTY_DTYPES)
-
-    health_state_data = pd.read_csv(HEALTH_DATA_STATE_FILE)
+    """Function to simply read the atlas data from file (through the
+    columnar cache, see columnar_cache.read_csv)."""
+    health_county_data = columnar_cache.read_csv(
+        HEALTH_DATA_COUNTY_FILE, usecols=list(COUNTY_DTYPES.keys()),
+        dtype=COUNTY_DTYPES, codes=COUNTY_CODE_WIDTHS)
+
+    health_state_data = columnar_cache.read_csv(HEALTH_DATA_STATE_FILE,
+                                                codes=STATE_CODE_WIDTHS)
     # print(health_county_data.head(),health_state_data.head())
 
     # Return.
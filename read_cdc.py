@@ -0,0 +1,160 @@
+"""
+Module for reading the CDC Summary Health Statistics (SHS) tables.
+
+Each file in datasets/cdc_data/ ('<year>_SHS_<table>.csv', with bare CR
+line endings) holds the percentage of people with a set of health
+measures for each of five income bands. read_data parses all of them in
+one batch into a single long table of (year, table, band, income,
+measure, value). In analysis.py it's the 'cdc_data' pipeline stage, so
+it's cached on disk with the other stages.
+
+The CDC income bands don't line up with the IRS agi_stub brackets, so
+each agi_stub is mapped to the band that covers most of its income range
+(STUB_TO_BAND), and measures are attached to IRS rows by indexing with
+that mapping (see stub_measures).
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import glob
+import io
+import os
+
+########################################################################
+# CONSTANTS
+
+DATA_DIR = os.path.join('datasets', 'cdc_data')
+FILE_PATTERN = '*_SHS_*.csv'
+ENCODING = 'cp1252'
+
+# Column holding the income band in every table.
+INCOME_COLUMN = 'Income (USD)'
+
+# CDC income bands, in order, and their edges in dollars.
+INCOME_BANDS = ['Less than 35k', '35k to 49,999', '50k to 74,999',
+                '75k to 99,999', '100k or more']
+BAND_EDGES = np.array([0, 35000, 50000, 75000, 100000, np.inf])
+
+# Edges of the IRS agi_stub brackets in dollars, one bracket per
+# read_irs.AGI_STUBS entry.
+STUB_EDGES = np.array([1, 25000, 50000, 75000, 100000, 200000, np.inf])
+
+########################################################################
+# FUNCTIONS
+
+
+def band_overlap(stub_edges=STUB_EDGES, band_edges=BAND_EDGES):
+    """Fraction of each stub's income range that falls in each band.
+
+    Returns an array of shape (# stubs, # bands). An open ended stub
+    (upper edge inf) lies entirely in the open ended band.
+    """
+    lo = np.maximum(stub_edges[:-1, None], band_edges[None, :-1])
+    hi = np.minimum(stub_edges[1:, None], band_edges[None, 1:])
+    with np.errstate(invalid='ignore'):
+        overlap = np.clip(hi - lo, 0, None)
+        width = (stub_edges[1:] - stub_edges[:-1])[:, None]
+        fraction = overlap / width
+    # inf / inf: the open ended stub in the open ended band.
+    fraction[np.isnan(fraction)] = 1.0
+    return fraction
+
+
+# Band index for each agi_stub (indexed by the stub itself, so entry 0 is
+# unused and -1).
+STUB_TO_BAND = np.concatenate(([-1], band_overlap().argmax(axis=1)))
+
+
+def data_files(data_dir=DATA_DIR):
+    """Sorted paths of the SHS files."""
+    return sorted(glob.glob(os.path.join(data_dir, FILE_PATTERN)))
+
+
+def _parse(path):
+    """Long table for a single SHS file."""
+    year, _, table = os.path.splitext(
+        os.path.basename(path))[0].split('_', 2)
+    with open(path, encoding=ENCODING, newline='') as f:
+        # The files use bare CR line endings; splitlines handles any.
+        text = '\n'.join(f.read().splitlines())
+    wide = pd.read_csv(io.StringIO(text), dtype={INCOME_COLUMN: str})
+
+    incomes = wide[INCOME_COLUMN].str.strip()
+    unknown = set(incomes) - set(INCOME_BANDS)
+    if unknown:
+        raise ValueError('Unknown income band(s) in {}: {}'.format(
+            path, sorted(unknown)))
+
+    measures = [c for c in wide.columns if c != INCOME_COLUMN]
+    values = wide[measures].to_numpy(dtype=np.float64)
+    n_bands, n_measures = values.shape
+    return pd.DataFrame({
+        'year': np.full(values.size, int(year), dtype=np.int16),
+        'table': table,
+        'income': np.repeat(incomes.to_numpy(), n_measures),
+        'measure': np.tile(measures, n_bands),
+        'value': values.ravel(),
+    })
+
+
+def read_data(paths=None):
+    """Read every SHS file into one long table.
+
+    Columns: year (int16), table, band (int8 index into INCOME_BANDS),
+    income, measure (all three categorical) and value (percent).
+    """
+    if paths is None:
+        paths = data_files()
+    data = pd.concat([_parse(path) for path in paths], ignore_index=True)
+
+    data['table'] = data['table'].astype('category')
+    data['income'] = pd.Categorical(data['income'],
+                                    categories=INCOME_BANDS, ordered=True)
+    data.insert(2, 'band', data['income'].cat.codes.astype(np.int8))
+    data['measure'] = data['measure'].astype('category')
+    return data
+
+
+def band_matrix(cdc_data, measures=None, year=None):
+    """Measures as a (# bands, # measures) array.
+
+    Returns (array, list of measures). year defaults to the latest year
+    in cdc_data; bands without a value are NaN.
+    """
+    if year is None:
+        year = cdc_data['year'].max()
+    data = cdc_data[cdc_data['year'] == year]
+    if measures is None:
+        measures = data['measure'].unique().tolist()
+    codes = pd.Categorical(data['measure'], categories=measures).codes
+    keep = codes >= 0
+
+    matrix = np.full((len(INCOME_BANDS), len(measures)), np.nan)
+    matrix[data['band'].to_numpy()[keep], codes[keep]] = \
+        data['value'].to_numpy()[keep]
+    return matrix, list(measures)
+
+
+def stub_measures(cdc_data, agi_stubs, measures=None, year=None):
+    """CDC measures for each agi_stub, e.g. a column of the IRS data.
+
+    Returns a DataFrame with one row per entry of agi_stubs (same index
+    if it's a Series) and one column per measure, taken from the band
+    each stub maps to (STUB_TO_BAND).
+    """
+    matrix, measures = band_matrix(cdc_data, measures, year)
+    bands = STUB_TO_BAND[np.asarray(agi_stubs, dtype=np.intp)]
+    index = agi_stubs.index if isinstance(agi_stubs, pd.Series) else None
+    return pd.DataFrame(matrix[bands], columns=measures, index=index)
+
+########################################################################
+# MAIN
+
+
+if __name__ == '__main__':
+    print(read_data())
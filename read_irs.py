@@ -4,7 +4,10 @@ using 2013 data.
 
 As described in the README.md file, this module expects you to have a
 folder called 'zipcode2013' in this directory. Within this directory,
-at the minimum a file called '13zpallagi.csv'
+at the minimum a file called '13zpallagi.csv'. Other years can be
+loaded into a single table with a 'year' column with
+get_irs_data(years=...), see irs_file_path for where their files are
+expected.
 
 NOTE: The IRS data excludes those with a gross deficit
 (rather than income).
@@ -18,8 +21,14 @@ import pandas as pd
 
 # Standard Library:
 import os.path
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 # Project modules:
+import columnar_cache
+import crosswalk
+import instrument
+import key_codec
 from fipsZipHandler import FipsZipHandler
 
 ########################################################################
@@ -32,6 +41,13 @@ IRS_DIR = 'zipcode2013'
 IRS_FILE = 'zipcodeagi13.csv'
 # Full path to IRS data file.
 IRS_FILE_PATH = os.path.join('.', IRS_DIR, IRS_FILE)
+# Year of the file above.
+IRS_YEAR = 2013
+
+# Other years are expected in the same layout, e.g.
+# 'zipcode2014/zipcodeagi14.csv'. Paths for years whose download doesn't
+# follow it can be added here.
+IRS_FILE_PATHS = {}
 
 # Columns to read. Keys are columns, values are brief explanations.
 COLUMNS = {'STATEFIPS': 'State FIPS code',
@@ -51,12 +67,14 @@ COLUMNS = {'STATEFIPS': 'State FIPS code',
 AGI_STUBS = {1: '\$1-\$25k', 2: '\$25k-\$50k', 3: '\$50k-\$75k',
              4: '\$75k-\$100k', 5: '\$100k-\$200k', 6: '\$200k+'}
 
-# Define data types for the IRS data. Codes should be mapped as a string
-# to avoid dropping leading 0's.
-COLUMN_DTYPES = {'STATEFIPS': np.str,
-                 'STATE': np.str,
-                 'zipcode': np.str,
-                 'agi_stub': np.int64,
+# Define data types for the IRS data. Codes are parsed as strings to
+# avoid dropping leading 0's (and then kept as integer keys, see
+# CODE_WIDTHS). Counts stay float64 so sums are exact;
+# they're only stored as float32 (where lossless) in the columnar cache.
+COLUMN_DTYPES = {'STATEFIPS': str,
+                 'STATE': 'category',
+                 'zipcode': str,
+                 'agi_stub': np.int8,
                  'N1': np.float64,
                  'MARS1': np.float64,
                  'MARS2': np.float64,
@@ -65,38 +83,59 @@ COLUMN_DTYPES = {'STATEFIPS': np.str,
                  'A00100': np.float64,
                  'A02650': np.float64}
 
+# Code columns (and their widths), stored and returned as key_codec
+# integer keys by the columnar cache.
+CODE_WIDTHS = {'STATEFIPS': key_codec.STATE_WIDTH,
+               'zipcode': key_codec.ZIP_WIDTH}
+
 ########################################################################
 # FUNCTIONS
 
 
-def read_data():
-    """Function to simply read the IRS data from file."""
-    irs_data = pd.read_csv(IRS_FILE_PATH, header=0,
-                           usecols=list(COLUMNS.keys()), dtype=COLUMN_DTYPES)
+def irs_file_path(year=None):
+    """Path to the IRS data file for a given year (default: IRS_YEAR)."""
+    if year is None or year == IRS_YEAR:
+        return IRS_FILE_PATH
+    if year in IRS_FILE_PATHS:
+        return IRS_FILE_PATHS[year]
+    return os.path.join('.', 'zipcode{}'.format(year),
+                        'zipcodeagi{:02d}.csv'.format(year % 100))
+
 
-    # Convert zipcode to a string. Note: it'd be more efficient to
-    # define the data type when the file is read, but that can be a real
-    # hassle. However, not doing so causes leading zeros to be dropped
-    #in the FIPS and zipcodes. The information loss is during data read,
-    #So converting the datatype subsequently has no utility.
-    #irs_data['zipcode'] = irs_data['zipcode'].astype(str)
+@instrument.stage()
+def read_data(chunksize=None, year=None):
+    """Function to simply read the IRS data from file (through the
+    columnar cache, see columnar_cache.read_csv).
+
+    If chunksize is given, an iterator over DataFrames of at most
+    chunksize rows is returned instead of a single DataFrame.
+    """
+    irs_data = columnar_cache.read_csv(irs_file_path(year),
+                                       usecols=list(COLUMNS.keys()),
+                                       dtype=COLUMN_DTYPES,
+                                       codes=CODE_WIDTHS,
+                                       chunksize=chunksize)
 
-    # Convert STATEFIPS to a string. Same efficiency note as above.
-    #irs_data['STATEFIPS'] = irs_data['STATEFIPS'].astype(str)
+    # NOTE: zipcode and STATEFIPS come back as integer keys (UInt32, see
+    # key_codec), which keep their leading zeros implicitly. Use
+    # key_codec.decode to get the zero padded strings.
 
     return irs_data
 
 
-def lookup_fips(irs_data):
+@instrument.stage()
+def lookup_fips(irs_data, fz_obj=None):
     """Function to associate FIPS codes based on IRS zipcodes"""
     # Initialize FipsZipHandler object
-    fz_obj = FipsZipHandler()
+    if fz_obj is None:
+        fz_obj = FipsZipHandler()
 
-    # Translate IRS data zip codes to FIPS codes.
-    irs_fips = [fz_obj.getFipsForZipcode(z) for z in irs_data['zipcode']]
+    # Translate IRS data zip codes to FIPS codes in one vectorized pass.
+    irs_fips = fz_obj.getFipsCodesForZipcodeArray(irs_data['zipcode'])
 
-    # Add column to irs_data for FIPS code.
-    irs_data['FIPS'] = irs_fips
+    # Add column to irs_data for FIPS code (an integer key, NA for zip
+    # codes without a county).
+    irs_data['FIPS'] = key_codec.to_pandas(irs_fips)
 
     # Investigate the NaN data.
     nan_data = irs_data[irs_data.isnull().any(axis=1)]
@@ -105,6 +144,7 @@ def lookup_fips(irs_data):
     return irs_data
 
 
+@instrument.stage()
 def aggregate_by_fips(irs_data):
     """Function to combine IRS data by FIPS code.
 
@@ -114,8 +154,12 @@ def aggregate_by_fips(irs_data):
     # Drop NaN state values.
     irs_data.dropna(inplace=True)
 
-    # Use groupby to aggregate.
-    aggregated_data = irs_data.groupby(['FIPS', 'agi_stub']).sum()
+    # Use groupby to aggregate. Only numeric columns are summed; the
+    # state and zip code keys don't aggregate meaningfully.
+    keys = [c for c in key_codec.KEY_COLUMNS
+            if c in irs_data.columns and c != 'FIPS']
+    aggregated_data = irs_data.drop(columns=keys).groupby(
+        ['FIPS', 'agi_stub']).sum(numeric_only=True)
 
     # For simplicity, change the multi-index into columns.
     # TODO: We may want to keep the multi-index around?
@@ -124,6 +168,50 @@ def aggregate_by_fips(irs_data):
     return aggregated_data
 
 
+@instrument.stage()
+def aggregate_chunks(chunks, apportion=False):
+    """Map and aggregate an iterable of IRS DataFrames chunk by chunk.
+
+    Each chunk is reduced to (FIPS, agi_stub) sums straight away and
+    merged into the running totals, so memory use depends on the number
+    of counties rather than the number of rows read. The result is the
+    same as aggregating the concatenated chunks in one go.
+    """
+    if apportion:
+        cw = crosswalk.crosswalk_matrix()
+    else:
+        fz_obj = FipsZipHandler()
+
+    totals = None
+    for chunk in chunks:
+        if apportion:
+            partial = crosswalk.apportion(chunk, crosswalk=cw)
+        else:
+            partial = aggregate_by_fips(lookup_fips(chunk, fz_obj))
+        partial.set_index(['FIPS', 'agi_stub'], inplace=True)
+
+        if totals is None:
+            totals = partial
+        else:
+            totals = totals.add(partial, fill_value=0)
+
+    if totals is None:
+        # No chunks: no rows, but the columns of a single groupby.
+        sums = [c for c, t in COLUMN_DTYPES.items()
+                if t is np.float64 and c not in key_codec.KEY_COLUMNS]
+        empty = {'FIPS': key_codec.to_pandas(np.empty(0, key_codec.DTYPE)),
+                 'agi_stub': np.empty(0, dtype=np.int8)}
+        empty.update({c: np.empty(0) for c in sums})
+        return pd.DataFrame(empty)
+
+    # Match the sorted order of a single groupby.
+    totals.sort_index(inplace=True)
+    totals.reset_index(inplace=True)
+
+    return totals
+
+
+@instrument.stage()
 def wealth_per_person(irs_data):
     """Estimate wealth per person with the IRS data.
 
@@ -149,13 +237,15 @@ def wealth_per_person(irs_data):
     return irs_data
 
 
+@instrument.stage()
 def compute_percentages(irs_data):
     """Compute pct of returns and pct of people for each FIPS code."""
-    # Sum returns and people by FIPS
-    totals = irs_data[['FIPS', 'N1', 'total_people']].groupby(['FIPS']).sum()
-
-    # Join the totals into the irs data
-    irs_data = irs_data.join(totals, on='FIPS', rsuffix='_total_for_FIPS')
+    # Sum returns and people by FIPS, for each row.
+    totals = irs_data.groupby('FIPS')[['N1', 'total_people']] \
+        .transform('sum')
+    irs_data = irs_data.copy()
+    for column in ('N1', 'total_people'):
+        irs_data[column + '_total_for_FIPS'] = totals[column]
 
     # Compute percentages.
     irs_data['N1_pct_of_FIPS'] = irs_data['N1'] / irs_data['N1_total_for_FIPS']
@@ -165,17 +255,105 @@ def compute_percentages(irs_data):
     return irs_data
 
 
-def get_irs_data():
-    """Main function to load, map, and aggregate IRS data.
-    """
-    # Read file.
-    data = read_data()
-
-    # Get FIPS for all zip codes.
-    data = lookup_fips(data)
+@instrument.stage()
+def aggregate_fused(irs_data):
+    """Single pass equivalent of aggregate_by_fips, wealth_per_person and
+    compute_percentages.
 
-    # Aggregate by FIPS codes.
-    data = aggregate_by_fips(data)
+    FIPS codes and agi_stubs are factorized once, every per-(FIPS,
+    agi_stub) sum is a single np.bincount, and the derived columns are
+    computed from those sums straight into the output arrays. No
+    intermediate frames or joins are built. The result matches the three
+    functions applied in sequence.
+    """
+    # Rows with a NaN anywhere are dropped, as in aggregate_by_fips.
+    keep = np.ones(len(irs_data), dtype=bool)
+    for column in irs_data.columns:
+        keep &= irs_data[column].notna().to_numpy()
+    all_kept = keep.all()
+
+    def kept(column):
+        values = irs_data[column].to_numpy()
+        return values if all_kept else values[keep]
+
+    # Integer group ids, ordered by FIPS then agi_stub like groupby.
+    fips_keys = key_codec.encode(irs_data['FIPS'], key_codec.FIPS_WIDTH)
+    fips_codes, fips = pd.factorize(
+        fips_keys if all_kept else fips_keys[keep], sort=True)
+    stub_codes, stubs = pd.factorize(kept('agi_stub'), sort=True)
+    group = fips_codes * len(stubs) + stub_codes
+    n_groups = len(fips) * len(stubs)
+    present = np.flatnonzero(np.bincount(group, minlength=n_groups))
+    out_fips = present // len(stubs)
+
+    # Sums for all numeric columns.
+    sum_columns = [c for c in irs_data.columns
+                   if c != 'agi_stub' and c not in key_codec.KEY_COLUMNS
+                   and pd.api.types.is_numeric_dtype(irs_data[c])]
+    out = {'FIPS': key_codec.to_pandas(fips[out_fips]),
+           'agi_stub': stubs[present % len(stubs)]}
+    for column in sum_columns:
+        out[column] = np.bincount(group, weights=kept(column),
+                                  minlength=n_groups)[present]
+
+    # Per person wealth (see wealth_per_person).
+    out['total_people'] = out['MARS1'] + 2 * out['MARS2'] + out['NUMDEP']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        agi = np.rint(1000 * out['A00100'] / out['total_people'])
+    agi[np.isnan(agi)] = 0
+    out['agi_per_person'] = agi
+
+    # Percentages of the FIPS totals (see compute_percentages).
+    for column in ('N1', 'total_people'):
+        total = np.bincount(out_fips, weights=out[column])[out_fips]
+        out[column + '_total_for_FIPS'] = total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['N1_pct_of_FIPS'] = out['N1'] / out['N1_total_for_FIPS']
+        out['total_people_pct_of_FIPS'] = \
+            (out['total_people'] / out['total_people_total_for_FIPS'])
+
+    return pd.DataFrame(out)
+
+
+@instrument.stage()
+def process_year(year=None, apportion=False, chunksize=None, fused=False):
+    """Load, map, and aggregate a single year of IRS data.
+
+    If apportion is True, zip codes that straddle several counties have
+    their totals split across all of them (see crosswalk.apportion)
+    rather than being assigned to their first county.
+
+    If chunksize is given, the file is streamed chunksize rows at a time
+    and aggregated incrementally (see aggregate_chunks) instead of being
+    loaded in full.
+
+    If fused is True, aggregation, per person wealth and percentages are
+    computed in a single pass by aggregate_fused.
+    """
+    if chunksize is not None:
+        # Read, map and aggregate in bounded chunks.
+        data = aggregate_chunks(read_data(chunksize=chunksize, year=year),
+                                apportion=apportion)
+    elif apportion:
+        # Read file.
+        data = read_data(year=year)
+
+        # Map and aggregate in one sparse product.
+        data = crosswalk.apportion(data)
+    else:
+        # Read file.
+        data = read_data(year=year)
+
+        # Get FIPS for all zip codes.
+        data = lookup_fips(data)
+
+    if fused:
+        # Aggregate and compute everything below in one pass.
+        return aggregate_fused(data)
+
+    if chunksize is None and not apportion:
+        # Aggregate by FIPS codes.
+        data = aggregate_by_fips(data)
 
     # Compute wealth per person.
     data = wealth_per_person(data)
@@ -185,6 +363,36 @@ def get_irs_data():
 
     return data
 
+
+@instrument.stage()
+def get_irs_data(apportion=False, chunksize=None, years=None,
+                 processes=None, fused=False):
+    """Main function to load, map, and aggregate IRS data.
+
+    Without years, the IRS_YEAR file is processed (see process_year for
+    apportion, chunksize and fused). Given a collection of years, each year's
+    file is processed in its own worker process (at most processes at a
+    time, default one per CPU) and the results are stacked into one flat
+    table with a leading 'year' column, i.e. one row per (year, FIPS,
+    agi_stub).
+    """
+    if years is None:
+        return process_year(apportion=apportion, chunksize=chunksize,
+                            fused=fused)
+
+    years = sorted(set(years))
+    args = (years, repeat(apportion), repeat(chunksize), repeat(fused))
+    if len(years) == 1 or processes == 1:
+        results = list(map(process_year, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(process_year, *args))
+
+    # Stack the years, each year's rows tagged with it.
+    for year, data in zip(years, results):
+        data.insert(0, 'year', np.int16(year))
+    return pd.concat(results, ignore_index=True)
+
 ########################################################################
 # MAIN
 
@@ -0,0 +1,436 @@
+"""
+Local HTTP service for ZIP/FIPS lookups and county metrics.
+
+The FIPS/ZIP index and the joined county table (Food Environment Atlas
+columns plus mean and median AGI per person, through the cached
+pipeline) are loaded once at start-up, so other jobs can query them
+instead of rebuilding the crosswalk dictionaries or re-reading the CSV
+files. Run it with
+
+    python service.py --port 8050
+
+Endpoints (JSON responses; batch requests POST a JSON body):
+    GET  /zip/<zip>               counties of a zip code
+    GET  /fips/<fips>/zips        zip codes of a county
+    GET  /fips/<fips>/name        county name and state
+    GET  /fips/<fips>/metrics     county metrics
+    POST /zips           {"zips": [...]}     first county of each zip
+    POST /fips/zips      {"fips": [...]}     zip codes of each county
+    POST /fips/names     {"fips": [...]}     name and state of each county
+    POST /fips/metrics   {"fips": [...], "columns": [...]}  (columns
+                                             optional)
+    GET  /stats                   cache and latency counters
+Unknown codes give 404 for single lookups and null in batches. Batch
+bodies must hold lists of strings (400 otherwise). Batch lookups are
+vectorized over the handler's sorted index arrays.
+Responses are kept in an LRU cache keyed by a hash of the request and
+capped by the total size of the cached responses. Unexpected errors give
+a 500 with a JSON error. Batches with large bodies are answered in a
+worker thread, so they don't hold up the event loop.
+
+The HTTP handling is deliberately minimal (HTTP/1.1 with keep-alive,
+Content-Length bodies only) and the service is meant for localhost.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+
+# Standard Library:
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import threading
+import time
+
+# Project modules:
+import feature_store
+import key_codec
+import read_atlas_data
+from fipsZipHandler import FipsZipHandler
+
+########################################################################
+# CONSTANTS
+
+HOST = '127.0.0.1'
+PORT = 8050
+
+# Total size of the responses kept in the LRU cache (bytes).
+CACHE_BYTES = 64 * 2 ** 20
+
+# Largest request body accepted, and smallest one that's answered in a
+# worker thread rather than on the event loop (bytes).
+MAX_BODY = 64 * 2 ** 20
+EXECUTOR_BODY = 64 * 2 ** 10
+
+# County level columns of the joined table served as metrics.
+METRIC_COLUMNS = ([c for c in read_atlas_data.COUNTY_DTYPES if c != 'FIPS']
+                  + ['mean_agi_per_person', 'median_mean_agi'])
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+########################################################################
+# CLASSES
+
+
+class NotFound(LookupError):
+    """Raised for codes or paths that don't exist."""
+
+
+class MethodNotAllowed(Exception):
+    """Raised for HTTP methods other than GET and POST."""
+
+
+class LookupService:
+    """Lookups against indexes loaded once; transport independent.
+
+    handle(method, path, body) returns (status, JSON bytes), so the
+    service can be used (and tested) without a socket.
+    """
+
+    def __init__(self, fz_obj=None, table=None, cache_bytes=CACHE_BYTES):
+        if fz_obj is None:
+            fz_obj = FipsZipHandler()
+        self.fz = fz_obj
+        self.store = feature_store.FeatureStore(fz_obj)
+        loader = county_table if table is None else (lambda: table)
+        self.store.register('counties', loader, METRIC_COLUMNS)
+        # Load everything now rather than on the first request.
+        for column in METRIC_COLUMNS:
+            self.store.array(column)
+
+        # Request hash -> (name, keys, status, payload), least recently
+        # used first. The lock guards the cache and the counters, as
+        # large batches are handled in worker threads.
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = collections.defaultdict(
+            lambda: {'requests': 0, 'keys': 0, 'seconds': 0.0,
+                     'max_seconds': 0.0})
+        self.hits = 0
+        self.misses = 0
+
+    # Lookups. Codes are encoded once (see key_codec) and found by binary
+    # search in the handler's sorted key arrays.
+
+    @staticmethod
+    def _one(keys, code, width):
+        pos, found = key_codec.find(keys, key_codec.encode([str(code)],
+                                                           width))
+        if not found[0]:
+            raise NotFound('Unknown code: {}'.format(code))
+        return pos[0]
+
+    def zip_counties(self, zipcode):
+        i = self._one(self.fz.zipKeys, zipcode, key_codec.ZIP_WIDTH)
+        values = self.fz.zipFipsCodes[self.fz.zipOffsets[i]:
+                                      self.fz.zipOffsets[i + 1]]
+        return {'zip': zipcode, 'fips': key_codec.decode(
+            values, key_codec.FIPS_WIDTH).tolist()}
+
+    def county_zips(self, fips):
+        i = self._one(self.fz.fipsKeys, fips, key_codec.FIPS_WIDTH)
+        values = self.fz.fipsZipCodes[self.fz.fipsOffsets[i]:
+                                      self.fz.fipsOffsets[i + 1]]
+        return {'fips': fips, 'zips': key_codec.decode(
+            values, key_codec.ZIP_WIDTH).tolist()}
+
+    def county_name(self, fips):
+        i = self._one(self.fz.nameKeys, fips, key_codec.FIPS_WIDTH)
+        return {'fips': fips, 'county': str(self.fz.countyNames[i]),
+                'state': str(self.fz.stateCodes[i])}
+
+    def county_metrics(self, fips, columns=None):
+        self._one(self.fz.nameKeys, fips, key_codec.FIPS_WIDTH)
+        metrics = self.metrics([fips], columns)
+        return {'fips': fips,
+                'metrics': {c: v[0] for c, v in metrics.items()}}
+
+    def first_counties(self, zips):
+        """First county of each zip code (None if unknown)."""
+        return self.fz.getFipsForZipcodeArray(
+            np.asarray(zips, dtype=str), missing=None).tolist()
+
+    def zip_lists(self, fips):
+        return self.fz.getZipcodesForFipsArray(
+            np.asarray(fips, dtype=str), missing=None).tolist()
+
+    def names(self, fips):
+        result = self.fz.getCountyNameAndStateForFipsArray(
+            np.asarray(fips, dtype=str), missing=None)
+        return {k: [None if v is None else str(v) for v in values]
+                for k, values in result.items()}
+
+    def metrics(self, fips, columns=None):
+        """{column: values aligned with fips}, None where missing."""
+        if columns is None:
+            columns = METRIC_COLUMNS
+        unknown = [c for c in columns if c not in self.store.columns]
+        if unknown:
+            raise NotFound('Unknown column(s): {}'.format(unknown))
+        rows = self.store.rows(np.asarray(fips, dtype=str))
+        result = {}
+        for column in columns:
+            array = self.store.array(column)
+            if isinstance(array, tuple):
+                codes, categories = array
+                labels = np.append(np.asarray(categories, dtype=object),
+                                   None)
+                # Code -1 (missing) picks the trailing None.
+                codes = np.where(rows >= 0, codes[rows], -1)
+                result[column] = labels[codes].tolist()
+            else:
+                values = np.where(rows >= 0, array[rows], np.nan).tolist()
+                result[column] = [None if v != v else v for v in values]
+        return result
+
+    # Requests.
+
+    @staticmethod
+    def _strings(request, name, optional=False):
+        """request[name], which must be a list of strings; if it's absent
+        (or null), None if optional, else an empty list."""
+        values = request.get(name)
+        if values is None:
+            return None if optional else []
+        if (not isinstance(values, list)
+                or not all(isinstance(v, str) for v in values)):
+            raise ValueError('"{}" must be a list of strings.'.format(name))
+        return values
+
+    def _route(self, method, path, body):
+        """(endpoint name, number of keys, result) for a request."""
+        parts = [p for p in path.split('/') if p]
+        if method == 'GET':
+            if parts == ['stats']:
+                return 'stats', 0, self.stats()
+            if len(parts) == 2 and parts[0] == 'zip':
+                return 'zip', 1, self.zip_counties(parts[1])
+            if len(parts) == 3 and parts[0] == 'fips':
+                lookup = {'zips': self.county_zips,
+                          'name': self.county_name,
+                          'metrics': self.county_metrics}.get(parts[2])
+                if lookup is not None:
+                    return 'fips/' + parts[2], 1, lookup(parts[1])
+        elif method == 'POST':
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError:
+                raise ValueError('Request body is not valid JSON.')
+            if not isinstance(request, dict):
+                raise ValueError('Request body must be a JSON object.')
+            if parts == ['zips']:
+                zips = self._strings(request, 'zips')
+                return 'batch/zips', len(zips), {
+                    'fips': self.first_counties(zips)}
+            if len(parts) == 2 and parts[0] == 'fips':
+                fips = self._strings(request, 'fips')
+                if parts[1] == 'zips':
+                    return 'batch/fips/zips', len(fips), {
+                        'zips': self.zip_lists(fips)}
+                if parts[1] == 'names':
+                    return 'batch/fips/names', len(fips), self.names(fips)
+                if parts[1] == 'metrics':
+                    return 'batch/fips/metrics', len(fips), self.metrics(
+                        fips, self._strings(request, 'columns', True))
+        else:
+            raise MethodNotAllowed(method)
+        raise NotFound('No such endpoint: {} {}'.format(method, path))
+
+    @staticmethod
+    def _key(method, path, body):
+        """Cache key of a request: a hash, so bodies aren't kept."""
+        sha = hashlib.sha256()
+        for part in (method.encode(), path.encode(), body):
+            sha.update(len(part).to_bytes(8, 'little'))
+            sha.update(part)
+        return sha.digest()
+
+    def _cache(self, key, entry):
+        """Add a response to the cache, evicting the least recently
+        used ones to stay within cache_bytes. Call with the lock held."""
+        size = len(entry[3])
+        if size > self.cache_bytes:
+            return
+        self.cache[key] = entry
+        self.cached_bytes += size
+        while self.cached_bytes > self.cache_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= len(evicted[3])
+
+    def handle(self, method, path, body=b''):
+        """Respond to a request: (status, JSON bytes)."""
+        start = time.perf_counter()
+        key = self._key(method, path, body)
+        with self._lock:
+            entry = None if path == '/stats' else self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            name, keys, status, payload = entry
+        else:
+            try:
+                name, keys, result = self._route(method, path, body)
+                status = 200
+            except NotFound as e:
+                name, keys, status, result = 'not_found', 0, 404, {
+                    'error': str(e)}
+            except MethodNotAllowed:
+                name, keys, status, result = 'bad_method', 0, 405, {
+                    'error': 'Method not allowed.'}
+            except (ValueError, TypeError) as e:
+                name, keys, status, result = 'bad_request', 0, 400, {
+                    'error': str(e)}
+            except Exception as e:
+                name, keys, status, result = 'error', 0, 500, {
+                    'error': '{}: {}'.format(type(e).__name__, e)}
+            payload = json.dumps(result).encode()
+            if path != '/stats':
+                with self._lock:
+                    self.misses += 1
+                    if status in (200, 404):
+                        self._cache(key, (name, keys, status, payload))
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            counter = self.counters[name]
+            counter['requests'] += 1
+            counter['keys'] += keys
+            counter['seconds'] += elapsed
+            counter['max_seconds'] = max(counter['max_seconds'], elapsed)
+        return status, payload
+
+    def stats(self):
+        """Cache and per-endpoint latency/throughput counters."""
+        uptime = time.time() - self.started
+        with self._lock:
+            counters = {name: dict(c) for name, c in self.counters.items()}
+            cache = {'size': len(self.cache), 'bytes': self.cached_bytes,
+                     'max_bytes': self.cache_bytes,
+                     'hits': self.hits, 'misses': self.misses}
+        for c in counters.values():
+            c['mean_ms'] = 1000 * c['seconds'] / max(c['requests'], 1)
+            c['us_per_key'] = 1e6 * c['seconds'] / max(c['keys'], 1)
+            c['requests_per_s'] = c['requests'] / uptime
+        return {'uptime_s': uptime, 'cache': cache, 'endpoints': counters}
+
+########################################################################
+# FUNCTIONS
+
+
+def county_table():
+    """One row per county of the joined data, from the cached pipeline."""
+    import analysis
+    tables = analysis.build_pipeline().run(['county_tables'],
+                                           verbose=False)['county_tables']
+    return tables.counties[METRIC_COLUMNS].reset_index()
+
+
+async def _read_request(reader):
+    """(method, path, headers, body) of the next request, or None at the
+    end of the connection."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise OverflowError(length)
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target.split('?', 1)[0], headers, body
+
+
+def _response(status, payload, keep_alive):
+    head = ('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+            'Content-Length: {}\r\nConnection: {}\r\n\r\n').format(
+        status, REASONS[status], len(payload),
+        'keep-alive' if keep_alive else 'close')
+    return head.encode('latin-1') + payload
+
+
+def connection_handler(service):
+    """asyncio.start_server callback answering requests with service."""
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except OverflowError:
+                    writer.write(_response(413, b'{}', False))
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(_response(400, b'{}', False))
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if len(body) >= EXECUTOR_BODY:
+                    # Large batches run in a worker thread.
+                    status, payload = await asyncio.get_running_loop() \
+                        .run_in_executor(None, service.handle, method,
+                                         path, body)
+                else:
+                    status, payload = service.handle(method, path, body)
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+    return handle
+
+
+async def serve(service, host=HOST, port=PORT):
+    """Serve service until cancelled."""
+    server = await asyncio.start_server(connection_handler(service), host,
+                                        port)
+    print('Serving on http://{}:{}'.format(host, port))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    """Command line interface."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--cache-bytes', type=int, default=CACHE_BYTES,
+                        help='Total size of the responses kept in the LRU '
+                        'cache.')
+    args = parser.parse_args(argv)
+
+    service = LookupService(cache_bytes=args.cache_bytes)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+########################################################################
+# MAIN
+
+
+if __name__ == '__main__':
+    main()
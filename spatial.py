@@ -0,0 +1,283 @@
+"""
+Module for spatial autocorrelation of county level data.
+
+Zip codes that straddle several counties (zipToFips.csv lists all of
+them) tie those counties together. With B the binary (zip code x
+county) incidence matrix of the crosswalk, W = B^T B counts the zip codes
+each pair of counties share, and its off-diagonal pattern is used as a
+county adjacency graph. Counties that share no zip code with another
+county are islands (no neighbours).
+
+On top of the (row standardized) weights, global Moran's I and local
+Moran's I (LISA) are computed for any FIPS-indexed column, with
+significance from permutation tests. Permutations are drawn in
+fixed-size batches spread across a process pool; each batch is one
+sparse matrix product (global) or one gather over padded neighbour lists
+(local), and draws from its own child of one SeedSequence, so results
+don't depend on the number of processes.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+# NOTE: scipy.sparse is imported where it's used, as for crosswalk.
+
+# Standard Library:
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+# Project modules:
+import crosswalk
+import key_codec
+
+########################################################################
+# CONSTANTS
+
+# Number of permutations handled by a single worker task.
+BATCH_SIZE = 100
+
+# Default number of permutations.
+PERMUTATIONS = 999
+
+# LISA quadrants (value vs. spatial lag, both standardized).
+QUADRANTS = {1: 'HH', 2: 'LH', 3: 'LL', 4: 'HL'}
+
+########################################################################
+# FUNCTIONS
+
+
+def adjacency(fz_obj=None, binary=True):
+    """County adjacency from zip codes shared between counties.
+
+    Returns a symmetric CSR matrix with a zero diagonal, holding 1 for
+    counties sharing a zip code (or, if binary is False, the number of
+    zip codes they share), and the sorted FIPS keys (see key_codec) of
+    its rows and columns.
+    """
+    matrix, _, fips = crosswalk.crosswalk_matrix(fz_obj)
+    incidence = matrix.copy()
+    incidence.data[:] = 1
+    shared = (incidence.T @ incidence).tocsr()
+    shared.setdiag(0)
+    shared.eliminate_zeros()
+    if binary:
+        shared.data[:] = 1
+    return shared, fips
+
+
+def standardize(w):
+    """Row standardize w, leaving rows of islands empty."""
+    import scipy.sparse as sp
+    sums = np.asarray(w.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        scale = np.where(sums > 0, 1 / sums, 0)
+    return sp.csr_matrix(sp.diags(scale) @ w)
+
+
+def align(values, fips):
+    """Float array of values (a Series indexed by FIPS codes, as strings
+    or integer keys) for the FIPS keys fips; NaN where missing."""
+    pos, found = key_codec.find(
+        fips, key_codec.encode(values.index, key_codec.FIPS_WIDTH))
+    data = np.asarray(values, dtype=np.float64)
+    result = np.full(len(fips), np.nan)
+    result[pos[found]] = data[found]
+    return result
+
+
+def _prepare(values, w, fips):
+    """Standardized values and row standardized weights for the counties
+    that have a value."""
+    if w is None:
+        w, fips = adjacency()
+    if isinstance(values, pd.Series):
+        values = align(values, fips)
+    values = np.asarray(values, dtype=np.float64)
+    keep = np.flatnonzero(~np.isnan(values))
+    w = standardize(w[keep][:, keep])
+    z = values[keep] - values[keep].mean()
+    return z, w, fips[keep], values[keep]
+
+
+def _padded(w):
+    """Neighbour weights of each row padded to the largest row: (n, K)."""
+    counts = np.diff(w.indptr)
+    pad = np.zeros((w.shape[0], max(counts.max(initial=0), 1)))
+    pad[np.repeat(np.arange(w.shape[0]), counts),
+        np.arange(w.nnz) - np.repeat(w.indptr[:-1], counts)] = w.data
+    return pad
+
+
+def _global_batch(z, w, size, seed):
+    """Moran's I of one batch of permutations of z."""
+    rng = np.random.default_rng(seed)
+    n = len(z)
+    permuted = z[rng.permuted(np.tile(np.arange(n), (size, 1)), axis=1)].T
+    lag = w @ permuted
+    return n / w.sum() * (permuted * lag).sum(axis=0) / (z @ z)
+
+
+def _local_batch(z, pad, observed, size, seed):
+    """Counts of conditional permutations with local I >= observed.
+
+    For each county, its neighbours' values are replaced by values drawn
+    without replacement from the other counties. As in PySAL, every
+    county uses the same random draw within a permutation, shifted past
+    its own position.
+    """
+    rng = np.random.default_rng(seed)
+    n, k = pad.shape
+    draws = np.stack([rng.permutation(n - 1)[:k] for _ in range(size)])
+    counts = np.zeros(n, dtype=np.int64)
+    scale = (n - 1) / (z @ z)
+    # Blocks of rows bound the (rows, size, K) gather.
+    step = max(1, 2 ** 22 // (size * k))
+    for start in range(0, n, step):
+        rows = np.arange(start, min(start + step, n))
+        ids = draws[None] + (draws[None] >= rows[:, None, None])
+        lag = np.einsum('rpk,rk->rp', z[ids], pad[rows])
+        local = z[rows, None] * lag * scale
+        counts[rows] = (local >= observed[rows, None]).sum(axis=1)
+    return counts
+
+
+def _run(func, tasks, processes, pool=None):
+    """func over tasks: on pool if given, else on a new pool, or
+    in-process if processes is 1."""
+    if pool is not None:
+        return list(pool.map(func, *zip(*tasks)))
+    if processes == 1 or len(tasks) <= 1:
+        return [func(*t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(func, *zip(*tasks)))
+
+
+def _sizes(permutations):
+    sizes = [BATCH_SIZE] * (permutations // BATCH_SIZE)
+    if permutations % BATCH_SIZE:
+        sizes.append(permutations % BATCH_SIZE)
+    return sizes
+
+
+def moran(values, w=None, fips=None, permutations=PERMUTATIONS, seed=0,
+          processes=None, pool=None):
+    """Global Moran's I of values.
+
+    values is a Series indexed by FIPS code, or an array aligned with
+    fips (the rows of w); w defaults to adjacency(). Counties without a
+    value are dropped. Permutations run on pool (an executor) if given,
+    else on a pool of processes made for this call.
+
+    Returns a dict with n, I, its expectation under no autocorrelation,
+    and (if permutations) the pseudo p-value (one sided, in the
+    direction of I) and z-score from the permutations. If no two of the
+    counties left are neighbours, I and the rest are NaN.
+    """
+    z, w, _, _ = _prepare(values, w, fips)
+    n = len(z)
+    result = {'n': n, 'I': np.nan,
+              'expected': -1 / (n - 1) if n > 1 else np.nan,
+              'islands': int((np.diff(w.indptr) == 0).sum())}
+    if not w.nnz:
+        # Every county is an island, so there's no spatial lag to
+        # correlate with (and w.sum() is 0).
+        if permutations:
+            result['p_sim'] = result['z_sim'] = np.nan
+        return result
+    stat = n / w.sum() * (z @ (w @ z)) / (z @ z)
+    result['I'] = stat
+    if permutations:
+        sizes = _sizes(permutations)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        simulated = np.concatenate(_run(
+            _global_batch, [(z, w, size, s) for size, s in zip(sizes, seeds)],
+            processes, pool))
+        larger = (simulated >= stat).sum()
+        larger = min(larger, permutations - larger)
+        result['p_sim'] = (larger + 1) / (permutations + 1)
+        result['z_sim'] = (stat - simulated.mean()) / simulated.std()
+    return result
+
+
+def lisa(values, w=None, fips=None, permutations=PERMUTATIONS, seed=0,
+         processes=None, pool=None):
+    """Local Moran's I of values (see moran for the arguments).
+
+    Returns a DataFrame indexed by FIPS code (zero padded strings) with
+    the value, its spatial lag, the local I, the quadrant (see
+    QUADRANTS; islands get 0) and (if permutations) the folded pseudo
+    p-value from conditional permutations.
+    """
+    z, w, fips, raw = _prepare(values, w, fips)
+    n = len(z)
+    lag = w @ z
+    local = (n - 1) * z * lag / (z @ z)
+    quadrant = np.select([(z > 0) & (lag > 0), (z <= 0) & (lag > 0),
+                          (z <= 0) & (lag <= 0), (z > 0) & (lag <= 0)],
+                         [1, 2, 3, 4])
+    islands = np.diff(w.indptr) == 0
+    quadrant[islands] = 0
+
+    result = pd.DataFrame(
+        {'value': raw, 'lag': lag + raw.mean(), 'I': local,
+         'quadrant': quadrant},
+        index=pd.Index(key_codec.decode(fips, key_codec.FIPS_WIDTH),
+                       name='FIPS'))
+    if permutations:
+        sizes = _sizes(permutations)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        pad = _padded(w)
+        larger = np.sum(_run(
+            _local_batch,
+            [(z, pad, local, size, s) for size, s in zip(sizes, seeds)],
+            processes, pool), axis=0)
+        larger = np.minimum(larger, permutations - larger)
+        p_sim = (larger + 1) / (permutations + 1)
+        p_sim[islands] = np.nan
+        result['p_sim'] = p_sim
+    return result
+
+
+def moran_table(data, columns, by='agi_stub', county_columns=(),
+                permutations=PERMUTATIONS, seed=0, processes=None):
+    """Global Moran's I of columns of the joined FIPS table.
+
+    Returns one tidy row per (by, column) (or per column if by is None)
+    with the moran() results. county_columns hold one value per county
+    (e.g. the health measures), so they're tested once, on each county's
+    first row, with by left empty. All permutations run on one pool.
+    """
+    w, fips = adjacency()
+    county_columns = [c for c in columns if c in county_columns]
+    columns = [c for c in columns if c not in county_columns]
+    tests = []
+    if county_columns:
+        tests.append((None, data.drop_duplicates('FIPS'), county_columns))
+    if by is None:
+        tests.append((None, data, columns))
+    elif columns:
+        tests.extend((key, group, columns)
+                     for key, group in data.groupby(by, sort=True))
+
+    rows = []
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if processes != 1 and permutations > BATCH_SIZE:
+            pool = stack.enter_context(
+                ProcessPoolExecutor(max_workers=processes))
+        for key, group, group_columns in tests:
+            for column in group_columns:
+                row = {} if by is None else {by: key}
+                row['column'] = column
+                row.update(moran(pd.Series(group[column].to_numpy(),
+                                           index=group['FIPS'].array),
+                                 w, fips, permutations, seed, processes,
+                                 pool))
+                rows.append(row)
+    result = pd.DataFrame(rows)
+    # Keep integer groups (agi_stubs) integers next to the empty ones.
+    if by is not None and pd.api.types.is_integer_dtype(data[by]):
+        result[by] = result[by].astype('Int64')
+    return result
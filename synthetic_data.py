@@ -0,0 +1,235 @@
+"""
+Module for generating synthetic, IRS-shaped input data at any scale.
+
+generate() writes a complete, self-consistent set of input files under a
+root folder, laid out exactly like the real ones relative to the
+working directory:
+    - datasets/zipToFips.csv, fipsToZip.csv, fipsToNameAndState.csv:
+      the ZIP/FIPS crosswalk, with a share of ZIPs in two counties,
+    - datasets/Food_Atlas_County_2013.csv and Food_Atlas_State_2013.csv,
+      with a few counties and values missing,
+    - zipcode<year>/zipcodeagi<yy>.csv: the IRS data, one row per
+      (ZIP, agi_stub) plus the state total ('00000') and 'other'
+      ('99999') rows the real files have.
+Running code from the root folder then reads the synthetic data in place
+of the real data. Nothing is downloaded.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+# Standard Library:
+import os
+
+# Project modules:
+import read_atlas_data
+import read_irs
+from fipsZipHandler import FipsZipHandler
+
+########################################################################
+# CONSTANTS
+
+# (state FIPS code, postal code) of the states and DC.
+STATES = [(1, 'AL'), (2, 'AK'), (4, 'AZ'), (5, 'AR'), (6, 'CA'), (8, 'CO'),
+          (9, 'CT'), (10, 'DE'), (11, 'DC'), (12, 'FL'), (13, 'GA'),
+          (15, 'HI'), (16, 'ID'), (17, 'IL'), (18, 'IN'), (19, 'IA'),
+          (20, 'KS'), (21, 'KY'), (22, 'LA'), (23, 'ME'), (24, 'MD'),
+          (25, 'MA'), (26, 'MI'), (27, 'MN'), (28, 'MS'), (29, 'MO'),
+          (30, 'MT'), (31, 'NE'), (32, 'NV'), (33, 'NH'), (34, 'NJ'),
+          (35, 'NM'), (36, 'NY'), (37, 'NC'), (38, 'ND'), (39, 'OH'),
+          (40, 'OK'), (41, 'OR'), (42, 'PA'), (44, 'RI'), (45, 'SC'),
+          (46, 'SD'), (47, 'TN'), (48, 'TX'), (49, 'UT'), (50, 'VT'),
+          (51, 'VA'), (53, 'WA'), (54, 'WV'), (55, 'WI'), (56, 'WY')]
+
+# Default scale: roughly the real number of counties and ZIPs.
+COUNTIES = 3100
+ZIPS_PER_COUNTY = 10
+
+# Share of ZIPs that also lie in a second county.
+SHARED_ZIP_FRACTION = 0.1
+
+# Share of counties missing from the Food Atlas data.
+MISSING_COUNTY_FRACTION = 0.03
+
+# Mean AGI per return (dollars) for each agi_stub.
+STUB_AGI = np.array([12000, 37000, 62000, 87000, 140000, 450000])
+
+########################################################################
+# FUNCTIONS
+
+
+def _write_csv(data, path, **kwargs):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data.to_csv(path, index=False, **kwargs)
+
+
+def counties(n_counties=COUNTIES):
+    """FIPS codes (integers) and state indices for n_counties counties,
+    spread evenly over the states."""
+    state = np.arange(n_counties) % len(STATES)
+    number = np.arange(n_counties) // len(STATES)
+    state_fips = np.array([s[0] for s in STATES])[state]
+    return state_fips * 1000 + 2 * number + 1, state
+
+
+def crosswalk(fips, zips_per_county=ZIPS_PER_COUNTY,
+              shared_fraction=SHARED_ZIP_FRACTION, rng=None):
+    """Random ZIP codes for the counties and the (zip, fips) pairs.
+
+    Every ZIP gets a primary county; shared_fraction of them are also in
+    the next county of the same state. Returns (zips, primary county
+    index per ZIP, DataFrame of (zip, fips) integer pairs).
+    """
+    rng = np.random.default_rng(rng)
+    n_zips = len(fips) * zips_per_county
+    if n_zips > 99998 - 1000:
+        raise ValueError('Too many ZIP codes requested: {}'.format(n_zips))
+    zips = np.sort(rng.choice(np.arange(1000, 99998), n_zips,
+                              replace=False))
+    primary = rng.integers(0, len(fips), n_zips)
+
+    shared = np.flatnonzero(rng.random(n_zips) < shared_fraction)
+    second = primary[shared] + len(STATES)
+    valid = second < len(fips)
+    pairs = pd.DataFrame({
+        'zip': np.concatenate((zips, zips[shared[valid]])),
+        'fips': np.concatenate((fips[primary], fips[second[valid]]))})
+    return zips, primary, pairs
+
+
+def irs_data(zips, state, year=read_irs.IRS_YEAR, extra_columns=0,
+             rng=None):
+    """IRS-shaped table for the given ZIPs (with their state indices).
+
+    Has read_irs.COLUMNS plus extra_columns filler columns, as the real
+    file has many more columns than are read.
+    """
+    rng = np.random.default_rng(rng)
+    stubs = np.arange(1, 7)
+
+    # Per state total rows and 'other' rows, as in the real files.
+    states = np.arange(len(STATES))
+    zip_codes = np.concatenate((
+        np.char.zfill(zips.astype(str), 5),
+        np.full(len(STATES), '00000'), np.full(len(STATES), '99999')))
+    zip_state = np.concatenate((state, states, states))
+
+    n = len(zip_codes) * len(stubs)
+    row_state = np.repeat(zip_state, len(stubs))
+    agi_stub = np.tile(stubs, len(zip_codes))
+    growth = 1.02 ** (year - read_irs.IRS_YEAR)
+
+    returns = np.rint(rng.lognormal(5, 1.2, n) * growth) * 10
+    single = np.rint(returns * rng.uniform(0.3, 0.6, n))
+    joint = np.rint((returns - single) * rng.uniform(0.5, 0.9, n))
+    head = returns - single - joint
+    agi = np.rint(returns * STUB_AGI[agi_stub - 1] * growth
+                  * rng.lognormal(0, 0.1, n) / 1000)
+
+    data = pd.DataFrame({
+        'STATEFIPS': np.char.zfill(
+            np.array([s[0] for s in STATES])[row_state].astype(str), 2),
+        'STATE': np.array([s[1] for s in STATES])[row_state],
+        'zipcode': np.repeat(zip_codes, len(stubs)),
+        'agi_stub': agi_stub,
+        'N1': returns,
+        'MARS1': single,
+        'MARS2': joint,
+        'MARS4': head,
+        'NUMDEP': np.rint(returns * rng.uniform(0.2, 0.9, n)),
+        'A00100': agi,
+        'A02650': np.rint(agi * rng.uniform(1.0, 1.05, n)),
+    })
+    for i in range(extra_columns):
+        data['X{:05d}'.format(i)] = rng.integers(0, 100000, n)
+    return data
+
+
+def atlas_county_data(fips, state, missing_fraction=MISSING_COUNTY_FRACTION,
+                      rng=None):
+    """Food Atlas county table for the counties, minus a few of them."""
+    rng = np.random.default_rng(rng)
+    keep = rng.random(len(fips)) >= missing_fraction
+    n = keep.sum()
+    data = pd.DataFrame({
+        'FIPS': np.char.zfill(fips[keep].astype(str), 5),
+        'State': np.array([s[1] for s in STATES])[state[keep]],
+        'County': ['County {}'.format(f) for f in fips[keep]],
+        'Population Estimate, 2013': np.rint(rng.lognormal(10, 1.3, n)),
+        'PCT_DIABETES_ADULTS13': np.round(rng.normal(11, 2.5, n), 1),
+        'PCT_OBESE_ADULTS13': np.round(rng.normal(31, 4.5, n), 1),
+        'FOODINSEC_13_15': np.round(rng.normal(14, 3, n), 1),
+        'VLFOODSEC_13_15': np.round(rng.normal(5.5, 1.2, n), 1),
+    })
+    # A handful of missing values, as in the real table.
+    for column in ('PCT_DIABETES_ADULTS13', 'PCT_OBESE_ADULTS13'):
+        data.loc[rng.random(n) < 0.001, column] = np.nan
+    return data
+
+
+def atlas_state_data(rng=None):
+    """Food Atlas state table."""
+    rng = np.random.default_rng(rng)
+    return pd.DataFrame({
+        'StateFIPS': ['{:02d}'.format(s[0]) for s in STATES],
+        'State': [s[1] for s in STATES],
+        # Written with thousands separators, like the real table.
+        'State Population,  2013': ['{:,}'.format(int(p)) for p in np.rint(
+            rng.lognormal(15, 1, len(STATES)))],
+        'Percent population uninsured': np.round(
+            rng.normal(13, 3, len(STATES)), 1),
+        'Cost of living index': np.round(
+            rng.normal(100, 12, len(STATES)), 1),
+    })
+
+
+def generate(root, n_counties=COUNTIES, zips_per_county=ZIPS_PER_COUNTY,
+             years=(read_irs.IRS_YEAR,), extra_columns=0, seed=0):
+    """Write a synthetic data set under root.
+
+    Returns a dict with the scale of the data set: counties, zips, the
+    number of IRS rows per year and the paths of the IRS files.
+    """
+    rng = np.random.default_rng(seed)
+    fips, state = counties(n_counties)
+    zips, primary, pairs = crosswalk(fips, zips_per_county, rng=rng)
+
+    datasets = os.path.join(root, FipsZipHandler.dataFilePrefix)
+    zip_str = np.char.zfill(pairs['zip'].to_numpy().astype(str), 5)
+    fips_str = np.char.zfill(pairs['fips'].to_numpy().astype(str), 5)
+    _write_csv(pd.DataFrame({'zip': zip_str, 'fips': fips_str}),
+               os.path.join(datasets, FipsZipHandler.zipToFipsFile),
+               header=False)
+    order = np.argsort(fips_str, kind='stable')
+    _write_csv(pd.DataFrame({'fips': fips_str[order],
+                             'zip': zip_str[order]}),
+               os.path.join(datasets, FipsZipHandler.fipsToZipFile),
+               header=False)
+    _write_csv(pd.DataFrame({
+        'fips': np.char.zfill(fips.astype(str), 5),
+        'name': ['County {} County'.format(f) for f in fips],
+        'state': np.array([s[1] for s in STATES])[state]}).sort_values(
+            'fips'),
+        os.path.join(datasets, FipsZipHandler.fipsToNameAndStateFile),
+        header=False)
+
+    _write_csv(atlas_county_data(fips, state, rng=rng),
+               os.path.join(root, read_atlas_data.HEALTH_DATA_COUNTY_FILE))
+    _write_csv(atlas_state_data(rng=rng),
+               os.path.join(root, read_atlas_data.HEALTH_DATA_STATE_FILE))
+
+    irs_paths = {}
+    irs_rows = {}
+    for year in years:
+        data = irs_data(zips, state[primary], year, extra_columns, rng=rng)
+        path = os.path.join(root, read_irs.irs_file_path(year))
+        _write_csv(data, path)
+        irs_paths[year] = path
+        irs_rows[year] = len(data)
+
+    return {'counties': len(fips), 'zips': len(zips),
+            'crosswalk_pairs': len(pairs), 'irs_rows': irs_rows,
+            'irs_paths': irs_paths}
@@ -0,0 +1,26 @@
+"""
+pytest configuration: the modules are imported from the repository root,
+as when running them from there, and the synthetic fixture provides a
+small data set (see synthetic_data.py) in a temporary working directory.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+# Years of IRS data in the synthetic data set.
+YEARS = (2013, 2014)
+
+
+@pytest.fixture
+def synthetic(tmp_path, monkeypatch):
+    """Working directory holding a small synthetic data set; returns
+    synthetic_data.generate()'s description of it."""
+    import synthetic_data
+    scale = synthetic_data.generate(str(tmp_path), n_counties=40,
+                                    zips_per_county=3, years=YEARS)
+    monkeypatch.chdir(tmp_path)
+    return scale
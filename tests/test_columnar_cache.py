@@ -0,0 +1,103 @@
+"""Tests for columnar_cache."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import columnar_cache
+import key_codec
+
+CSV = 'zipcode,agi_stub,N1,STATE\n00501,1,10.5,NY\n35004,2,3,AL\n'
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    with open(path, 'w') as f:
+        f.write(CSV)
+    return path
+
+
+def _read(path, **kwargs):
+    return columnar_cache.read_csv(path, codes={'zipcode': 5}, **kwargs)
+
+
+def _manifest(path):
+    with open(os.path.join(columnar_cache.cache_dir(path),
+                           'manifest.json')) as f:
+        return json.load(f)
+
+
+def test_read_matches_csv(path):
+    data = _read(path)
+    assert data['zipcode'].dtype == key_codec.PANDAS_DTYPE
+    assert data['zipcode'].tolist() == [501, 35004]
+    assert data['agi_stub'].dtype == np.int8
+    expected = pd.read_csv(path, usecols=['N1', 'STATE'])
+    pd.testing.assert_frame_equal(
+        _read(path, usecols=['N1', 'STATE'], dtype={'STATE': object}),
+        expected, check_dtype=False)
+    # Read again from the cache.
+    pd.testing.assert_frame_equal(_read(path), data)
+
+
+def test_changed_source_is_converted_again(path):
+    _read(path)
+    with open(path, 'a') as f:
+        f.write('99999,3,7,XX\n')
+    assert _read(path)['zipcode'].tolist() == [501, 35004, 99999]
+    assert _manifest(path)['rows'] == 3
+
+    # Same size, different contents.
+    with open(path, 'w') as f:
+        f.write(CSV.replace('10.5', '12.5'))
+    assert _read(path)['N1'].tolist() == [12.5, 3.0]
+
+
+def test_touched_source_keeps_the_cache(path):
+    _read(path)
+    directory = columnar_cache.cache_dir(path)
+    built = os.stat(os.path.join(directory, '0.values.npy')).st_mtime_ns
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    _read(path)
+    assert os.stat(os.path.join(directory, '0.values.npy')).st_mtime_ns == \
+        built
+    assert _manifest(path)['mtime_ns'] == os.stat(path).st_mtime_ns
+    # The manifest was replaced, not rewritten in place.
+    assert not [f for f in os.listdir(directory) if f.endswith('.tmp')]
+
+
+def test_other_options_rebuild(path):
+    _read(path)
+    data = columnar_cache.read_csv(path)
+    assert data['zipcode'].tolist() == [501, 35004]
+    assert 'width' not in _manifest(path)['columns']['zipcode']
+
+
+def test_chunks(path):
+    # Without a cache the CSV is streamed; with one, the columns are
+    # sliced.
+    streamed = pd.concat(_read(path, chunksize=1), ignore_index=True)
+    assert not os.path.exists(columnar_cache.cache_dir(path))
+    _read(path)
+    cached = pd.concat(_read(path, chunksize=1), ignore_index=True)
+    assert streamed['zipcode'].tolist() == cached['zipcode'].tolist()
+    np.testing.assert_array_equal(streamed['N1'], cached['N1'])
+
+
+def test_write_frame_replaces_the_folder(tmp_path):
+    directory = str(tmp_path / 'frame')
+    columnar_cache.write_frame(pd.DataFrame({'a': [1, 2], 'b': [3, 4]}),
+                               directory)
+    data = pd.DataFrame({'FIPS': ['01001'], 'a': [1.5]})
+    columnar_cache.write_frame(data, directory, codes={'FIPS': 5})
+    # No temporary or old folder is left behind.
+    assert sorted(os.listdir(str(tmp_path))) == ['frame']
+    loaded = columnar_cache.read_frame(directory)
+    assert loaded.columns.tolist() == ['FIPS', 'a']
+    assert loaded['FIPS'].tolist() == [1001]
+    assert sorted(os.listdir(directory)) == ['0.values.npy', '1.values.npy',
+                                             'manifest.json']
@@ -0,0 +1,70 @@
+"""Tests for correlation."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import correlation
+
+stats = pytest.importorskip('scipy.stats')
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 60
+    income = rng.normal(size=(n, 2))
+    health = income @ [[0.8, 0.1], [0.0, -0.5]] + rng.normal(size=(n, 2))
+    return pd.DataFrame({'agi_stub': np.repeat([1, 2], n // 2),
+                         'h1': health[:, 0], 'h2': health[:, 1],
+                         'i1': income[:, 0], 'i2': income[:, 1]})
+
+
+def _check_against_scipy(data, result):
+    for _, row in result.iterrows():
+        group = data[data['agi_stub'] == row['agi_stub']]
+        pair = group[[row['health'], row['income']]].dropna()
+        x, y = pair.to_numpy().T
+        assert row['n'] == len(pair)
+        assert row['pearson'] == pytest.approx(stats.pearsonr(x, y)[0])
+        assert row['spearman'] == pytest.approx(stats.spearmanr(x, y)[0])
+
+
+def test_matches_scipy(data):
+    result = correlation.correlate(data, ['h1', 'h2'], ['i1', 'i2'],
+                                   n_resamples=0)
+    assert len(result) == 8
+    _check_against_scipy(data, result)
+
+
+def test_nans_are_deleted_pairwise(data):
+    data.loc[[0, 5], 'h1'] = np.nan
+    data.loc[[7], 'i2'] = np.nan
+    result = correlation.correlate(data, ['h1', 'h2'], ['i1', 'i2'],
+                                   n_resamples=0)
+    assert not result[['pearson', 'spearman']].isna().any().any()
+    assert result.loc[result['agi_stub'] == 1, 'n'].tolist() == [
+        28, 27, 30, 29]
+    _check_against_scipy(data, result)
+
+
+def test_too_few_rows_give_nan(data):
+    data.loc[1:, 'h1'] = np.nan
+    result = correlation.correlate(data, ['h1'], ['i1'], by=None,
+                                   n_resamples=20, processes=1)
+    assert result['n'].tolist() == [1]
+    assert result.drop(columns=['health', 'income', 'n']).isna().all(
+        axis=None)
+
+
+def test_resampling_is_reproducible(data):
+    data.loc[3, 'i1'] = np.nan
+    kwargs = dict(n_resamples=250, processes=1, seed=3)
+    first = correlation.correlate(data, ['h1'], ['i1', 'i2'], **kwargs)
+    second = correlation.correlate(data, ['h1'], ['i1', 'i2'], **kwargs)
+    pd.testing.assert_frame_equal(first, second)
+    assert (first['pearson_low'] <= first['pearson']).all()
+    assert (first['pearson'] <= first['pearson_high']).all()
+    permutation = correlation.correlate(data, ['h1'], ['i1'],
+                                        method='permutation', **kwargs)
+    assert ((permutation['pearson_p'] > 0)
+            & (permutation['pearson_p'] <= 1)).all()
@@ -0,0 +1,98 @@
+"""Tests for county_tables."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import county_tables
+
+
+@pytest.fixture
+def data():
+    """Joined rows of three counties; 02013 lacks agi_stub 2."""
+    return pd.DataFrame({
+        'FIPS': pd.array([1003, 1001, 1001, 1003, 2013, None],
+                         dtype='UInt32'),
+        'agi_stub': [2, 1, 2, 1, 1, 1],
+        'N1': [40.0, 10.0, 20.0, 30.0, 50.0, 60.0],
+        'State': ['AL', 'AL', 'AL', 'AL', 'AK', 'AK'],
+        'PCT_OBESE_ADULTS13': [30.0, 20.0, 20.0, 30.0, np.nan, 1.0],
+    })
+
+
+def _sorted(frame):
+    return frame.sort_values(['agi_stub', 'FIPS'], ignore_index=True)
+
+
+def test_split(data):
+    tables = county_tables.split(
+        data, county_columns=['State', 'PCT_OBESE_ADULTS13'])
+    assert len(tables) == 3
+    assert tables.counties.index.tolist() == [1001, 1003, 2013]
+    assert tables.county_columns == ['State', 'PCT_OBESE_ADULTS13']
+    assert tables.stub_columns == ['N1']
+    assert tables.stub_values.tolist() == [1, 2]
+    assert len(tables.stubs) == 5
+
+
+def test_county_columns_default_to_constant_columns(data):
+    tables = county_tables.split(data)
+    assert tables.county_columns == ['State', 'PCT_OBESE_ADULTS13']
+
+
+def test_absent_county_columns_are_skipped(data):
+    tables = county_tables.split(
+        data, county_columns=county_tables.COUNTY_COLUMNS)
+    assert tables.county_columns == ['State', 'PCT_OBESE_ADULTS13']
+
+
+def test_joined_round_trip(data):
+    tables = county_tables.split(data)
+    joined = tables.joined()
+    expected = _sorted(data.dropna(subset=['FIPS']))[joined.columns]
+    pd.testing.assert_frame_equal(joined, expected, check_dtype=False)
+    assert joined['FIPS'].dtype == 'UInt32'
+
+
+def test_stub(data):
+    tables = county_tables.split(data)
+    stub = tables.stub(2, ['N1', 'State'])
+    assert stub.columns.tolist() == ['FIPS', 'State', 'N1']
+    assert stub['FIPS'].tolist() == [1001, 1003]
+    assert stub['N1'].tolist() == [20.0, 40.0]
+    assert stub['State'].tolist() == ['AL', 'AL']
+
+
+def test_complete_stub_shares_the_county_arrays(data):
+    tables = county_tables.split(data)
+    stub = tables.stub(1)
+    assert len(stub) == 3
+    assert np.shares_memory(
+        stub['PCT_OBESE_ADULTS13'].to_numpy(),
+        tables.counties['PCT_OBESE_ADULTS13'].to_numpy())
+
+
+def test_unknown_stub_and_columns(data):
+    tables = county_tables.split(data)
+    with pytest.raises(KeyError):
+        tables.stub(3)
+    with pytest.raises(KeyError):
+        tables.joined(['N2'])
+
+
+def test_save_and_load(data, tmp_path):
+    tables = county_tables.split(data)
+    tables.save(str(tmp_path / 'tables'))
+    loaded = county_tables.CountyTables.load(str(tmp_path / 'tables'))
+    assert loaded.key == tables.key and loaded.by == tables.by
+    # Text columns come back as categoricals (see columnar_cache).
+    pd.testing.assert_frame_equal(loaded.joined().astype(object),
+                                  tables.joined().astype(object))
+
+
+def test_empty():
+    data = pd.DataFrame({'FIPS': pd.array([], dtype='UInt32'),
+                         'agi_stub': np.array([], dtype=np.int64),
+                         'N1': np.array([], dtype=np.float64)})
+    tables = county_tables.split(data, county_columns=[])
+    assert len(tables) == 0
+    assert len(tables.joined()) == 0
@@ -0,0 +1,70 @@
+"""Tests for crosswalk."""
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import crosswalk
+import key_codec
+
+pytest.importorskip('scipy')
+
+
+@pytest.fixture
+def fz_obj():
+    """Zip index of the handler's shape: 00501 lies in 01001 and 01003,
+    35004 in 01003 only."""
+    return SimpleNamespace(
+        zipKeys=np.array([501, 35004], dtype=key_codec.DTYPE),
+        zipOffsets=np.array([0, 2, 3]),
+        zipFipsCodes=np.array([1001, 1003, 1003], dtype=key_codec.DTYPE))
+
+
+def test_equal_weights(fz_obj):
+    matrix, zips, fips = crosswalk.crosswalk_matrix(fz_obj)
+    assert zips.tolist() == [501, 35004]
+    assert fips.tolist() == [1001, 1003]
+    assert matrix.toarray().tolist() == [[0.5, 0.5], [0.0, 1.0]]
+
+
+def test_given_weights():
+    weights = pd.DataFrame({'zipcode': ['35004', '00501', 'bad'],
+                            'FIPS': ['01003', '01001', '01001'],
+                            'weight': [1.0, 0.25, 1.0]})
+    matrix, zips, fips = crosswalk.crosswalk_matrix(weights=weights)
+    assert zips.tolist() == [501, 35004]
+    assert fips.tolist() == [1001, 1003]
+    assert matrix.toarray().tolist() == [[0.25, 0.0], [0.0, 1.0]]
+
+
+def test_apportion(fz_obj):
+    irs_data = pd.DataFrame({
+        'zipcode': ['00501', '35004', '00501', '99999', '35004'],
+        'agi_stub': [1, 1, 2, 1, 2],
+        'N1': [10.0, 4.0, 6.0, 100.0, np.nan],
+    })
+    result = crosswalk.apportion(irs_data, ['N1'],
+                                 crosswalk.crosswalk_matrix(fz_obj))
+    assert result.columns.tolist() == ['FIPS', 'agi_stub', 'N1']
+    assert result['FIPS'].dtype == key_codec.PANDAS_DTYPE
+    # Unknown zip codes and NaN rows are dropped; the rest is conserved.
+    assert list(zip(result['FIPS'], result['agi_stub'], result['N1'])) == [
+        (1001, 1, 5.0), (1001, 2, 3.0), (1003, 1, 9.0), (1003, 2, 3.0)]
+
+
+def test_apportion_default_columns(fz_obj):
+    irs_data = pd.DataFrame({'zipcode': ['35004'], 'STATEFIPS': [1],
+                             'agi_stub': [1], 'N1': [2.0], 'A00100': [3.0]})
+    result = crosswalk.apportion(irs_data,
+                                 crosswalk=crosswalk.crosswalk_matrix(fz_obj))
+    assert result.columns.tolist() == ['FIPS', 'agi_stub', 'N1', 'A00100']
+
+
+def test_apportion_nothing_found(fz_obj):
+    irs_data = pd.DataFrame({'zipcode': ['99999'], 'agi_stub': [1],
+                             'N1': [1.0]})
+    result = crosswalk.apportion(irs_data, ['N1'],
+                                 crosswalk.crosswalk_matrix(fz_obj))
+    assert len(result) == 0
+    assert result.columns.tolist() == ['FIPS', 'agi_stub', 'N1']
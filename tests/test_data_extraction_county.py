@@ -0,0 +1,47 @@
+"""Tests for data_extraction_county."""
+import os
+
+import pytest
+
+import data_extraction_county
+import key_codec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def root(monkeypatch):
+    """The repository root, whose datasets folder holds the Food Atlas
+    tables."""
+    files = [path for path, _ in data_extraction_county.SPECS]
+    files.append(os.path.join('datasets', data_extraction_county.OUTPUT_FILE))
+    if not all(os.path.exists(os.path.join(ROOT, f)) for f in files):
+        pytest.skip('Food Atlas datasets not found.')
+    monkeypatch.chdir(ROOT)
+    return ROOT
+
+
+def test_output_is_byte_identical(root, tmp_path):
+    output = str(tmp_path / data_extraction_county.OUTPUT_FILE)
+    data_extraction_county.extract(output=output)
+    with open(output, 'rb') as f:
+        written = f.read()
+    with open(os.path.join('datasets', data_extraction_county.OUTPUT_FILE),
+              'rb') as f:
+        assert written == f.read()
+    assert os.listdir(str(tmp_path)) == [data_extraction_county.OUTPUT_FILE]
+
+
+def test_join_keeps_the_base_table(tmp_path):
+    base = tmp_path / 'base.csv'
+    base.write_text('FIPS,a\n01001,1\n02013,2\n', encoding='cp1252')
+    other = tmp_path / 'other.csv'
+    other.write_text('FIPS,b,c\n02013,x,9\n09001,y,8\n', encoding='cp1252')
+    data = data_extraction_county.join_tables(
+        [(str(base), ['a']), (str(other), ['b'])])
+    assert data['FIPS'].dtype == key_codec.PANDAS_DTYPE
+    assert data['FIPS'].tolist() == [1001, 2013]
+    assert data['a'].tolist() == [1, 2]
+    assert data['b'].isna().tolist() == [True, False]
+    assert data['b'].iloc[1] == 'x'
+    assert 'c' not in data.columns
@@ -0,0 +1,72 @@
+"""Tests for data_stages."""
+import contextlib
+import io
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_stages
+import read_atlas_data
+import read_irs
+import weighted_stats
+from conftest import YEARS
+
+
+@pytest.fixture
+def irs_years(synthetic):
+    return read_irs.get_irs_data(years=YEARS, processes=1)
+
+
+def _quiet(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def test_store_has_irs_totals_per_year(irs_years):
+    store = _quiet(data_stages.build_store, irs_years,
+                   read_atlas_data.read_data())
+    for year in YEARS:
+        rows = irs_years[irs_years['year'] == year]
+        expected = rows.groupby('FIPS')['N1'].sum()
+        values = store.gather(['N1_total_for_FIPS {}'.format(year)],
+                              expected.index)
+        np.testing.assert_allclose(values.iloc[:, 0], expected)
+
+
+def test_join_and_mean_medians_per_year(irs_years):
+    atlas_data = read_atlas_data.read_data()
+    store = _quiet(data_stages.build_store, irs_years, atlas_data)
+    joined = _quiet(data_stages.join_data, irs_years, store)
+    assert sorted(joined['year'].unique()) == list(YEARS)
+    data = data_stages.compute_mean_medians(joined)
+    for year in YEARS:
+        rows = joined[joined['year'] == year].drop(columns='year')
+        expected = data_stages.compute_mean_medians(rows)
+        actual = data[data['year'] == year]
+        for column in ('mean_agi_per_person', 'median_mean_agi'):
+            pd.testing.assert_series_equal(actual[column], expected[column])
+
+
+def test_store_has_income_distribution_per_year(irs_years):
+    store = _quiet(data_stages.build_store, irs_years,
+                   read_atlas_data.read_data())
+    for year in YEARS:
+        rows = irs_years[irs_years['year'] == year]
+        expected = weighted_stats.distribution_features(rows)
+        values = store.gather(
+            ['{} {}'.format(c, year) for c in expected.columns],
+            expected.index)
+        np.testing.assert_allclose(values, expected)
+
+
+def test_store_coverage_is_logged(irs_years, caplog, capsys):
+    atlas_data = read_atlas_data.read_data()
+    data_stages.build_store(irs_years, atlas_data)
+    assert not caplog.records and not capsys.readouterr().out
+    with caplog.at_level(logging.INFO, logger='data_stages'):
+        store = data_stages.build_store(irs_years, atlas_data)
+    assert 'coverage of {} counties'.format(len(store)) in caplog.text
+    assert 'gini_agi_per_person {}'.format(YEARS[0]) in caplog.text
+    assert not capsys.readouterr().out
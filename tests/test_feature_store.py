@@ -0,0 +1,53 @@
+"""Tests for feature_store."""
+from functools import partial
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_store
+import key_codec
+
+
+def _frame(data):
+    return data
+
+
+@pytest.fixture
+def store():
+    fz_obj = SimpleNamespace(nameKeys=np.array([1001, 1003, 2013],
+                                               dtype=key_codec.DTYPE))
+    return feature_store.FeatureStore(fz_obj)
+
+
+def test_load_and_gather(store):
+    data = pd.DataFrame({'FIPS': ['02013', '01001', '99999'],
+                         'x': [1.0, 2.0, 3.0], 'State': ['AK', 'AL', 'XX']})
+    store.register('d', partial(_frame, data), ['x', 'State'])
+    frame = store.frame(fips=['01001', '01003', '02013'])
+    assert frame['x'].tolist()[::2] == [2.0, 1.0]
+    assert np.isnan(frame['x'].iloc[1])
+    assert frame['State'].isna().tolist() == [False, True, False]
+    assert frame['State'].iloc[::2].tolist() == ['AL', 'AK']
+    assert store.missing('x').tolist() == ['01003']
+    assert store.stats('d')['unmatched_fips'] == ['99999']
+    coverage = store.coverage()
+    assert coverage['present'].tolist() == [2, 2]
+    assert coverage['unmatched'].tolist() == [1, 1]
+
+
+def test_duplicate_counties_raise(store):
+    data = pd.DataFrame({'FIPS': ['01001', '01003', '01001'],
+                         'x': [1.0, 2.0, 3.0]})
+    store.register('d', partial(_frame, data), ['x'])
+    with pytest.raises(ValueError, match='1 duplicate FIPS rows'):
+        store.array('x')
+
+
+def test_columns_are_registered_once(store):
+    store.register('d', partial(_frame, None), ['x'])
+    with pytest.raises(ValueError):
+        store.register('e', partial(_frame, None), ['x'])
+    with pytest.raises(ValueError):
+        store.register('d', partial(_frame, None), ['y'])
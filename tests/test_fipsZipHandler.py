@@ -0,0 +1,61 @@
+"""Tests for fipsZipHandler."""
+import json
+import os
+
+import numpy as np
+
+from fipsZipHandler import FipsZipHandler
+
+ARRAYS = ('zipKeys', 'zipOffsets', 'zipFipsCodes', 'fipsKeys',
+          'fipsOffsets', 'fipsZipCodes', 'nameKeys', 'countyNames',
+          'stateCodes')
+
+
+def _index_file(name):
+    return os.path.join(FipsZipHandler.dataFilePrefix,
+                        FipsZipHandler.indexDir, name)
+
+
+def _assert_same(handler, other):
+    for name in ARRAYS:
+        np.testing.assert_array_equal(getattr(handler, name),
+                                      getattr(other, name))
+
+
+def test_index_reloads_from_its_manifest(synthetic):
+    built = FipsZipHandler()
+    assert not isinstance(built.zipKeys, np.memmap)
+    with open(_index_file('manifest.json')) as f:
+        manifest = json.load(f)
+    assert manifest['version'] == FipsZipHandler.indexVersion
+    assert len(manifest['arrays']) == len(ARRAYS)
+
+    loaded = FipsZipHandler()
+    assert isinstance(loaded.zipKeys, np.memmap)
+    _assert_same(loaded, built)
+    _assert_same(loaded, FipsZipHandler(useIndexCache=False))
+    assert loaded.zipToFipsMap == built.zipToFipsMap
+    assert loaded.fipsToCountyNameAndStateMap == \
+        built.fipsToCountyNameAndStateMap
+
+
+def test_changed_source_rebuilds_the_index(synthetic):
+    handler = FipsZipHandler()
+    path = FipsZipHandler.dataFilePrefix + FipsZipHandler.zipToFipsFile
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, 'w') as f:
+        f.writelines(lines[:-1])
+
+    rebuilt = FipsZipHandler()
+    assert not isinstance(rebuilt.zipKeys, np.memmap)
+    assert len(rebuilt.zipFipsCodes) == len(handler.zipFipsCodes) - 1
+    _assert_same(FipsZipHandler(), rebuilt)
+
+
+def test_unreadable_manifest_rebuilds(synthetic):
+    built = FipsZipHandler()
+    with open(_index_file('manifest.json'), 'w') as f:
+        f.write('{')
+    _assert_same(FipsZipHandler(), built)
+    assert isinstance(FipsZipHandler().zipKeys, np.memmap)
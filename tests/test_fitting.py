@@ -0,0 +1,91 @@
+"""Tests for fitting."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import fitting
+
+HEALTH = ['PCT_OBESE_ADULTS13', 'PCT_DIABETES_ADULTS13']
+INCOME = ['agi_per_person', 'median_mean_agi']
+
+
+@pytest.fixture
+def data():
+    """Two agi_stubs of noisy quadratic trends with some NaNs."""
+    rng = np.random.default_rng(0)
+    n = 60
+    data = pd.DataFrame({'agi_stub': np.repeat([1, 2], n // 2)})
+    for column in INCOME:
+        data[column] = rng.uniform(10000, 90000, n)
+    x = data[INCOME[0]] / 10000
+    data[HEALTH[0]] = 30 - 2 * x + 0.3 * x ** 2 + rng.normal(0, 1, n)
+    data[HEALTH[1]] = 5 + 0.1 * x + rng.normal(0, 1, n)
+    data.loc[[3, 40], HEALTH[0]] = np.nan
+    data.loc[[7], INCOME[1]] = np.nan
+    return data
+
+
+def _r2(y, pred):
+    return 1 - ((y - pred) ** 2).sum() / ((y - y.mean()) ** 2).sum()
+
+
+def test_fits_match_polyfit(data):
+    scores, curves = fitting.fit_polynomials(data, HEALTH, INCOME)
+    assert len(scores) == 2 * len(HEALTH) * len(INCOME) * 2
+    for row in scores.itertuples():
+        rows = data[data['agi_stub'] == row.agi_stub]
+        rows = rows[[row.income, row.health]].dropna()
+        x, y = rows[row.income].to_numpy(), rows[row.health].to_numpy()
+        coef = np.polyfit(x, y, row.degree)
+        assert row.n == len(rows)
+        np.testing.assert_allclose(row.r2, _r2(y, np.polyval(coef, x)))
+        if row.best:
+            curve_x, curve_y = curves[(row.agi_stub, row.health,
+                                       row.income)]
+            # The grid spans the income column of the group.
+            income = data.loc[data['agi_stub'] == row.agi_stub, row.income]
+            np.testing.assert_allclose(curve_x[[0, -1]],
+                                       [income.min(), income.max()])
+            np.testing.assert_allclose(curve_y, np.polyval(coef, curve_x))
+
+
+def test_cross_validation_matches_refits(data):
+    folds = 3
+    scores, _ = fitting.fit_polynomials(data, HEALTH, INCOME, folds=folds,
+                                        seed=1)
+    # Fold of each row within its group, as fit_polynomials assigns them.
+    fold = np.random.default_rng(1).permutation(30) % folds
+    for row in scores.itertuples():
+        rows = data[data['agi_stub'] == row.agi_stub].reset_index(drop=True)
+        rows = rows[[row.income, row.health]].dropna()
+        x, y = rows[row.income].to_numpy(), rows[row.health].to_numpy()
+        row_fold = fold[rows.index]
+        r2 = []
+        for f in range(folds):
+            train, test = row_fold != f, row_fold == f
+            coef = np.polyfit(x[train], y[train], row.degree)
+            r2.append(_r2(y[test], np.polyval(coef, x[test])))
+        np.testing.assert_allclose(row.cv_r2, np.mean(r2))
+
+
+def test_best_degree(data):
+    scores, _ = fitting.fit_polynomials(data, HEALTH, INCOME, folds=0)
+    assert scores['cv_r2'].isna().all()
+    best = scores[scores['best']].set_index(['agi_stub', 'health',
+                                             'income'])['degree']
+    assert len(best) == 2 * len(HEALTH) * len(INCOME)
+    # The quadratic trend needs degree 2 without cross-validation.
+    assert (best.xs(HEALTH[0], level='health').xs(
+        INCOME[0], level='income') == 2).all()
+
+
+def test_without_groups(data):
+    scores, curves = fitting.fit_polynomials(data, HEALTH[:1], INCOME[:1],
+                                             by=None, degrees=(1,))
+    assert 'agi_stub' not in scores.columns
+    rows = data[[INCOME[0], HEALTH[0]]].dropna()
+    coef = np.polyfit(rows[INCOME[0]], rows[HEALTH[0]], 1)
+    np.testing.assert_allclose(
+        scores['r2'].iloc[0],
+        _r2(rows[HEALTH[0]], np.polyval(coef, rows[INCOME[0]])))
+    assert list(curves) == [(None, HEALTH[0], INCOME[0])]
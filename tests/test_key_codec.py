@@ -0,0 +1,90 @@
+"""Tests for key_codec."""
+import numpy as np
+import pandas as pd
+
+import key_codec
+
+
+def test_round_trip_keeps_leading_zeros():
+    codes = ['01001', '00501', '99999', '00000']
+    encoded = key_codec.encode(codes, key_codec.FIPS_WIDTH)
+    assert encoded.dtype == key_codec.DTYPE
+    assert encoded.tolist() == [1001, 501, 99999, 0]
+    assert key_codec.decode(encoded, key_codec.FIPS_WIDTH).tolist() == codes
+
+
+def test_invalid_codes_are_missing():
+    codes = ['1001', '010011', '01a01', '', ' 1001', None, np.nan]
+    encoded = key_codec.encode(np.array(codes, dtype=object),
+                               key_codec.FIPS_WIDTH)
+    assert (encoded == key_codec.MISSING).all()
+    decoded = key_codec.decode(encoded, key_codec.FIPS_WIDTH, missing=None)
+    assert decoded.tolist() == [None] * len(codes)
+
+
+def test_integers_and_out_of_range():
+    encoded = key_codec.encode(np.array([1001, -1, 100000]),
+                               key_codec.FIPS_WIDTH)
+    assert encoded.tolist() == [1001, key_codec.MISSING, key_codec.MISSING]
+
+
+def test_floats():
+    encoded = key_codec.encode(np.array([1001.0, 1001.5, np.nan, np.inf]),
+                               key_codec.FIPS_WIDTH)
+    assert encoded.tolist() == [1001] + [key_codec.MISSING] * 3
+
+
+def test_nullable_integers():
+    codes = pd.Series([1001, None, 56045], dtype='Int64')
+    encoded = key_codec.encode(codes, key_codec.FIPS_WIDTH)
+    assert encoded.tolist() == [1001, key_codec.MISSING, 56045]
+    assert key_codec.decode(codes, key_codec.FIPS_WIDTH,
+                            missing=None).tolist() == ['01001', None,
+                                                       '56045']
+
+
+def test_object_integers():
+    codes = np.array([1001, None, 501], dtype=object)
+    encoded = key_codec.encode(codes, key_codec.ZIP_WIDTH)
+    assert encoded.tolist() == [1001, key_codec.MISSING, 501]
+
+
+def test_encode_column_is_nullable():
+    column = key_codec.encode_column(['01001', 'bad', '56045'],
+                                     key_codec.FIPS_WIDTH)
+    assert column.dtype == key_codec.PANDAS_DTYPE
+    assert column.isna().tolist() == [False, True, False]
+    assert column[0] == 1001
+
+
+def test_to_pandas_round_trip():
+    codes = np.array([1001, key_codec.MISSING], dtype=key_codec.DTYPE)
+    array = key_codec.to_pandas(codes)
+    assert pd.isna(array[1])
+    assert key_codec.encode(array, key_codec.FIPS_WIDTH).tolist() == \
+        codes.tolist()
+
+
+def test_find():
+    keys = np.array([501, 1001, 56045], dtype=key_codec.DTYPE)
+    codes = np.array([1001, 2, 56045, 99999, key_codec.MISSING],
+                     dtype=key_codec.DTYPE)
+    pos, found = key_codec.find(keys, codes)
+    assert found.tolist() == [True, False, True, False, False]
+    assert pos[found].tolist() == [1, 2]
+
+
+def test_find_missing_key():
+    # MISSING is never found, even if it's in keys.
+    keys = np.array([1001, key_codec.MISSING], dtype=key_codec.DTYPE)
+    _, found = key_codec.find(keys, [key_codec.MISSING])
+    assert not found.any()
+
+
+def test_find_empty_keys():
+    keys = np.array([], dtype=key_codec.DTYPE)
+    pos, found = key_codec.find(keys, [1001, 501])
+    assert len(pos) == 2
+    assert not found.any()
+    pos, found = key_codec.find(keys, [])
+    assert len(pos) == 0 and len(found) == 0
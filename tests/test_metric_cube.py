@@ -0,0 +1,112 @@
+"""Tests for metric_cube."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import county_tables
+import metric_cube
+
+
+@pytest.fixture
+def data():
+    """Two states: 01 with two counties, 02 with one lacking agi_stub 2."""
+    return pd.DataFrame({
+        'FIPS': pd.array([1001, 1001, 1003, 1003, 2013, None],
+                         dtype='UInt32'),
+        'agi_stub': [1, 2, 1, 2, 1, 1],
+        'N1': [10.0, 20.0, 30.0, 40.0, 50.0, 60.0],
+        'population': [100.0, 100.0, 300.0, 300.0, 50.0, 0.0],
+    })
+
+
+def test_build_shapes_and_missing_cells(data):
+    cube = metric_cube.build(data, ['N1'], ['population'])
+    assert cube.shape == (1, 3, 2, 1)
+    assert cube.fips.tolist() == ['01001', '01003', '02013']
+    assert cube.get('N1', stub=1).tolist() == [10.0, 30.0, 50.0]
+    assert np.isnan(cube.get('N1', stub=2, county=2013))
+    assert cube.get('population').tolist() == [100.0, 300.0, 50.0]
+
+
+def test_default_metrics(data):
+    cube = metric_cube.build(data, county_metrics=['population'])
+    assert cube.metrics == ['N1']
+
+
+def test_totals(data):
+    cube = metric_cube.build(data, ['N1'], ['population'])
+    assert cube.totals('N1').tolist() == [30.0, 70.0, 50.0]
+    assert cube.totals('N1', county='01003') == 70.0
+    assert cube.state_totals('N1', stub=1).tolist() == [40.0, 50.0]
+    assert cube.state_totals('population', state=1) == 400.0
+    assert cube.state_totals('N1', stub=2, mean=True)[0] == 30.0
+    assert np.isnan(cube.state_totals('N1', stub=2, mean=True)[1])
+    assert cube.national_totals('N1', stub=1) == 90.0
+    assert cube.national_totals('population', mean=True) == 150.0
+
+
+def test_totals_of_county_metrics_raise(data):
+    cube = metric_cube.build(data, ['N1'], ['population'])
+    with pytest.raises(ValueError):
+        cube.totals('population')
+    with pytest.raises(KeyError):
+        cube.totals('N2')
+
+
+def test_weighted_mean(data):
+    cube = metric_cube.build(data, ['N1'], ['population'])
+    means = cube.weighted_mean('N1', 'population', stub=1)
+    assert means.tolist() == [(10 * 100 + 30 * 300) / 400, 50.0]
+    national = cube.weighted_mean('N1', 'population', stub=1,
+                                  level='national')
+    assert national == (10 * 100 + 30 * 300 + 50 * 50) / 450
+    with pytest.raises(ValueError):
+        cube.weighted_mean('N1', 'population', level='county')
+
+
+def test_get_is_a_view(data):
+    cube = metric_cube.build(data, ['N1'])
+    assert np.shares_memory(cube.get('N1', stub=1), cube.values)
+
+
+def test_positions(data):
+    cube = metric_cube.build(data, ['N1'])
+    rows = data.dropna(subset=['FIPS'])
+    years, counties, stubs = cube.positions(rows)
+    assert (cube.values[years, counties, stubs, 0] == rows['N1']).all()
+    with pytest.raises(KeyError):
+        cube.positions(pd.DataFrame({'FIPS': ['09001'], 'agi_stub': [1]}))
+
+
+def test_years():
+    data = pd.DataFrame({'FIPS': ['01001'] * 2, 'agi_stub': [1, 1],
+                         'year': [2013, 2014], 'N1': [1.0, 2.0]})
+    cube = metric_cube.build(data, ['N1'], year='year')
+    assert cube.years == (2013, 2014)
+    assert cube.get('N1', stub=1, year=2014).tolist() == [2.0]
+    assert cube.totals('N1').tolist() == [[1.0], [2.0]]
+
+
+def test_duplicate_rows_raise(data):
+    with pytest.raises(ValueError):
+        metric_cube.build(pd.concat([data, data.head(1)]), ['N1'])
+
+
+def test_empty():
+    data = pd.DataFrame({'FIPS': pd.array([], dtype='UInt32'),
+                         'agi_stub': np.array([], dtype=np.int64),
+                         'N1': np.array([], dtype=np.float64)})
+    cube = metric_cube.build(data, ['N1'])
+    assert len(cube) == 0
+    assert cube.state_totals('N1').shape == (0, 0)
+
+
+def test_from_tables_matches_build(data):
+    cube = metric_cube.build(data, ['N1'], ['population'])
+    tables = county_tables.split(data, county_columns=['population'])
+    other = metric_cube.from_tables(tables)
+    assert other.metrics == ['N1']
+    assert other.county_metrics == ['population']
+    np.testing.assert_array_equal(other.keys, cube.keys)
+    np.testing.assert_array_equal(other.values, cube.values)
+    np.testing.assert_array_equal(other.county_values, cube.county_values)
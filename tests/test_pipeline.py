@@ -0,0 +1,52 @@
+"""Tests for pipeline and the analysis pipeline's stage keys."""
+import contextlib
+import io
+
+import analysis
+import pipeline
+import read_irs
+from conftest import YEARS
+
+
+def _double(x):
+    return 2 * x
+
+
+def test_stages_are_cached(tmp_path):
+    calls = []
+
+    def load():
+        calls.append(1)
+        return 21
+
+    stages = [pipeline.Stage('a', load, code=[]),
+              pipeline.Stage('b', _double, inputs=['a'], code=[])]
+    for _ in range(2):
+        results = pipeline.Pipeline(stages, cache_dir=str(tmp_path)).run(
+            ['b'], verbose=False)
+        assert results['b'] == 42
+    assert len(calls) == 1
+
+
+def test_only_requested_stages_are_keyed(synthetic):
+    keys = analysis.build_pipeline().keys(['atlas_data'])
+    assert list(keys) == ['atlas_data']
+
+
+def test_year_files_are_part_of_the_key(synthetic):
+    build = analysis.build_pipeline(years=list(YEARS))
+    before = build.keys(['irs_data'])['irs_data']
+    with open(read_irs.irs_file_path(YEARS[-1]), 'a') as f:
+        f.write('\n')
+    after = build.keys(['irs_data'])['irs_data']
+    assert before != after
+
+
+def test_multi_year_pipeline(synthetic):
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = analysis.build_pipeline(years=list(YEARS)).run(
+            ['mean_median_data', 'county_tables'], verbose=False)
+    data = results['mean_median_data']
+    assert sorted(data['year'].unique()) == list(YEARS)
+    report = data[data['year'] == read_irs.IRS_YEAR]
+    assert len(results['county_tables']) == report['FIPS'].nunique()
@@ -0,0 +1,36 @@
+"""Tests for read_irs."""
+import pandas as pd
+import pytest
+
+import read_irs
+from conftest import YEARS
+
+
+def test_years_give_a_flat_table(synthetic):
+    data = read_irs.get_irs_data(years=YEARS[::-1], processes=1)
+    assert data.columns[:3].tolist() == ['year', 'FIPS', 'agi_stub']
+    assert isinstance(data.index, pd.RangeIndex)
+    assert sorted(data['year'].unique()) == list(YEARS)
+    for year in YEARS:
+        rows = data[data['year'] == year].drop(columns='year')
+        pd.testing.assert_frame_equal(rows.reset_index(drop=True),
+                                      read_irs.process_year(year))
+
+
+@pytest.mark.parametrize('apportion', [False, True])
+def test_chunked_matches_in_memory(synthetic, apportion):
+    year = YEARS[0]
+    # The first chunked read streams the CSV, the second slices the
+    # columnar cache the in-memory read built.
+    streamed = read_irs.process_year(year, apportion, chunksize=50)
+    expected = read_irs.process_year(year, apportion)
+    cached = read_irs.process_year(year, apportion, chunksize=50)
+    pd.testing.assert_frame_equal(streamed, expected, check_dtype=False)
+    pd.testing.assert_frame_equal(cached, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('apportion', [False, True])
+def test_fused_matches_sequential(synthetic, apportion):
+    expected = read_irs.process_year(YEARS[0], apportion)
+    fused = read_irs.process_year(YEARS[0], apportion, fused=True)
+    pd.testing.assert_frame_equal(fused, expected, check_dtype=False)
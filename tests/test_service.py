@@ -0,0 +1,91 @@
+"""Tests for service (through LookupService.handle, without a socket)."""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import key_codec
+import service
+from fipsZipHandler import FipsZipHandler
+
+
+@pytest.fixture
+def lookup(synthetic):
+    fz_obj = FipsZipHandler()
+    fips = key_codec.decode(fz_obj.nameKeys, key_codec.FIPS_WIDTH)
+    table = pd.DataFrame({'FIPS': fips})
+    for i, column in enumerate(service.METRIC_COLUMNS):
+        if column in ('State', 'County'):
+            table[column] = 'x'
+        else:
+            table[column] = np.arange(len(fips)) + i
+    return service.LookupService(fz_obj, table)
+
+
+def _get(lookup, method, path, body=None):
+    body = b'' if body is None else json.dumps(body).encode()
+    status, payload = lookup.handle(method, path, body)
+    return status, json.loads(payload)
+
+
+def test_single_lookups(lookup):
+    fz_obj = lookup.fz
+    zipcode = key_codec.decode(fz_obj.zipKeys[:1], key_codec.ZIP_WIDTH)[0]
+    fips = key_codec.decode(fz_obj.nameKeys[:1], key_codec.FIPS_WIDTH)[0]
+    status, result = _get(lookup, 'GET', '/zip/' + zipcode)
+    assert status == 200 and result['zip'] == zipcode and result['fips']
+    status, result = _get(lookup, 'GET', '/fips/{}/name'.format(fips))
+    assert status == 200 and result['fips'] == fips
+    status, result = _get(lookup, 'GET', '/fips/{}/metrics'.format(fips))
+    assert status == 200
+    assert result['metrics']['median_mean_agi'] == float(
+        len(service.METRIC_COLUMNS) - 1)
+
+
+def test_batches(lookup):
+    fips = key_codec.decode(lookup.fz.nameKeys[:2], key_codec.FIPS_WIDTH)
+    status, result = _get(lookup, 'POST', '/fips/metrics',
+                          {'fips': fips.tolist() + ['99999'],
+                           'columns': ['median_mean_agi']})
+    assert status == 200
+    values = result['median_mean_agi']
+    assert values[2] is None and values[:2] == [
+        len(service.METRIC_COLUMNS) - 1, len(service.METRIC_COLUMNS)]
+    status, result = _get(lookup, 'POST', '/zips', {'zips': ['00000']})
+    assert status == 200 and result == {'fips': [None]}
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/zips', {'zips': '00624'}),
+    ('/zips', {'zips': [624]}),
+    ('/fips/names', {'fips': [None]}),
+    ('/fips/metrics', {'fips': [], 'columns': 'N1'}),
+    ('/zips', ['00624']),
+])
+def test_bad_batches(lookup, path, body):
+    status, result = _get(lookup, 'POST', path, body)
+    assert status == 400 and 'error' in result
+
+
+def test_errors(lookup):
+    assert lookup.handle('POST', '/zips', b'{')[0] == 400
+    assert _get(lookup, 'GET', '/zip/00000')[0] == 404
+    assert _get(lookup, 'GET', '/nowhere')[0] == 404
+    assert _get(lookup, 'PUT', '/zips')[0] == 405
+
+
+def test_unexpected_errors_give_500(lookup, monkeypatch):
+    def fail(zipcode):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(lookup, 'zip_counties', fail)
+    status, result = _get(lookup, 'GET', '/zip/00501')
+    assert status == 500 and 'boom' in result['error']
+
+
+def test_cache(lookup):
+    for _ in range(2):
+        _get(lookup, 'GET', '/zip/00000')
+    cache = _get(lookup, 'GET', '/stats')[1]['cache']
+    assert cache['hits'] == 1 and cache['misses'] == 1
+    assert 0 < cache['bytes'] <= cache['max_bytes']
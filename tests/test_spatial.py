@@ -0,0 +1,82 @@
+"""Tests for spatial."""
+import warnings
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import key_codec
+import spatial
+
+sp = pytest.importorskip('scipy.sparse')
+
+# Four counties on a path: 1001 - 1003 - 1005 - 1007.
+FIPS = np.array([1001, 1003, 1005, 1007], dtype=key_codec.DTYPE)
+
+
+def _path():
+    w = np.zeros((4, 4))
+    for i in range(3):
+        w[i, i + 1] = w[i + 1, i] = 1
+    return sp.csr_matrix(w)
+
+
+def test_adjacency_from_shared_zips():
+    # Zip 2 straddles counties 1001 and 1003; zip 3 is in 1005 only.
+    fz_obj = SimpleNamespace(
+        zipKeys=np.array([1, 2, 3], dtype=key_codec.DTYPE),
+        zipOffsets=np.array([0, 1, 3, 4]),
+        zipFipsCodes=np.array([1001, 1001, 1003, 1005],
+                              dtype=key_codec.DTYPE))
+    w, fips = spatial.adjacency(fz_obj)
+    assert fips.tolist() == [1001, 1003, 1005]
+    assert w.toarray().tolist() == [[0, 1, 0], [1, 0, 0], [0, 0, 0]]
+
+
+def test_moran_by_hand():
+    # z = [-1.5, -0.5, 0.5, 1.5] and its row standardized lag
+    # [-0.5, -0.5, 0.5, 0.5] give I = 4 / 4 * 2 / 5.
+    result = spatial.moran(np.array([1.0, 2.0, 3.0, 4.0]), _path(), FIPS,
+                           permutations=0)
+    assert result['I'] == pytest.approx(0.4)
+    assert result['expected'] == pytest.approx(-1 / 3)
+    assert result['n'] == 4 and result['islands'] == 0
+
+
+def test_moran_drops_missing_values():
+    values = pd.Series([1.0, 2.0, np.nan, 4.0],
+                       index=key_codec.decode(FIPS, key_codec.FIPS_WIDTH))
+    result = spatial.moran(values, _path(), FIPS, permutations=0)
+    # 1007 loses its only neighbour.
+    assert result['n'] == 3 and result['islands'] == 1
+
+
+def test_moran_permutations():
+    values = np.arange(4, dtype=np.float64)
+    first = spatial.moran(values, _path(), FIPS, permutations=150,
+                          processes=1)
+    second = spatial.moran(values, _path(), FIPS, permutations=150,
+                           processes=1)
+    assert 0 < first['p_sim'] <= 1
+    assert first['p_sim'] == second['p_sim']
+
+
+def test_moran_without_neighbours():
+    values = np.array([1.0, np.nan, 3.0, np.nan])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result = spatial.moran(values, _path(), FIPS, permutations=10,
+                               processes=1)
+    assert result['n'] == 2 and result['islands'] == 2
+    assert np.isnan(result['I']) and np.isnan(result['p_sim'])
+
+
+def test_lisa_by_hand():
+    result = spatial.lisa(np.array([1.0, 2.0, 3.0, 4.0]), _path(), FIPS,
+                          permutations=0)
+    assert result.index.tolist() == ['01001', '01003', '01005', '01007']
+    # local I = (n - 1) z lag / (z . z)
+    np.testing.assert_allclose(result['I'], 3 * np.array(
+        [0.75, 0.25, 0.25, 0.75]) / 5)
+    assert result['quadrant'].tolist() == [3, 3, 1, 1]
@@ -0,0 +1,75 @@
+"""Tests for weighted_stats."""
+import numpy as np
+import pandas as pd
+
+import weighted_stats
+
+
+def _data(seed=0, n_groups=50):
+    """IRS-shaped rows: up to 6 agi_stubs per FIPS, some people counts 0."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for fips in rng.permutation(np.arange(1001, 1001 + n_groups)):
+        stubs = np.sort(rng.choice(np.arange(1, 7), rng.integers(1, 7),
+                                   replace=False))
+        for stub in rng.permutation(stubs):
+            rows.append((fips, stub, float(rng.integers(0, 50)),
+                         float(rng.integers(0, 100000))))
+    return pd.DataFrame(rows, columns=['FIPS', 'agi_stub', 'total_people',
+                                       'agi_per_person'])
+
+
+def _median_loop(data):
+    """The per-FIPS loop weighted_quantiles replaced."""
+    medians = {}
+    for name, group in data.groupby('FIPS'):
+        group = group.sort_values(by='agi_stub')
+        c = np.cumsum(group['total_people'].values)
+        medians[name] = group.iloc[np.searchsorted(c, c[-1] / 2)][
+            'agi_per_person']
+    return pd.Series(medians)
+
+
+def test_median_matches_the_loop():
+    data = _data()
+    groups, medians = weighted_stats.weighted_quantiles(
+        data['FIPS'], data['agi_per_person'], data['total_people'], 0.5,
+        order=data['agi_stub'])
+    expected = _median_loop(data)
+    assert groups.tolist() == expected.index.tolist()
+    np.testing.assert_array_equal(medians[:, 0], expected.to_numpy())
+
+
+def test_quantiles_of_equal_weights():
+    groups, quants = weighted_stats.weighted_quantiles(
+        [2, 1, 1, 1, 1], [7.0, 4.0, 1.0, 3.0, 2.0], [1.0] * 5,
+        [0.25, 0.5, 1.0])
+    assert groups.tolist() == [1, 2]
+    assert quants.tolist() == [[1.0, 2.0, 4.0], [7.0, 7.0, 7.0]]
+
+
+def test_mean_and_gini():
+    groups = [1, 1, 2, 2, 3]
+    values = [1.0, 3.0, 5.0, 5.0, 0.0]
+    weights = [1.0, 3.0, 2.0, 1.0, 0.0]
+    _, means = weighted_stats.weighted_mean(groups, values, weights)
+    np.testing.assert_allclose(means[:2], [2.5, 5.0])
+    assert np.isnan(means[2])
+    _, ginis = weighted_stats.gini(groups, values, weights)
+    # Group 1: a quarter of the people hold a tenth of the income.
+    np.testing.assert_allclose(ginis[:2], [0.15, 0.0], atol=1e-12)
+
+
+def test_distribution_features():
+    data = _data(1)
+    features = weighted_stats.distribution_features(data)
+    assert features.columns.tolist() == weighted_stats.feature_columns()
+    assert features.columns.tolist() == [
+        'mean_agi_per_person', 'p10_agi_per_person', 'p50_agi_per_person',
+        'p90_agi_per_person', 'gini_agi_per_person']
+    data = data[data.groupby('FIPS')['total_people'].transform('sum') > 0]
+    features = weighted_stats.distribution_features(data)
+    expected = data.groupby('FIPS').apply(
+        lambda rows: np.average(rows['agi_per_person'],
+                                weights=rows['total_people']))
+    np.testing.assert_allclose(features['mean_agi_per_person'], expected)
@@ -0,0 +1,146 @@
+"""
+Module for weighted distribution statistics computed for many groups
+(e.g. every FIPS code) at once.
+
+All functions take aligned arrays of group labels, values and weights.
+Rows are sorted once by (group, order) and every statistic is then a few
+segmented array operations over the whole table, rather than a Python
+loop over the groups.
+"""
+########################################################################
+# IMPORTS
+
+# Installed packages:
+import numpy as np
+import pandas as pd
+
+########################################################################
+# CONSTANTS
+
+# Quantiles reported by distribution_features.
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+
+########################################################################
+# FUNCTIONS
+
+
+def _segments(groups, values, weights, order=None):
+    """Sort rows by group, then by order (default: values).
+
+    Returns (unique groups, sorted values, sorted weights, segment start
+    indices, segment end indices).
+    """
+    codes, uniques = pd.factorize(np.asarray(groups), sort=True)
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    order = values if order is None else np.asarray(order)
+
+    sort = np.lexsort((order, codes))
+    counts = np.bincount(codes, minlength=len(uniques))
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    return uniques, values[sort], weights[sort], starts, ends
+
+
+def _segment_cumsum(x, starts, ends):
+    """Cumulative sum of x restarting at every segment."""
+    cum = np.cumsum(x)
+    before = np.concatenate(([0.0], cum))[starts]
+    return cum - np.repeat(before, ends - starts)
+
+
+def weighted_quantiles(groups, values, weights, quantiles, order=None):
+    """Weighted quantiles of values within each group.
+
+    The q quantile of a group is the value of the first row (sorted by
+    order, default values) at which the cumulative weight reaches q times
+    the group's total weight.
+
+    Returns (unique groups, array of shape (# groups, # quantiles)).
+    """
+    uniques, values, weights, starts, ends = _segments(groups, values,
+                                                       weights, order)
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=np.float64))
+
+    # Cumulative weight over the whole sorted table is non-decreasing, so
+    # every group's targets can be searched for in one call.
+    cum = np.cumsum(weights)
+    before = np.concatenate(([0.0], cum))
+    totals = before[ends] - before[starts]
+    targets = before[starts, None] + quantiles[None, :] * totals[:, None]
+    ind = np.searchsorted(cum, targets, side='left')
+
+    # Keep each index inside its own group.
+    ind = np.clip(ind, starts[:, None], ends[:, None] - 1)
+    return uniques, values[ind]
+
+
+def weighted_mean(groups, values, weights):
+    """Weighted mean of values within each group.
+
+    Returns (unique groups, array of means).
+    """
+    codes, uniques = pd.factorize(np.asarray(groups), sort=True)
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = (np.bincount(codes, weights=values * weights)
+                 / np.bincount(codes, weights=weights))
+    return uniques, means
+
+
+def gini(groups, values, weights):
+    """Weighted Gini coefficient of values within each group.
+
+    0 means every unit has the same value, values near 1 mean it's
+    concentrated in a few units. Computed from the area under each
+    group's Lorenz curve.
+
+    Returns (unique groups, array of coefficients).
+    """
+    uniques, values, weights, starts, ends = _segments(groups, values,
+                                                       weights)
+    amounts = values * weights
+    cum_amount = _segment_cumsum(amounts, starts, ends)
+    previous = cum_amount - amounts
+
+    segment = np.repeat(np.arange(len(uniques)), ends - starts)
+    total_weight = np.bincount(segment, weights=weights,
+                               minlength=len(uniques))
+    total_amount = np.bincount(segment, weights=amounts,
+                               minlength=len(uniques))
+    area = np.bincount(segment, weights=weights * (previous + cum_amount),
+                       minlength=len(uniques))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return uniques, 1 - area / (total_weight * total_amount)
+
+
+def feature_columns(quantiles=DEFAULT_QUANTILES, value='agi_per_person'):
+    """Columns of distribution_features(data, quantiles, value=value)."""
+    return (['mean_' + value]
+            + ['p{:g}_'.format(100 * q) + value for q in quantiles]
+            + ['gini_' + value])
+
+
+def distribution_features(data, quantiles=DEFAULT_QUANTILES,
+                          group='FIPS', value='agi_per_person',
+                          weight='total_people'):
+    """Per-FIPS income distribution features from the aggregated IRS data.
+
+    Uses the (FIPS, agi_stub, total_people, agi_per_person) table, i.e.
+    each agi_stub's people are treated as earning that stub's mean
+    income. Returns a DataFrame indexed by FIPS with the weighted mean,
+    the requested weighted quantiles ('p10_agi_per_person', ...) and the
+    Gini coefficient of agi_per_person.
+    """
+    groups = data[group].to_numpy()
+    values = data[value].to_numpy()
+    weights = data[weight].to_numpy()
+
+    columns = feature_columns(quantiles, value)
+    uniques, means = weighted_mean(groups, values, weights)
+    _, quants = weighted_quantiles(groups, values, weights, quantiles)
+    _, ginis = gini(groups, values, weights)
+    return pd.DataFrame(np.column_stack([means, quants, ginis]),
+                        index=pd.Index(uniques, name=group),
+                        columns=columns)